@@ -0,0 +1,218 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+# llm_server endpoint of each analysis, and whether it streams by default
+ENDPOINTS = {
+    "hb": ("/hb-analyze/", True),
+    "hrv": ("/hrv-analyze/", True),
+    "stress": ("/stress-analyze/", True),
+    "overall": ("/overall-analyze/", False),
+}
+
+
+def random_payload(name, rng):
+    """Inputs of one analysis, drawn at random so the answers are not served from the LLM cache."""
+    payload = {"week": int(rng.integers(4, 41))}
+    if name == "hb":
+        payload["bpms"] = round(float(rng.uniform(60, 110)), 2)
+    if name == "hrv":
+        payload.update(sdnn=round(float(rng.uniform(20, 80)), 2), rmssd=round(float(rng.uniform(15, 70)), 2),
+                       pnn50=round(float(rng.uniform(0, 40)), 2))
+    if name == "stress":
+        payload["stress_level"] = round(float(rng.uniform(0, 100)), 2)
+    if name == "overall":
+        payload.update(bpms=round(float(rng.uniform(60, 110)), 2), sdnn=round(float(rng.uniform(20, 80)), 2),
+                       rmssd=round(float(rng.uniform(15, 70)), 2), pnn50=round(float(rng.uniform(0, 40)), 2),
+                       stress_level=round(float(rng.uniform(0, 100)), 2),
+                       history_result=f"Average heart rate {rng.uniform(65, 95):.0f} bpm over the last sessions")
+    return payload
+
+
+async def timed_request(client, name, payload, stream):
+    """
+    Send one analysis request and read the whole answer.
+
+    Returns:
+        dict: endpoint, status (None on a transport error, "sse_error" for a stream of
+        server-sent events that ends with an `error` event), latency and time to the first
+        body byte in seconds, and response size.
+    """
+    path = ENDPOINTS[name][0]
+    start = time.perf_counter()
+    first_byte = None
+    body = bytearray()
+    try:
+        async with client.stream("POST", path, json={**payload, "stream": stream}) as response:
+            async for chunk in response.aiter_bytes():
+                if first_byte is None and chunk:
+                    first_byte = time.perf_counter() - start
+                body += chunk
+            status = response.status_code
+            if (status == 200 and response.headers.get("content-type", "").startswith("text/event-stream")
+                    and b"event: error" in body):
+                status = "sse_error"
+    except Exception as e:
+        return {"endpoint": name, "status": None, "error": type(e).__name__,
+                "latency_s": time.perf_counter() - start, "ttfb_s": first_byte, "bytes": len(body)}
+    return {"endpoint": name, "status": status, "latency_s": time.perf_counter() - start,
+            "ttfb_s": first_byte, "bytes": len(body)}
+
+
+async def run_level(client, rps, duration, endpoints, stream, arrivals, same_inputs, rng):
+    """
+    Open-loop load at `rps` requests/s for `duration` seconds, spread over `endpoints` in
+    turn: requests are started on schedule whether or not the earlier ones are done, so a
+    server that falls behind shows growing latencies instead of a lower request rate.
+    """
+    tasks = []
+    in_flight = {"now": 0, "max": 0}
+    fixed = {name: random_payload(name, rng) for name in endpoints}
+
+    async def send(name):
+        in_flight["now"] += 1
+        in_flight["max"] = max(in_flight["max"], in_flight["now"])
+        try:
+            payload = fixed[name] if same_inputs else random_payload(name, rng)
+            default_stream = ENDPOINTS[name][1]
+            return await timed_request(client, name, payload, default_stream if stream is None else stream)
+        finally:
+            in_flight["now"] -= 1
+
+    start = time.perf_counter()
+    due = 0.0
+    i = 0
+    while due < duration:
+        delay = start + due - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(send(endpoints[i % len(endpoints)])))
+        i += 1
+        due += rng.exponential(1 / rps) if arrivals == "poisson" else 1 / rps
+    results = await asyncio.gather(*tasks)
+    return results, time.perf_counter() - start, in_flight["max"]
+
+
+def percentiles(values):
+    values = [v for v in values if v is not None]
+    if not values:
+        return {"p50": None, "p95": None, "p99": None}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"p50": float(p50), "p95": float(p95), "p99": float(p99)}
+
+
+def summarize(results, wall, offered_rps, max_in_flight):
+    """Latency and time-to-first-byte percentiles of the successful requests, throughput and errors, overall and per endpoint."""
+    def stats(rows):
+        ok = [r for r in rows if r["status"] == 200]
+        errors = {}
+        for r in rows:
+            if r["status"] != 200:
+                key = str(r["status"] or r.get("error"))
+                errors[key] = errors.get(key, 0) + 1
+        return {"requests": len(rows), "ok": len(ok), "error_rate": 1 - len(ok) / len(rows) if rows else 0.0,
+                "errors": errors, "throughput_rps": len(ok) / wall,
+                "latency_s": percentiles([r["latency_s"] for r in ok]),
+                "ttfb_s": percentiles([r["ttfb_s"] for r in ok])}
+
+    by_endpoint = {}
+    for r in results:
+        by_endpoint.setdefault(r["endpoint"], []).append(r)
+    return {"offered_rps": offered_rps, "wall_s": wall, "max_in_flight": max_in_flight, **stats(results),
+            "endpoints": {name: stats(rows) for name, rows in by_endpoint.items()}}
+
+
+async def wait_ready(client, timeout):
+    """Poll `GET /ready` until llm_server has loaded its models."""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            if (await client.get("/ready")).status_code == 200:
+                return
+        except Exception:
+            pass
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"llm_server not ready after {timeout} s")
+        await asyncio.sleep(1)
+
+
+def _ms(value):
+    return f"{value * 1000:8.0f}" if value is not None else f"{'-':>8s}"
+
+
+def print_level(level):
+    print(f"\n{level['offered_rps']:g} req/s offered, {level['throughput_rps']:.2f} req/s answered, "
+          f"{level['error_rate']:.1%} errors {level['errors'] or ''}, at most {level['max_in_flight']} in flight")
+    print(f"{'endpoint':10s} {'requests':>8s} {'errors':>7s} {'p50 ms':>8s} {'p95 ms':>8s} {'p99 ms':>8s}"
+          f" {'ttfb50':>8s} {'ttfb95':>8s} {'ttfb99':>8s}")
+    for name, s in [("all", level), *level["endpoints"].items()]:
+        latency, ttfb = s["latency_s"], s["ttfb_s"]
+        print(f"{name:10s} {s['requests']:8d} {s['requests'] - s['ok']:7d} {_ms(latency['p50'])} {_ms(latency['p95'])}"
+              f" {_ms(latency['p99'])} {_ms(ttfb['p50'])} {_ms(ttfb['p95'])} {_ms(ttfb['p99'])}")
+
+
+async def run(args):
+    import httpx
+
+    limits = httpx.Limits(max_connections=args.connections, max_keepalive_connections=args.connections)
+    rng = np.random.default_rng(args.seed)
+    levels = []
+    async with httpx.AsyncClient(base_url=args.url, timeout=httpx.Timeout(args.timeout, connect=10),
+                                 limits=limits) as client:
+        await wait_ready(client, args.ready_timeout)
+        for rps in args.rps:
+            results, wall, max_in_flight = await run_level(client, rps, args.duration, args.endpoints, args.stream,
+                                                           args.arrivals, args.same_inputs, rng)
+            level = summarize(results, wall, rps, max_in_flight)
+            levels.append(level)
+            print_level(level)
+            if level["error_rate"] > args.max_error_rate or (
+                    args.max_p95 and (level["latency_s"]["p95"] or float("inf")) > args.max_p95):
+                print(f"\nStopping: limit reached at {rps:g} req/s")
+                break
+            await asyncio.sleep(args.pause)
+    return levels
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Open-loop load test of the llm_server analysis endpoints.")
+    parser.add_argument("--url", default="http://127.0.0.1:3001")
+    parser.add_argument("--rps", type=float, nargs="+", default=[1, 2, 5, 10],
+                        help="request rates to run in turn, over all the endpoints")
+    parser.add_argument("--duration", type=float, default=30, help="seconds per rate")
+    parser.add_argument("--endpoints", nargs="+", choices=list(ENDPOINTS), default=list(ENDPOINTS))
+    stream = parser.add_mutually_exclusive_group()
+    stream.add_argument("--stream", dest="stream", action="store_true", default=None,
+                        help="stream every answer (overall as server-sent events)")
+    stream.add_argument("--no-stream", dest="stream", action="store_false", help="ask for complete answers")
+    parser.add_argument("--arrivals", choices=["poisson", "uniform"], default="poisson")
+    parser.add_argument("--same-inputs", action="store_true", help="repeat one payload per endpoint (LLM cache hits)")
+    parser.add_argument("--connections", type=int, default=256)
+    parser.add_argument("--timeout", type=float, default=120, help="seconds per request")
+    parser.add_argument("--ready-timeout", type=float, default=300)
+    parser.add_argument("--pause", type=float, default=2, help="seconds between two rates")
+    parser.add_argument("--max-error-rate", type=float, default=0.05, help="stop the sweep above this error rate")
+    parser.add_argument("--max-p95", type=float, help="stop the sweep above this p95 latency (s)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="result file (default: benchmarks/results/load-<time>.json)")
+    args = parser.parse_args(argv)
+
+    levels = asyncio.run(run(args))
+    report = {"meta": {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "args": vars(args)}, "levels": levels}
+    output = args.output or os.path.join(RESULTS_DIR, "load-" + time.strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"\nSaved to {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
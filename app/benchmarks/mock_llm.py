@@ -0,0 +1,142 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Behaviour of the stand-in, from the environment (or the command line, see `main`)
+MOCK_PARAMS = {
+    'ttft': float(os.getenv('MOCK_LLM_TTFT', '0.5')),                 # seconds before the first token
+    'jitter': float(os.getenv('MOCK_LLM_JITTER', '0.2')),             # +/- share of random variation of the delays
+    'tokens_per_second': float(os.getenv('MOCK_LLM_TOKENS_PER_SECOND', '50')),  # 0: no delay between tokens
+    'output_tokens': int(os.getenv('MOCK_LLM_OUTPUT_TOKENS', '120')),  # length of a plain text answer
+    'error_rate': float(os.getenv('MOCK_LLM_ERROR_RATE', '0')),       # share of requests answered with an error
+    'error_status': int(os.getenv('MOCK_LLM_ERROR_STATUS', '500')),   # e.g. 429 or 503
+    'max_concurrency': int(os.getenv('MOCK_LLM_MAX_CONCURRENCY', '0')),  # answered with 429 beyond (0: no limit)
+}
+
+# Keys of the overall analysis answer (see `overall_analysis_template`)
+OVERALL_KEYS = ("stress_management", "physical_activity", "nutrition", "sleep")
+WORDS = ("keep", "a", "steady", "routine", "with", "light", "walks", "regular", "meals", "and", "rest",
+         "your", "heart", "rate", "is", "within", "the", "usual", "range", "for", "this", "week")
+
+app = FastAPI()
+state = {"in_flight": 0, "requests": 0, "errors": 0, "tokens": 0}
+
+
+def _delay(seconds):
+    jitter = MOCK_PARAMS['jitter']
+    return max(0.0, seconds * (1 + random.uniform(-jitter, jitter)))
+
+
+def answer_tokens(messages):
+    """
+    Tokens of the answer to `messages`: a fenced JSON object with the four suggestions when
+    the prompt asks for them, like the real model, otherwise `output_tokens` words.
+    """
+    prompt = " ".join(str(m.get("content", "")) for m in messages)
+    if "stress_management" in prompt:
+        per_key = max(5, MOCK_PARAMS['output_tokens'] // len(OVERALL_KEYS))
+        tokens = ["```json\n{"]
+        for i, key in enumerate(OVERALL_KEYS):
+            tokens.append(f'{"," if i else ""}\n  "{key}": "')
+            tokens.extend(random.choice(WORDS) + " " for _ in range(per_key))
+            tokens.append('"')
+        tokens.append("\n}\n```")
+        return tokens
+    return [random.choice(WORDS) + " " for _ in range(MOCK_PARAMS['output_tokens'])]
+
+
+def _error(status, message):
+    state["errors"] += 1
+    return JSONResponse({"error": {"message": message, "type": "mock_error", "code": status}}, status_code=status)
+
+
+@app.get("/health")
+def health():
+    return {**state, "params": MOCK_PARAMS}
+
+
+@app.get("/v1/models")
+def models():
+    return {"object": "list", "data": [{"id": "mock", "object": "model", "owned_by": "mock"}]}
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    """OpenAI chat completions, streamed (`"stream": true`) or not, with the delays and errors of MOCK_PARAMS."""
+    body = await request.json()
+    state["requests"] += 1
+    limit = MOCK_PARAMS['max_concurrency']
+    if limit and state["in_flight"] >= limit:
+        return _error(429, "Too many concurrent requests")
+    if random.random() < MOCK_PARAMS['error_rate']:
+        await asyncio.sleep(_delay(MOCK_PARAMS['ttft']))
+        return _error(MOCK_PARAMS['error_status'], "Injected error")
+
+    model = body.get("model") or "mock"
+    tokens = answer_tokens(body.get("messages", []))
+    rate = MOCK_PARAMS['tokens_per_second']
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+    created = int(time.time())
+    usage = {"prompt_tokens": 0, "completion_tokens": len(tokens), "total_tokens": len(tokens)}
+
+    if not body.get("stream"):
+        state["in_flight"] += 1
+        try:
+            await asyncio.sleep(_delay(MOCK_PARAMS['ttft'] + (len(tokens) / rate if rate else 0)))
+        finally:
+            state["in_flight"] -= 1
+        state["tokens"] += len(tokens)
+        return {"id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)},
+                             "finish_reason": "stop"}],
+                "usage": usage}
+
+    def chunk(delta, finish_reason=None, **extra):
+        choices = [] if delta is None else [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+        data = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": choices, **extra}
+        return f"data: {json.dumps(data)}\n\n"
+
+    async def events():
+        state["in_flight"] += 1
+        try:
+            await asyncio.sleep(_delay(MOCK_PARAMS['ttft']))
+            yield chunk({"role": "assistant", "content": ""})
+            for i, token in enumerate(tokens):
+                if i and rate:
+                    await asyncio.sleep(_delay(1 / rate))
+                state["tokens"] += 1
+                yield chunk({"content": token})
+            yield chunk({}, "stop")
+            if (body.get("stream_options") or {}).get("include_usage"):
+                yield chunk(None, usage=usage)
+            yield "data: [DONE]\n\n"
+        finally:
+            state["in_flight"] -= 1
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible stand-in for load tests, fully offline.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    for name, value in MOCK_PARAMS.items():
+        parser.add_argument("--" + name.replace("_", "-"), type=type(value), default=value)
+    args = parser.parse_args(argv)
+    MOCK_PARAMS.update({name: getattr(args, name) for name in MOCK_PARAMS})
+
+    import uvicorn
+
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
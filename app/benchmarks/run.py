@@ -0,0 +1,232 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+
+from benchmarks.synthetic import (synthetic_nni, synthetic_rgb_trace, synthetic_bvp_windows,
+                                  write_synthetic_video)
+from src.data_process_tools import (VHR_PARAMS, vhr_process, vhr_process_trace, bvp_transform,
+                                    hrv_process, summarize_vhr)
+from src.hrv_tools import hrv_metrics, hrv_metrics_batch
+from src.signal_quality import SignalQualityError
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+VIDEOS_DIR = os.path.join(BENCH_DIR, "videos")
+
+
+def current_rss():
+    """Resident memory of this process in bytes (where /proc is missing: its peak so far, from getrusage)."""
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return max_rss if sys.platform == "darwin" else max_rss * 1024  # bytes on macOS, KB on Linux
+
+
+def measure(func, *args, track_memory=True, interval=0.005, **kwargs):
+    """
+    Run `func` once and return (result, wall time in s, peak memory in MB).
+
+    Peak memory is the highest resident memory of the process while `func` runs, sampled
+    every `interval` seconds, above its level before the call. Unlike tracemalloc it sees
+    native allocations (OpenCV, MediaPipe, decoders), but not the separate processes of
+    VHR_SEGMENT_WORKERS.
+    """
+    gc.collect()
+    peak, stop, sampler = None, threading.Event(), None
+    if track_memory:
+        baseline = peak = current_rss()
+
+        def sample():
+            nonlocal peak
+            while not stop.wait(interval):
+                peak = max(peak, current_rss())
+
+        sampler = threading.Thread(target=sample, daemon=True)
+        sampler.start()
+    start = time.perf_counter()
+    try:
+        result = func(*args, **kwargs)
+    finally:
+        wall = time.perf_counter() - start
+        if sampler is not None:
+            stop.set()
+            sampler.join()
+            peak = (max(peak, current_rss()) - baseline) / 2 ** 20
+    return result, wall, peak
+
+
+def truth_of(nni, duration):
+    """Ground-truth metrics of the beats that fall inside the first `duration` seconds."""
+    nni = nni[np.cumsum(nni) <= duration * 1000]
+    metrics = hrv_metrics(nni)
+    return {"bpm": 60000.0 / metrics["nni_mean"], "sdnn": metrics["sdnn"],
+            "rmssd": metrics["rmssd"], "pnn50": metrics["pnn50"], "n_beats": len(nni)}
+
+
+def hrv_errors(nni_est, truth):
+    est = hrv_metrics(nni_est)
+    return {"sdnn_err": abs(est["sdnn"] - truth["sdnn"]), "rmssd_err": abs(est["rmssd"] - truth["rmssd"]),
+            "n_beats_err": abs(len(nni_est) - truth["n_beats"])}
+
+
+def error_of(value, truth):
+    """Absolute error, None when the pipeline could not compute the value."""
+    return None if value is None else abs(value - truth)
+
+
+def bench_signal_stages(cases, fps_list, durations, seed, track_memory):
+    for fps in fps_list:
+        for duration in durations:
+            nni = synthetic_nni(duration + 10, seed=seed)
+            truth = truth_of(nni, duration)
+
+            bvps, timesES = synthetic_bvp_windows(nni, fps, duration, winsize=VHR_PARAMS['winsize'], seed=seed)
+            nni_est, wall, peak = measure(bvp_transform, bvps, timesES, track_memory=track_memory)
+            cases.append({"name": f"bvp_transform/{fps}fps/{duration}s", "wall_s": wall, "peak_mb": peak,
+                          "throughput_fps": fps * duration / wall, **hrv_errors(nni_est, truth)})
+
+            sig = synthetic_rgb_trace(nni, fps, duration, seed=seed)
+            (_, _, bpmES), wall, peak = measure(vhr_process_trace, sig, fps, track_memory=track_memory)
+            bpm = float(np.mean([item.tolist() for item in bpmES]))
+            cases.append({"name": f"vhr_process_trace/{fps}fps/{duration}s", "wall_s": wall, "peak_mb": peak,
+                          "throughput_fps": len(sig) / wall, "bpm_err": abs(bpm - truth["bpm"])})
+
+    for duration in durations:
+        nni = synthetic_nni(duration, seed=seed)
+        for backend in ("numpy", "pyhrv"):
+            try:
+                result, wall, peak = measure(hrv_process, nni, backend=backend, track_memory=track_memory)
+            except ImportError:
+                continue
+            cases.append({"name": f"hrv_process/{backend}/{duration}s", "wall_s": wall, "peak_mb": peak,
+                          "sdnn_err": abs(float(result["sdnn"]) - hrv_metrics(nni)["sdnn"])})
+
+    batch = [synthetic_nni(300, seed=seed + i) for i in range(1000)]
+    _, wall, peak = measure(hrv_metrics_batch, batch, track_memory=track_memory)
+    cases.append({"name": "hrv_metrics_batch/1000x300s", "wall_s": wall, "peak_mb": peak})
+
+
+def bench_videos(cases, heights, fps_list, durations, seed, face_image, track_memory):
+    for height in heights:
+        for fps in fps_list:
+            for duration in durations:
+                nni = synthetic_nni(duration + 10, seed=seed)
+                truth = truth_of(nni, duration)
+                path = os.path.join(VIDEOS_DIR, f"face_{height}p_{fps}fps_{duration}s_seed{seed}.avi")
+                if not os.path.exists(path):
+                    write_synthetic_video(path, height, fps, duration, nni, face_image=face_image, seed=seed)
+                n_frames = int(duration * fps)
+                name = f"video/{height}p/{fps}fps/{duration}s"
+
+                try:
+                    (bvps, timesES, bpmES), vhr_wall, vhr_peak = measure(vhr_process, path,
+                                                                         track_memory=track_memory)
+                except SignalQualityError as e:
+                    # e.g. no face detected in the drawn face: record it and go on with the other videos
+                    cases.append({"name": f"{name}/vhr_process", "error": str(e)})
+                    continue
+                nni_est, bvp_wall, _ = measure(bvp_transform, bvps, timesES, track_memory=False)
+                _, hrv_wall, _ = measure(hrv_process, nni_est, track_memory=False)
+                result, total_wall, _ = measure(summarize_vhr, bvps, timesES, bpmES, track_memory=False)
+
+                cases.append({"name": f"{name}/vhr_process", "wall_s": vhr_wall, "peak_mb": vhr_peak,
+                              "throughput_fps": n_frames / vhr_wall})
+                cases.append({"name": f"{name}/bvp_transform", "wall_s": bvp_wall})
+                cases.append({"name": f"{name}/hrv_process", "wall_s": hrv_wall})
+                cases.append({"name": f"{name}/overall", "wall_s": vhr_wall + total_wall, "peak_mb": vhr_peak,
+                              "throughput_fps": n_frames / (vhr_wall + total_wall),
+                              "bpm_err": error_of(result["bpms"], truth["bpm"]),
+                              "sdnn_err": error_of(result["sdnn"], truth["sdnn"]),
+                              "rmssd_err": error_of(result["rmssd"], truth["rmssd"])})
+
+
+def run_metadata():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, cwd=BENCH_DIR).stdout.strip()
+    except OSError:
+        commit = None
+    return {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "commit": commit, "python": platform.python_version(),
+            "numpy": np.__version__, "machine": platform.machine(), "cpu_count": os.cpu_count(),
+            "vhr_params": VHR_PARAMS}
+
+
+def compare(current, baseline, tolerance):
+    """Print time ratios against a previous run; returns the names of the regressed cases."""
+    previous = {case["name"]: case for case in baseline["cases"]}
+    regressions = []
+    print(f"\n{'case':55s} {'before':>10s} {'after':>10s} {'ratio':>7s}")
+    for case in current["cases"]:
+        before = previous.get(case["name"])
+        if before is None or "wall_s" not in before or "wall_s" not in case:
+            continue
+        ratio = case["wall_s"] / before["wall_s"] if before["wall_s"] else float("inf")
+        flag = "  REGRESSION" if ratio > tolerance else ""
+        print(f"{case['name']:55s} {before['wall_s']:10.4f} {case['wall_s']:10.4f} {ratio:7.2f}{flag}")
+        if flag:
+            regressions.append(case["name"])
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the video → HRV pipeline on synthetic data.")
+    parser.add_argument("--heights", type=int, nargs="+", default=[360, 720, 1080])
+    parser.add_argument("--fps", type=int, nargs="+", default=[30, 60])
+    parser.add_argument("--durations", type=int, nargs="+", default=[10, 30])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--face-image", help="local face photo to modulate instead of the drawn face")
+    parser.add_argument("--skip-videos", action="store_true", help="only benchmark the signal stages")
+    parser.add_argument("--gpu", action="store_true", help="keep the CUDA settings of VHR_PARAMS")
+    parser.add_argument("--no-memory", action="store_true", help="do not sample peak memory")
+    parser.add_argument("--output", help="result file (default: benchmarks/results/<time>.json)")
+    parser.add_argument("--compare", help="previous result file to compare with")
+    parser.add_argument("--tolerance", type=float, default=1.2, help="time ratio reported as a regression")
+    args = parser.parse_args(argv)
+
+    if not args.gpu:
+        VHR_PARAMS.update(method='cpu_CHROM', cuda=False)
+
+    track_memory = not args.no_memory
+    cases = []
+    bench_signal_stages(cases, args.fps, args.durations, args.seed, track_memory)
+    if not args.skip_videos:
+        bench_videos(cases, args.heights, args.fps, args.durations, args.seed, args.face_image, track_memory)
+
+    report = {"meta": run_metadata(), "cases": cases}
+    output = args.output or os.path.join(RESULTS_DIR, time.strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(report, file, indent=2, default=float)
+
+    print(f"\n{'case':55s} {'wall_s':>10s} {'peak_mb':>9s} {'fps':>9s}  accuracy")
+    for case in cases:
+        accuracy = ", ".join(f"{k}={v:.2f}" if v is not None else f"{k}=-" for k, v in case.items()
+                             if k.endswith("_err"))
+        wall = f"{case['wall_s']:10.4f}" if "wall_s" in case else f"{'-':>10s}"
+        peak = f"{case['peak_mb']:9.1f}" if case.get("peak_mb") is not None else f"{'-':>9s}"
+        throughput = f"{case['throughput_fps']:9.1f}" if "throughput_fps" in case else f"{'-':>9s}"
+        print(f"{case['name']:55s} {wall} {peak} {throughput}  {case.get('error', accuracy)}")
+    print(f"\nSaved to {output}")
+
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(report, json.load(file), args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) over {args.tolerance}x")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,157 @@
+import os
+
+import cv2
+import numpy as np
+
+# Relative strength of the pulse in the B, G, R channels of skin (green carries most of it)
+PULSE_BGR = np.array([0.53, 0.77, 0.33])
+SKIN_BGR = np.array([120.0, 150.0, 200.0])
+
+
+def synthetic_nni(duration, mean_hr=75.0, sdnn=40.0, rsa_hz=0.25, seed=0):
+    """
+    NN intervals (ms) covering `duration` seconds, with respiratory sinus arrhythmia and noise.
+
+    Parameters:
+        duration (float): Seconds to cover.
+        mean_hr (float): Mean heart rate in BPM.
+        sdnn (float): Approximate standard deviation of the NN intervals in ms.
+        rsa_hz (float): Breathing frequency modulating the intervals.
+
+    Returns:
+        numpy.ndarray: NN intervals in ms.
+    """
+    rng = np.random.default_rng(seed)
+    mean_nni = 60000.0 / mean_hr
+    nni, t = [], 0.0
+    while t < duration * 1000:
+        value = mean_nni + 0.7 * sdnn * np.sin(2 * np.pi * rsa_hz * t / 1000) + 0.7 * sdnn * rng.standard_normal()
+        nni.append(float(np.clip(value, 350, 1500)))
+        t += nni[-1]
+    return np.array(nni)
+
+
+def pulse_wave(nni, fps, n_samples):
+    """
+    PPG-like waveform sampled at `fps`: a systolic peak and a smaller dicrotic wave per beat.
+
+    Returns:
+        tuple: (wave, beat_times), wave normalized to [-1, 1] and beat times in seconds.
+    """
+    beat_times = np.cumsum(nni) / 1000.0
+    t = np.arange(n_samples) / fps
+    wave = np.zeros(n_samples)
+    for beat in beat_times[beat_times < t[-1] + 1]:
+        wave += np.exp(-0.5 * ((t - beat) / 0.08) ** 2)
+        wave += 0.4 * np.exp(-0.5 * ((t - beat - 0.3) / 0.1) ** 2)
+    wave = 2 * (wave - wave.min()) / (np.ptp(wave) or 1) - 1
+    return wave, beat_times
+
+
+def synthetic_rgb_trace(nni, fps, duration, amplitude=0.01, noise=0.002, seed=0):
+    """
+    Skin RGB trace shaped like `FaceSkinExtractor` output, shape (n_frames, 1, 3), in RGB order.
+    """
+    rng = np.random.default_rng(seed)
+    n_frames = int(duration * fps)
+    wave, _ = pulse_wave(nni, fps, n_frames)
+    bgr = SKIN_BGR * (1 + amplitude * wave[:, None] * PULSE_BGR + noise * rng.standard_normal((n_frames, 3)))
+    return bgr[:, None, ::-1].astype(np.float32)
+
+
+def synthetic_bvp_windows(nni, fps, duration, winsize=6, stride=1, noise=0.05, seed=0):
+    """
+    BVP windows laid out like pyVHR's output for `bvp_transform`.
+
+    Returns:
+        tuple: (bvps, timesES), bvps of shape (n_windows, 1, winsize * fps) with a different
+        gain per window, and the window centres in seconds.
+    """
+    rng = np.random.default_rng(seed)
+    n_samples = int(duration * fps)
+    wave, _ = pulse_wave(nni, fps, n_samples)
+    window_length = int(winsize * fps)
+    n_windows = int((n_samples - window_length) / (stride * fps)) + 1
+    starts = (np.arange(n_windows) * stride * fps).astype(int)
+    bvps = np.stack([wave[s:s + window_length] for s in starts])
+    bvps = bvps * rng.uniform(0.5, 2.0, size=(n_windows, 1)) + noise * rng.standard_normal(bvps.shape)
+    timesES = (winsize / 2 + stride * np.arange(n_windows)).astype(np.float32)
+    return bvps[:, None, :], timesES
+
+
+def draw_face(height, width, skin_bgr):
+    """
+    Draw a frontal face on a neutral background.
+
+    Returns:
+        tuple: (frame, skin_mask), a BGR image and a float mask of the skin pixels.
+    """
+    frame = np.full((height, width, 3), 90, dtype=np.uint8)
+    mask = np.zeros((height, width), dtype=np.uint8)
+    cx, cy = width // 2, height // 2
+    fw, fh = int(height * 0.28), int(height * 0.38)
+    cv2.ellipse(mask, (cx, cy), (fw, fh), 0, 0, 360, 255, -1)
+    cv2.rectangle(mask, (cx - fw // 3, cy + fh - 5), (cx + fw // 3, height), 255, -1)  # neck
+
+    face = np.zeros_like(frame)
+    face[:] = np.clip(skin_bgr, 0, 255).astype(np.uint8)
+    frame[mask > 0] = face[mask > 0]
+
+    unit = max(1, fh // 10)
+    for side in (-1, 1):
+        eye = (cx + side * fw // 2, cy - fh // 5)
+        cv2.ellipse(frame, eye, (2 * unit, unit), 0, 0, 360, (245, 245, 245), -1)
+        cv2.circle(frame, eye, unit, (40, 30, 20), -1)
+        cv2.line(frame, (eye[0] - 2 * unit, eye[1] - 2 * unit), (eye[0] + 2 * unit, eye[1] - 2 * unit),
+                 (30, 40, 60), max(1, unit // 2))
+    cv2.line(frame, (cx, cy - unit), (cx - unit, cy + 2 * unit), (80, 100, 150), max(1, unit // 3))
+    cv2.ellipse(frame, (cx, cy + fh // 2), (3 * unit, unit), 0, 0, 180, (60, 60, 150), max(1, unit // 2))
+
+    skin_mask = (mask > 0).astype(np.float32)
+    for eye_x in (cx - fw // 2, cx + fw // 2):
+        cv2.ellipse(skin_mask, (eye_x, cy - fh // 5), (3 * unit, 3 * unit), 0, 0, 360, 0, -1)
+    return frame, skin_mask
+
+
+def write_synthetic_video(path, height, fps, duration, nni, face_image=None, amplitude=0.01,
+                          noise=1.0, seed=0):
+    """
+    Write a video of a face whose skin color follows the pulse given by `nni`.
+
+    Parameters:
+        path (str): Output file (.avi); lossless FFV1 is used when available, MJPG otherwise.
+        height (int): Frame height; width is 4/3 of it.
+        face_image (str, optional): Photo to use instead of the drawn face; the whole image
+            is modulated and resized to the frame size.
+        amplitude (float): Relative pulse amplitude on the skin.
+        noise (float): Standard deviation of the per-pixel sensor noise, in gray levels.
+
+    Returns:
+        int: Number of frames written.
+    """
+    rng = np.random.default_rng(seed)
+    width = int(round(height * 4 / 3 / 2)) * 2
+    n_frames = int(duration * fps)
+    wave, _ = pulse_wave(nni, fps, n_frames)
+
+    if face_image:
+        base = cv2.resize(cv2.imread(face_image), (width, height)).astype(np.float32)
+        skin_mask = np.ones((height, width), dtype=np.float32)
+    else:
+        base, skin_mask = draw_face(height, width, SKIN_BGR)
+        base = base.astype(np.float32)
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"FFV1"), fps, (width, height))
+    if not writer.isOpened():
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), fps, (width, height))
+
+    modulation = skin_mask[..., None] * PULSE_BGR
+    try:
+        for i in range(n_frames):
+            frame = base * (1 + amplitude * wave[i] * modulation)
+            frame += noise * rng.standard_normal(frame.shape[:2] + (1,))
+            writer.write(np.clip(frame, 0, 255).astype(np.uint8))
+    finally:
+        writer.release()
+    return n_frames
@@ -1,37 +1,55 @@
 from pyVHR.analysis.pipeline import Pipeline
 import numpy as np
-import pyhrv.time_domain as td
-import statistics
-import time
+import inspect
+import math
+import os
+import threading
 from scipy.signal import find_peaks
+from src.hrv_tools import hrv_metrics, OnlineHRV
+from src.metrics import timed
+from src.signal_quality import QUALITY_PARAMS, monitor_factory
+from src.vhr_stages import (FaceSkinExtractor, extract_trace_from_file, extract_trace_parallel, rgb_trace_to_bvp,
+                             warm_up_segments)
 
-import time
-import functools
 import json
 import orjson
 
 
-def execution_timer(func):
-    """
-    Decorator to measure and log the execution time of a function.
-
-    Parameters:
-        func (function): The function to be wrapped.
-
-    Returns:
-        function: Wrapped function with execution time measurement.
-    """
-    @functools.wraps(func)
-    def wrapper(*args, **kwargs):
-        start_time = time.perf_counter()  # Start timer
-        result = func(*args, **kwargs)    # Execute function
-        end_time = time.perf_counter()    # End timer
-        execution_time = end_time - start_time  # Calculate elapsed time
-
-        print(f"Function '{func.__name__}' executed in {execution_time:.4f} seconds.")
-        return result
-
-    return wrapper
+# Bump when the processing code changes its output, so cached results are not reused
+PROCESS_VERSION = 2
+
+# Parameters of the pyVHR pipeline, shared by every entry point
+VHR_PARAMS = {
+    'winsize': 6,                  # window size in seconds
+    'roi_method': 'convexhull',
+    'roi_approach': 'holistic',    # use holistic approach instead of patches
+    'method': 'cupy_CHROM',        # one of the methods implemented in pyVHR
+    'estimate': 'clustering',      # BPM final estimate if patches choose 'medians' or 'clustering'
+    'RGB_LOW_HIGH_TH': (5, 230),
+    'Skin_LOW_HIGH_TH': (5, 230),
+    'pre_filt': True,
+    'post_filt': True,
+    'cuda': True,
+}
+
+# HRV metrics: 'numpy' (built-in kernel) or 'pyhrv' (reference implementation)
+HRV_BACKEND = os.getenv('HRV_BACKEND', 'numpy')
+
+# ROI extraction mode: 'full' detects landmarks on every full-resolution frame; 'fast' downscales
+# frames and tracks landmarks between detections (see `vhr_stages.FaceSkinExtractor`).
+# Frame source: 'chunked' decodes under VHR_FRAME_MEMORY_BYTES and keeps only the skin RGB trace
+# (see `frame_source`); 'pyvhr' lets `Pipeline.run_on_video` read the video (full mode only).
+# Segments > 1 splits a video file across that many processes (see `vhr_stages.extract_trace_parallel`)
+ROI_PARAMS = {
+    'mode': os.getenv('VHR_ROI_MODE', 'full'),
+    'source': os.getenv('VHR_FRAME_SOURCE', 'chunked'),
+    'max_height': int(os.getenv('VHR_ROI_MAX_HEIGHT', '480')),         # working resolution in fast mode
+    'detect_every': int(os.getenv('VHR_ROI_DETECT_EVERY', '5')),        # landmark detection every N frames
+    'motion_threshold': float(os.getenv('VHR_ROI_MOTION_THRESHOLD', '0.02')),
+    'segments': int(os.getenv('VHR_SEGMENT_WORKERS', '1')),
+}
+
+_extractor_local = threading.local()  # per thread (one per worker process): FaceSkinExtractor by parameters
 
 
 def adaptive_peak_detection(signal, fs=30):
@@ -40,18 +58,14 @@ def adaptive_peak_detection(signal, fs=30):
     
     Parameters:
         signal (numpy.ndarray): The input BVP signal.
-        fs (int, optional): Sampling frequency of the signal (default is 30 Hz).
+        fs (float, optional): Sampling frequency of the signal (default is 30 Hz).
     
     Returns:
         numpy.ndarray: Indices of detected peaks in the signal.
     """
-    # 基于信号统计的动态参数
-    abs_signal = np.abs(signal)
-    height_th = np.percentile(abs_signal, 75)  # 取75%分位数作为高度阈值
-
     # 根据心率范围计算distance
     max_bpm = 180
-    min_distance = int(fs * 60 / max_bpm)  # 180 BPM → 10 samples
+    min_distance = max(1, int(fs * 60 / max_bpm))  # 180 BPM → 10 samples at 30 Hz
 
     peaks, _ = find_peaks(
         signal,
@@ -60,13 +74,35 @@ def adaptive_peak_detection(signal, fs=30):
     return peaks
 
 
-@execution_timer
-def vhr_process(videoFileName='data/vid.avi'):
+@timed("warm_up")
+def warm_up_pipeline():
+    """
+    Build a pyVHR pipeline and pay its one-off costs up front (CUDA context, CuPy kernel
+    compilation of the rPPG method and the BVP filter, face mesh of the ROI step), so the
+    first real video does not.
+
+    Returns:
+        Pipeline: Initialized pipeline to be reused across calls of `vhr_process`.
+    """
+    pipe = Pipeline()
+    fps = 30
+    dummy_sig = np.random.uniform(50, 200, size=(2 * VHR_PARAMS['winsize'] * fps, 1, 3))
+    vhr_process_trace(dummy_sig, fps)
+    if ROI_PARAMS['segments'] > 1:
+        warm_up_segments(ROI_PARAMS['segments'])
+    elif ROI_PARAMS['mode'] == 'fast' or ROI_PARAMS['source'] == 'chunked':
+        skin_extractor()
+    return pipe
+
+
+def vhr_process(videoFileName='data/vid.avi', pipe=None):
     """
     Process a video file to extract BVP (Blood Volume Pulse) signals and estimated heart rate.
 
     Parameters:
         videoFileName (str, optional): Path to the input video file (default: '../data/vid.avi').
+        pipe (Pipeline, optional): Already initialized pipeline to reuse with the 'pyvhr'
+            frame source (default: a new one).
 
     Returns:
         tuple: (bvps, timesES, bpmES)
@@ -74,75 +110,158 @@ def vhr_process(videoFileName='data/vid.avi'):
             - timesES (numpy.ndarray): Time series of BVP extraction.
             - bpmES (numpy.ndarray): Estimated BPM values.
     """
-    wsize = 6                  # window size in seconds
-    roi_approach = 'holistic'  # use holistic approach instead of patches
-    bpm_est = 'clustering'     # BPM final estimate if patches choose 'medians' or 'clustering'
-    method = 'cupy_CHROM'       # one of the methods implemented in pyVHR
+    if ROI_PARAMS['segments'] > 1 and (ROI_PARAMS['mode'] == 'fast' or ROI_PARAMS['source'] == 'chunked'):
+        sig, fps = extract_trace_parallel(videoFileName, skin_extractor_params(), ROI_PARAMS['segments'])
+        quality = signal_quality_monitor()
+        if quality:
+            # segments run at once, so the gates only apply afterwards (same trace as a serial run)
+            sig = quality(fps).apply(sig)
+        return vhr_process_trace(sig, fps)
+    if ROI_PARAMS['mode'] == 'fast' or ROI_PARAMS['source'] == 'chunked':
+        sig, fps = extract_trace_from_file(videoFileName, skin_extractor(), quality=signal_quality_monitor())
+        return vhr_process_trace(sig, fps)
 
     # run
-    pipe = Pipeline()          # object to execute the pipeline
-    bvps, timesES, bpmES = pipe.run_on_video(videoFileName,
-                                            winsize=wsize,
-                                            roi_method='convexhull',
-                                            roi_approach=roi_approach,
-                                            method=method,
-                                            estimate=bpm_est,
-                                            RGB_LOW_HIGH_TH=(5,230),
-                                            Skin_LOW_HIGH_TH=(5,230),
-                                            pre_filt=True,
-                                            post_filt=True,
-                                            cuda=True,
-                                            verb=True)
+    if pipe is None:
+        pipe = Pipeline()      # object to execute the pipeline
+    with timed("vhr_pipeline"):  # decode, ROI and CHROM in one pyVHR call
+        bvps, timesES, bpmES = pipe.run_on_video(videoFileName, verb=True, **VHR_PARAMS)
 
     return bvps, timesES, bpmES
 
 
-@execution_timer
-def bvp_transform(bvps):
+def skin_extractor_params():
+    """
+    Keyword arguments of `vhr_stages.FaceSkinExtractor` matching VHR_PARAMS and ROI_PARAMS.
+    """
+    params = {
+        'skin_th': VHR_PARAMS['Skin_LOW_HIGH_TH'],
+        'device': 'GPU' if VHR_PARAMS['cuda'] else 'CPU',
+    }
+    if ROI_PARAMS['mode'] == 'fast':
+        params.update(max_height=ROI_PARAMS['max_height'],
+                      detect_every=ROI_PARAMS['detect_every'],
+                      motion_threshold=ROI_PARAMS['motion_threshold'])
+    return params
+
+
+def skin_extractor():
+    """
+    The `vhr_stages.FaceSkinExtractor` of this thread for `skin_extractor_params()`, built on
+    first use (or by `warm_up_pipeline`) and kept for the next videos, reset for a new one.
+    """
+    if not hasattr(_extractor_local, "extractors"):
+        _extractor_local.extractors = {}
+    params = skin_extractor_params()
+    key = tuple(sorted(params.items()))
+    extractor = _extractor_local.extractors.get(key)
+    if extractor is None:
+        extractor = _extractor_local.extractors[key] = FaceSkinExtractor(**params)
+    extractor.reset()
+    return extractor
+
+
+def signal_quality_monitor():
+    """Factory of the signal-quality gates of QUALITY_PARAMS for the VHR_PARAMS window (None when off)."""
+    return monitor_factory(VHR_PARAMS['winsize'], QUALITY_PARAMS)
+
+
+def vhr_process_trace(sig, fps, pipe=None):
+    """
+    Same as `vhr_process`, but starting from an already extracted skin RGB trace.
+
+    Parameters:
+        sig (numpy.ndarray): Skin RGB trace, shape (n_frames, 1, 3) (see `vhr_stages.FaceSkinExtractor`).
+        fps (float): Frame rate of the video the trace comes from.
+        pipe (Pipeline, optional): Unused, accepted so the worker pool can run it like `vhr_process`.
+
+    Returns:
+        tuple: (bvps, timesES, bpmES)
+    """
+    return rgb_trace_to_bvp(sig, fps,
+                            winsize=VHR_PARAMS['winsize'],
+                            method=VHR_PARAMS['method'],
+                            pre_filt=VHR_PARAMS['pre_filt'],
+                            post_filt=VHR_PARAMS['post_filt'],
+                            cuda=VHR_PARAMS['cuda'])
+
+
+def stitch_bvp_windows(bvps, timesES, fps=None):
+    """
+    Rebuild one continuous BVP signal from pyVHR's overlapping windows.
+
+    pyVHR windows are `winsize` seconds long and start every `timesES[i] - timesES[0]`
+    seconds (`timesES` holds the window centres). Each window is standardized, tapered and
+    overlap-added at its start sample in a single vectorized pass.
+
+    Parameters:
+        bvps (numpy.ndarray): Windowed BVP signals, shape (n_windows, 1, window_length).
+        timesES (numpy.ndarray): Window centres in seconds.
+        fps (float, optional): Sampling frequency (default: derived from the window length,
+            since the first centre is `winsize / 2`).
+
+    Returns:
+        tuple: (signal, fps)
+    """
+    windows = np.squeeze(np.asarray(bvps, dtype=np.float64), axis=1)
+    n_windows, window_length = windows.shape
+    timesES = np.asarray(timesES, dtype=np.float64)[:n_windows]
+    if fps is None:
+        fps = window_length / (2 * timesES[0])
+
+    windows = windows - windows.mean(axis=1, keepdims=True)
+    std = windows.std(axis=1, keepdims=True)
+    windows /= np.where(std > 0, std, 1)
+
+    taper = np.hanning(window_length + 2)[1:-1]  # strictly positive, so every sample keeps a weight
+    starts = np.floor((timesES - timesES[0]) * fps + 1e-6).astype(np.int64)
+    idx = (starts[:, None] + np.arange(window_length)).ravel()
+    length = starts[-1] + window_length
+    signal = np.bincount(idx, weights=(windows * taper).ravel(), minlength=length)
+    weight = np.bincount(idx, weights=np.broadcast_to(taper, windows.shape).ravel(), minlength=length)
+    return signal / weight, fps
+
+
+@timed("peak_detection")
+def bvp_transform(bvps, timesES, fps=None):
     """
     Transform raw BVP signals into a sequence of NN intervals for HRV analysis.
 
     Parameters:
-        bvps (numpy.ndarray): Extracted BVP signals.
+        bvps (numpy.ndarray): Extracted BVP signals, shape (n_windows, 1, window_length).
+        timesES (numpy.ndarray): Window centres in seconds, as returned with `bvps`.
+        fps (float, optional): Sampling frequency (default: derived from `bvps` and `timesES`).
 
     Returns:
-        numpy.ndarray: Sequence of NN intervals (differences between detected peak times).
-    """
-    bvps_squeezed = np.squeeze(bvps, axis=1)
-    stdev, mean = statistics.stdev(bvps_squeezed.flatten()), statistics.mean(bvps_squeezed.flatten())
-    # 动态设置高度阈值（例如：基于信号幅度的统计）
-    abs_heights = np.abs(bvps_squeezed)
-    height_th = np.median(abs_heights) + 0.5 * np.std(abs_heights)  # 中位数+0.5倍标准差
-    non_overlap_idx = round(bvps_squeezed.shape[1] / 6 * 5)
-
-    all_peaks = [adaptive_peak_detection(sig) for sig in bvps_squeezed]
-
-    # get peak milisecond time
-    peak_miliseconds = []
-    interval = bvps_squeezed.shape[1] - non_overlap_idx
-
-    for row in range(len(all_peaks)):
-        for idx in all_peaks[row]:
-            if row == 0 or idx >= non_overlap_idx:
-                milisecond = round((idx + interval * row)/3 * 100, 2)
-                peak_miliseconds.append(milisecond)
-    
+        numpy.ndarray: Sequence of NN intervals in ms (differences between detected peak times).
+    """
+    signal, fps = stitch_bvp_windows(bvps, timesES, fps)
+    peaks = adaptive_peak_detection(signal, fs=fps)
+
     # calc diff between peaks
-    nni_seq = np.diff(peak_miliseconds)
+    nni_seq = np.diff(peaks) * (1000.0 / fps)
     return nni_seq
 
 
-@execution_timer
-def hrv_process(nni_seq, histogram_path='data/nni_histogram.png'):
+@timed("hrv")
+def hrv_process(nni_seq, histogram_path='data/nni_histogram.png', backend=None):
     """
     Compute heart rate variability (HRV) metrics from NN intervals.
 
     Parameters:
         nni_seq (numpy.ndarray): Sequence of NN intervals.
+        backend (str, optional): 'numpy' for the built-in kernel (SDNN, RMSSD, pNN50, mean HR...)
+            or 'pyhrv' for every pyhrv time-domain parameter, kept as a reference
+            (default: the HRV_BACKEND environment variable, 'numpy' if unset).
 
     Returns:
         dict: Dictionary containing HRV time-domain metrics.
     """
+    if (backend or HRV_BACKEND) == 'numpy':
+        return hrv_metrics(nni_seq)
+
+    import pyhrv.time_domain as td  # pulls in matplotlib, only for the reference mode
+
     results = td.time_domain(nni=nni_seq)
     # results['nni_histogram'].savefig(histogram_path)
     result_dict = results.__dict__
@@ -152,6 +271,23 @@ def hrv_process(nni_seq, histogram_path='data/nni_histogram.png'):
     return result_dict
 
 
+def hrv_process_incremental(nni_chunks, window=None):
+    """
+    Compute HRV metrics progressively, as NN intervals arrive.
+
+    Parameters:
+        nni_chunks (iterable): Chunks (or single values) of NN intervals in ms.
+        window (int, optional): Only keep the latest `window` NN intervals (default: all).
+
+    Yields:
+        dict: Metrics after each chunk, with the same keys as `hrv_process`.
+    """
+    accumulator = OnlineHRV(window=window)
+    for chunk in nni_chunks:
+        accumulator.extend(np.atleast_1d(chunk))
+        yield accumulator.result()
+
+
 def convert_np_type(obj):
     if isinstance(obj, (np.int64, np.int32)):  
         return int(obj)  # Convert int64 to Python int
@@ -160,6 +296,14 @@ def convert_np_type(obj):
     return obj
 
 
+def finite_or_none(value):
+    """`value` as a Python number, or None when it is NaN or infinite (not valid JSON)."""
+    value = convert_np_type(value)
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+
 # def remove_useless_data(data):
 #     data.pop('timesES')
 #     data.pop('nni_seq')
@@ -193,13 +337,44 @@ def calculate_stress_level(sdnn, rmssd, pnn50, min_sdnn=20, max_sdnn=500,
     # Ensure the score is within bounds (0-100)
     return np.clip(stress_score, 0, 100)
 
-@execution_timer
-def overall_process(videoFileName='data/vid.avi'):
-    # Step 1: Process video → Extract bvps, timesES, bpmES
-    bvps, timesES, bpmES = vhr_process(videoFileName)
 
+def processing_params():
+    """
+    Every setting that affects the result of a video, used to key cached results.
+
+    Returns:
+        dict: JSON-serializable parameters.
+    """
+    stress_params = {name: param.default
+                     for name, param in inspect.signature(calculate_stress_level).parameters.items()
+                     if param.default is not inspect.Parameter.empty}
+    return {"version": PROCESS_VERSION, "vhr": VHR_PARAMS, "roi": ROI_PARAMS, "hrv": HRV_BACKEND,
+            "stress": stress_params, "quality": QUALITY_PARAMS}
+
+
+def summarize_vhr(bvps, timesES, bpmES, fps=None):
+    """
+    Turn the pyVHR output into the final health data: mean BPM, HRV metrics and stress level.
+    """
+    result = {**summarize_bpm(bpmES), **summarize_hrv(bvps, timesES, fps=fps)}
+    return orjson.loads(orjson.dumps(result, option=orjson.OPT_INDENT_2))
+
+
+def summarize_bpm(bpmES):
+    """Mean BPM, known as soon as pyVHR is done, before the HRV (see `summarize_hrv`)."""
+    bpms_lst = [item.tolist() for item in bpmES]
+    return {"bpms": finite_or_none(sum(bpms_lst) / len(bpms_lst))}
+
+
+def summarize_hrv(bvps, timesES, fps=None):
+    """
+    HRV metrics (SDNN, RMSSD, pNN50) and stress level of the BVP signal.
+
+    Metrics that cannot be computed (fewer than 3 detected peaks) are None, so the result
+    stays valid JSON for the responses, the SSE events and the result cache.
+    """
     # Step 2: Transform bvps → Get NN intervals (nni_seq)
-    nni_seq = bvp_transform(bvps)
+    nni_seq = bvp_transform(bvps, timesES, fps=fps)
 
     # Step 3: Compute HRV results → Return final HRV data
     hrv_results = hrv_process(nni_seq)
@@ -208,23 +383,20 @@ def overall_process(videoFileName='data/vid.avi'):
     for k, v in hrv_results_dict.items():
         hrv_results_dict[k] = convert_np_type(v)
 
-    bpms_lst = [item.tolist() for item in bpmES]
     sdnn = hrv_results_dict['sdnn']
     rmssd = hrv_results_dict['rmssd']
     pnn50 = hrv_results_dict['pnn50']
     stress_lvl = convert_np_type(calculate_stress_level(sdnn, rmssd, pnn50))
     
-    result = {
-        "bpms": sum(bpms_lst) / len(bpms_lst),
-        "sdnn": sdnn,
-        "rmssd": rmssd,
-        "pnn50": pnn50,
-        "stress_level": stress_lvl
+    return {
+        "sdnn": finite_or_none(sdnn),
+        "rmssd": finite_or_none(rmssd),
+        "pnn50": finite_or_none(pnn50),
+        "stress_level": finite_or_none(stress_lvl)
     }
-    return orjson.loads(orjson.dumps(result, option=orjson.OPT_INDENT_2))
 
 if __name__ == "__main__":
-    # temp = overall_process()
+    # temp = summarize_vhr(*vhr_process('data/vid.avi'))
     with open('data/temp_data.json', 'r') as file:
         data = json.load(file)
 
@@ -0,0 +1,123 @@
+import asyncio
+import os
+import queue
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from src import metrics
+
+EMBED_CACHE_ENTRIES = int(os.getenv("EMBED_CACHE_ENTRIES", "4096"))    # query embeddings kept
+EMBED_BATCH_WAIT_MS = float(os.getenv("EMBED_BATCH_WAIT_MS", "5"))     # how long a batch waits for more queries
+EMBED_MAX_BATCH = int(os.getenv("EMBED_MAX_BATCH", "32"))              # queries encoded in one model call
+
+
+def normalize_text(text):
+    """Cache key of a query: surrounding and repeated whitespace does not change its meaning."""
+    return re.sub(r"\s+", " ", str(text)).strip()
+
+
+class EmbeddingService:
+    """
+    Query embeddings with an LRU cache and a micro-batcher.
+
+    Cache misses are put on a queue served by one background thread, which waits up to
+    `batch_wait` seconds for more queries (at most `max_batch`) and encodes them together in
+    a single `embed_documents` call. Callers block on (or, with `aembed`, await) a future,
+    so encoding never runs on the event loop and concurrent requests share model calls.
+
+    Parameters:
+        embeddings (Embeddings): LangChain embeddings model.
+        max_entries (int): Cached query embeddings (0 disables the cache).
+        batch_wait (float): Seconds to wait for more queries once one arrived.
+        max_batch (int): Queries per model call.
+    """
+
+    def __init__(self, embeddings, max_entries=EMBED_CACHE_ENTRIES, batch_wait=EMBED_BATCH_WAIT_MS / 1000,
+                 max_batch=EMBED_MAX_BATCH):
+        self.embeddings = embeddings
+        self.max_entries = max_entries
+        self.batch_wait = batch_wait
+        self.max_batch = max(1, max_batch)
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._pending = {}  # text → future, so a query already waiting is not queued twice
+        self.stats = {"hits": 0, "misses": 0, "batches": 0, "encoded": 0}
+        threading.Thread(target=self._batch_loop, name="embedding-batcher", daemon=True).start()
+
+    def embed(self, text):
+        """Embedding of one query (list of floats), blocking until it is available."""
+        return self.submit(text).result()
+
+    async def aembed(self, text):
+        return await asyncio.wrap_future(self.submit(text))
+
+    def submit(self, text):
+        """Future of the embedding of `text`, already resolved on a cache hit."""
+        key = normalize_text(text)
+        with self._lock:
+            vector = self._cache.get(key)
+            if vector is not None:
+                self._cache.move_to_end(key)
+                self.stats["hits"] += 1
+            else:
+                self.stats["misses"] += 1
+                future = self._pending.get(key)
+                if future is None:
+                    future = self._pending[key] = Future()
+                    self._queue.put(key)
+        metrics.record_cache("embedding", hit=vector is not None)
+        if vector is not None:
+            future = Future()
+            future.set_result(vector)
+        return future
+
+    def info(self):
+        with self._lock:
+            return {**self.stats, "entries": len(self._cache),
+                    "mean_batch": round(self.stats["encoded"] / max(self.stats["batches"], 1), 2)}
+
+    def _batch_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.batch_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._encode(batch)
+
+    def _encode(self, texts):
+        try:
+            with metrics.timed("embedding"):
+                vectors = self._embed_batch(texts)
+        except Exception as e:
+            with self._lock:
+                futures = [self._pending.pop(text) for text in texts]
+            for future in futures:
+                future.set_exception(e)
+            return
+
+        with self._lock:
+            self.stats["batches"] += 1
+            self.stats["encoded"] += len(texts)
+            futures = [self._pending.pop(text) for text in texts]
+            if self.max_entries > 0:
+                for text, vector in zip(texts, vectors):
+                    self._cache[text] = vector
+                while len(self._cache) > self.max_entries:
+                    self._cache.popitem(last=False)
+        for future, vector in zip(futures, vectors):
+            future.set_result(vector)
+
+    def _embed_batch(self, texts):
+        # embed_query may use its own encoding options (e.g. a query prompt); batching is
+        # only equivalent when it does not
+        if getattr(self.embeddings, "query_encode_kwargs", None):
+            return [self.embeddings.embed_query(text) for text in texts]
+        return self.embeddings.embed_documents(texts)
@@ -0,0 +1,158 @@
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+FRAME_MEMORY_BYTES = int(os.getenv("VHR_FRAME_MEMORY_BYTES", str(256 * 1024 * 1024)))  # decoded frames held per job
+TRACE_MEMORY_BYTES = int(os.getenv("VHR_TRACE_MEMORY_BYTES", str(8 * 1024 * 1024)))    # RGB trace kept in RAM
+SCRATCH_DIR = os.getenv("VHR_SCRATCH_DIR") or None                                      # spill directory (default: system temp)
+
+
+def frame_budget(frame_bytes, memory_bytes=FRAME_MEMORY_BYTES):
+    """Number of frames of `frame_bytes` each that fit in `memory_bytes` (at least 1)."""
+    return max(1, int(memory_bytes // max(frame_bytes, 1)))
+
+
+class VideoFrameSource:
+    """
+    Decode a video file lazily, a chunk of frames at a time, under a fixed memory budget.
+
+    Two chunk buffers of `memory_bytes / 2` are allocated once and reused: while the caller
+    works on one chunk, the next one is decoded into the other buffer in a background
+    thread. Frames are downscaled to `max_height` as they are decoded, so the budget holds
+    frames at working resolution.
+
+    Parameters:
+        path (str): Video file.
+        max_height (int, optional): Downscale frames to at most this height.
+        memory_bytes (int): Budget for decoded frames.
+        start (int): First frame to decode.
+        stop (int, optional): Frame to stop before (default: the end of the video).
+    """
+
+    def __init__(self, path, max_height=None, memory_bytes=FRAME_MEMORY_BYTES, start=0, stop=None):
+        self.cap = cv2.VideoCapture(path)
+        if not self.cap.isOpened():
+            raise ValueError(f"Cannot open video: {path}")
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS)
+        self.decode_time = 0.0  # seconds spent decoding, overlapped with the caller's work
+        self.frame_count = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))  # from the container, may be approximate
+        if start:
+            self._seek(start)
+        self.remaining = None if stop is None else max(0, stop - start)
+        width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        if max_height and height > max_height:
+            width, height = round(width * max_height / height), max_height
+        self.max_height = max_height
+        self.frame_shape = (height, width, 3)
+        self.chunk_frames = frame_budget(height * width * 3, memory_bytes / 2)
+        if self.remaining is not None:
+            self.chunk_frames = max(1, min(self.chunk_frames, self.remaining))
+
+    def _seek(self, frame):
+        start = time.perf_counter()
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame)
+        if int(self.cap.get(cv2.CAP_PROP_POS_FRAMES)) != frame:
+            # the container cannot seek to an exact frame: skip frames from the start instead
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            for _ in range(frame):
+                if not self.cap.grab():
+                    break
+        self.decode_time += time.perf_counter() - start
+
+    def _fill(self, buffer):
+        """Decode up to len(buffer) frames (and `remaining`) into `buffer`; returns how many were decoded."""
+        start = time.perf_counter()
+        limit = len(buffer) if self.remaining is None else min(len(buffer), self.remaining)
+        n = 0
+        while n < limit:
+            ok, frame = self.cap.read()
+            if not ok:
+                break
+            if frame.shape != self.frame_shape:
+                frame = cv2.resize(frame, self.frame_shape[1::-1], interpolation=cv2.INTER_AREA)
+            buffer[n] = frame
+            n += 1
+        if self.remaining is not None:
+            self.remaining -= n
+        self.decode_time += time.perf_counter() - start
+        return n
+
+    def chunks(self):
+        """
+        Yield chunks of BGR frames, shape (n, height, width, 3).
+
+        A chunk is overwritten after the next one is requested, copy what must outlive it.
+        """
+        buffers = [np.empty((self.chunk_frames,) + self.frame_shape, dtype=np.uint8) for _ in range(2)]
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="decode") as decoder:
+            current = 0
+            pending = decoder.submit(self._fill, buffers[current])
+            while True:
+                n = pending.result()
+                if n == 0:
+                    break
+                chunk = buffers[current][:n]
+                current ^= 1
+                pending = decoder.submit(self._fill, buffers[current]) if n == self.chunk_frames else None
+                yield chunk
+                if pending is None:
+                    break
+
+    def close(self):
+        self.cap.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class TraceBuffer:
+    """
+    Growable skin RGB trace, shape (n_frames, 1, 3) float32, like `FaceSkinExtractor` outputs.
+
+    Capacity doubles as frames are appended. Past `memory_bytes` the trace moves to a
+    memory-mapped scratch file (unlinked at once, so nothing is left behind), letting the OS
+    page it out instead of growing the process.
+
+    Parameters:
+        memory_bytes (int): Size the trace may take in RAM before spilling.
+        scratch_dir (str, optional): Directory of the scratch file.
+    """
+
+    def __init__(self, memory_bytes=TRACE_MEMORY_BYTES, scratch_dir=SCRATCH_DIR, capacity=1024):
+        self.memory_bytes = memory_bytes
+        self.scratch_dir = scratch_dir
+        self.spilled = False
+        self._data = np.empty((capacity, 1, 3), dtype=np.float32)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def append(self, value):
+        if self._size == len(self._data):
+            self._grow()
+        self._data[self._size] = value
+        self._size += 1
+
+    def _grow(self):
+        shape = (2 * len(self._data), 1, 3)
+        if self.spilled or np.prod(shape) * 4 > self.memory_bytes:
+            with tempfile.TemporaryFile(dir=self.scratch_dir) as scratch:
+                data = np.memmap(scratch, dtype=np.float32, mode="w+", shape=shape)  # the mapping outlives the file
+            self.spilled = True
+        else:
+            data = np.empty(shape, dtype=np.float32)
+        data[:self._size] = self._data[:self._size]
+        self._data = data
+
+    def array(self):
+        """The trace so far, shape (len(self), 1, 3); a view, memory-mapped once spilled."""
+        return np.asarray(self._data[:self._size])
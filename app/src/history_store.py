@@ -0,0 +1,289 @@
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+HISTORY_DIR = os.getenv("HISTORY_DIR", "data/history")              # column files of the results store
+HISTORY_RECENT = int(os.getenv("HISTORY_RECENT", "3"))              # sessions in the "recent" average
+HISTORY_INITIAL_ROWS = 1024
+
+METRICS = ("bpms", "sdnn", "rmssd", "pnn50", "stress_level")
+# column name → dtype; one memory-mapped file per column
+COLUMNS = {"user": np.int32, "week": np.int16, "time": np.float64, **{m: np.float32 for m in METRICS}}
+MAX_WEEK = 64
+
+
+class _Aggregates:
+    """
+    Running sums of every metric per group (user or week): count, sum, sum of squares,
+    and the sums of a least-squares fit of the metric against the week, so the mean,
+    standard deviation and trend of a group are O(1) to read and to update.
+    """
+
+    def __init__(self, groups=0):
+        self.count = np.zeros(groups)
+        self.week_sum = np.zeros(groups)
+        self.week_sq = np.zeros(groups)
+        self.sum = np.zeros((groups, len(METRICS)))
+        self.sq = np.zeros((groups, len(METRICS)))
+        self.week_dot = np.zeros((groups, len(METRICS)))
+
+    def __len__(self):
+        return len(self.count)
+
+    def grow(self, groups):
+        for name, value in vars(self).items():
+            grown = np.zeros((groups,) + value.shape[1:])
+            grown[:len(value)] = value
+            setattr(self, name, grown)
+
+    def add(self, groups, weeks, values):
+        """Add rows: group index, week and metric values (n, len(METRICS)) of each."""
+        n = len(self)
+        self.count += np.bincount(groups, minlength=n)
+        self.week_sum += np.bincount(groups, weights=weeks, minlength=n)
+        self.week_sq += np.bincount(groups, weights=weeks ** 2, minlength=n)
+        for j in range(len(METRICS)):
+            self.sum[:, j] += np.bincount(groups, weights=values[:, j], minlength=n)
+            self.sq[:, j] += np.bincount(groups, weights=values[:, j] ** 2, minlength=n)
+            self.week_dot[:, j] += np.bincount(groups, weights=weeks * values[:, j], minlength=n)
+
+    def stats(self, group):
+        """{metric: {"mean", "std", "trend_per_week"}} of one group."""
+        n = self.count[group]
+        result = {}
+        for j, metric in enumerate(METRICS):
+            mean = self.sum[group, j] / n
+            var = max(self.sq[group, j] / n - mean ** 2, 0.0)
+            denom = n * self.week_sq[group] - self.week_sum[group] ** 2
+            trend = ((n * self.week_dot[group, j] - self.week_sum[group] * self.sum[group, j]) / denom
+                     if denom > 1e-9 else None)
+            result[metric] = {"mean": round(float(mean), 2), "std": round(float(np.sqrt(var)), 2),
+                              "trend_per_week": None if trend is None else round(float(trend), 3)}
+        return result
+
+
+class HistoryStore:
+    """
+    Append-only store of per-session results (week, BPM, SDNN, RMSSD, pNN50, stress level).
+
+    Each column is a memory-mapped file of fixed-size values, grown by doubling; `meta.json`
+    holds the number of committed rows and is replaced atomically after the row is written,
+    so a crash mid-append leaves the store as it was. User ids are appended to `users.txt`
+    and stored in the rows as their line number.
+
+    Rows of a user, and of a user and week, are indexed in memory, and per-user and
+    per-week aggregates (see `_Aggregates`) are rebuilt with a few vectorized passes on
+    open, then updated on every append. One process writes to a store; within it, appends
+    and reads are serialized by a lock, so readers never see half-updated indexes.
+
+    Parameters:
+        path (str): Directory of the store, created if needed.
+    """
+
+    def __init__(self, path=HISTORY_DIR):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.Lock()
+        self.size = self._read_meta()
+        self.user_ids = self._read_users()
+        self.user_codes = {user_id: code for code, user_id in enumerate(self.user_ids)}
+        self.capacity = max(HISTORY_INITIAL_ROWS, self.size)
+        self.columns = {name: self._map(name, dtype, self.capacity) for name, dtype in COLUMNS.items()}
+        self._build_indexes()
+
+    # storage
+
+    def _column_path(self, name):
+        return os.path.join(self.path, f"{name}.bin")
+
+    def _map(self, name, dtype, rows):
+        path = self._column_path(name)
+        nbytes = rows * np.dtype(dtype).itemsize
+        with open(path, "ab") as f:  # create if missing
+            if f.tell() < nbytes:
+                f.truncate(nbytes)
+        return np.memmap(path, dtype=dtype, mode="r+", shape=(rows,))
+
+    def _grow(self):
+        old = self.columns
+        for column in old.values():
+            column.flush()
+        self.capacity *= 2
+        self.columns = {name: self._map(name, dtype, self.capacity) for name, dtype in COLUMNS.items()}
+        for column in old.values():
+            column._mmap.close()  # numpy only unmaps on garbage collection; readers hold `_lock`
+
+    def _read_meta(self):
+        try:
+            with open(os.path.join(self.path, "meta.json")) as f:
+                return json.load(f)["rows"]
+        except FileNotFoundError:
+            return 0
+
+    def _write_meta(self):
+        path = os.path.join(self.path, "meta.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump({"rows": self.size, "columns": {name: np.dtype(dtype).str for name, dtype in COLUMNS.items()}}, f)
+        os.replace(path + ".tmp", path)
+
+    def _read_users(self):
+        try:
+            with open(os.path.join(self.path, "users.txt")) as f:
+                return f.read().splitlines()
+        except FileNotFoundError:
+            return []
+
+    def _user_code(self, user_id):
+        code = self.user_codes.get(user_id)
+        if code is None:
+            with open(os.path.join(self.path, "users.txt"), "a") as f:
+                f.write(user_id + "\n")
+            code = self.user_codes[user_id] = len(self.user_ids)
+            self.user_ids.append(user_id)
+        return code
+
+    # indexes
+
+    def _build_indexes(self):
+        n = self.size
+        users = np.asarray(self.columns["user"][:n], dtype=np.int64)
+        weeks = np.asarray(self.columns["week"][:n], dtype=np.int64)
+        values = np.stack([np.asarray(self.columns[m][:n], dtype=np.float64) for m in METRICS], axis=1)
+
+        order = np.argsort(users, kind="stable")  # rows of each user, in append order
+        bounds = np.searchsorted(users[order], np.arange(len(self.user_ids) + 1))
+        self.rows_by_user = [list(order[bounds[u]:bounds[u + 1]]) for u in range(len(self.user_ids))]
+        self.rows_by_user_week = {}
+        for row in range(n):
+            self.rows_by_user_week.setdefault((int(users[row]), int(weeks[row])), []).append(row)
+
+        self.by_user = _Aggregates(len(self.user_ids))
+        self.by_user.add(users, weeks.astype(np.float64), values)
+        self.by_week = _Aggregates(MAX_WEEK)
+        self.by_week.add(np.clip(weeks, 0, MAX_WEEK - 1), weeks.astype(np.float64), values)
+
+    # API
+
+    def append(self, user_id, week, values, timestamp=None):
+        """
+        Record one session.
+
+        Parameters:
+            user_id (str): User the session belongs to.
+            week (int): Pregnancy week.
+            values (dict): Every metric of METRICS, as finite numbers.
+            timestamp (float, optional): Seconds since the epoch (default: now).
+
+        Returns:
+            int: Row of the session.
+
+        Raises:
+            ValueError: For an invalid user or week, or a missing or non-finite metric (e.g.
+                an HRV that could not be computed), which would spoil the aggregates.
+        """
+        user_id, week = str(user_id), int(week)
+        if "\n" in user_id or not user_id:
+            raise ValueError("Invalid user_id")
+        if not 0 <= week < MAX_WEEK:
+            raise ValueError(f"Week out of range: {week}")
+        missing = [m for m in METRICS if values.get(m) is None]
+        if missing:
+            raise ValueError(f"Missing metrics: {missing}")
+        try:
+            metrics = np.array([float(values[m]) for m in METRICS])
+        except (TypeError, ValueError):
+            raise ValueError(f"Metrics must be numbers: {[values[m] for m in METRICS]}")
+        if not np.all(np.isfinite(metrics)):
+            raise ValueError(f"Non-finite metrics: {[m for m, v in zip(METRICS, metrics) if not np.isfinite(v)]}")
+
+        with self._lock:
+            code = self._user_code(user_id)
+            row = self.size
+            if row == self.capacity:
+                self._grow()
+            self.columns["user"][row] = code
+            self.columns["week"][row] = week
+            self.columns["time"][row] = time.time() if timestamp is None else timestamp
+            for m, value in zip(METRICS, metrics):
+                self.columns[m][row] = value
+            for column in self.columns.values():
+                column.flush()
+            self.size += 1
+            self._write_meta()
+
+            if code == len(self.rows_by_user):
+                self.rows_by_user.append([])
+                self.by_user.grow(code + 1)
+            self.rows_by_user[code].append(row)
+            self.rows_by_user_week.setdefault((code, week), []).append(row)
+            stored = np.asarray([[self.columns[m][row] for m in METRICS]], dtype=np.float64)
+            self.by_user.add(np.array([code]), np.array([float(week)]), stored)
+            self.by_week.add(np.array([week]), np.array([float(week)]), stored)
+        return row
+
+    def sessions(self, user_id, week=None, limit=None):
+        """Sessions of a user (optionally of one week), oldest first, at most the `limit` latest."""
+        with self._lock:
+            code = self.user_codes.get(str(user_id))
+            if code is None:
+                return []
+            rows = self.rows_by_user[code] if week is None else self.rows_by_user_week.get((code, int(week)), [])
+            if limit:
+                rows = rows[-limit:]
+            return [self._row(row) for row in rows]
+
+    def summary(self, user_id, recent=HISTORY_RECENT):
+        """
+        Aggregates of a user: number of sessions, weeks covered, and per metric the last
+        value, the mean of the `recent` latest sessions, the overall mean and standard
+        deviation, and the trend (change per pregnancy week). None for an unknown user.
+        """
+        with self._lock:
+            code = self.user_codes.get(str(user_id))
+            if code is None or not self.rows_by_user[code]:
+                return None
+            rows = np.asarray(self.rows_by_user[code])
+            weeks = self.columns["week"][rows]
+            latest = rows[-recent:]
+            stats = self.by_user.stats(code)
+            for m in METRICS:
+                stats[m]["last"] = round(float(self.columns[m][rows[-1]]), 2)
+                stats[m]["recent_mean"] = round(float(np.mean(self.columns[m][latest])), 2)
+        return {"user_id": str(user_id), "sessions": len(rows), "first_week": int(weeks.min()),
+                "last_week": int(weeks.max()), "metrics": stats}
+
+    def week_summary(self, week):
+        """Mean, standard deviation and count of every metric over all the sessions of a week."""
+        week = int(week)
+        with self._lock:
+            if not 0 <= week < MAX_WEEK or self.by_week.count[week] == 0:
+                return {"week": week, "sessions": 0, "metrics": {}}
+            stats = self.by_week.stats(week)
+            sessions = int(self.by_week.count[week])
+        for m in METRICS:
+            stats[m].pop("trend_per_week")
+        return {"week": week, "sessions": sessions, "metrics": stats}
+
+    def context(self, user_id):
+        """Compact text of a user's history for the LLM prompt ("" for an unknown user)."""
+        summary = self.summary(user_id)
+        if summary is None:
+            return ""
+        lines = [f"{summary['sessions']} previous sessions, weeks {summary['first_week']}-{summary['last_week']}"]
+        for m, s in summary["metrics"].items():
+            trend = "" if s["trend_per_week"] is None else f", trend {s['trend_per_week']:+.2f}/week"
+            lines.append(f"{m}: last {s['last']}, recent mean {s['recent_mean']}, "
+                         f"mean {s['mean']} (sd {s['std']}){trend}")
+        return "\n".join(lines)
+
+    def info(self):
+        with self._lock:
+            return {"sessions": self.size, "users": len(self.user_ids), "capacity": self.capacity}
+
+    def _row(self, row):
+        session = {"week": int(self.columns["week"][row]), "time": float(self.columns["time"][row])}
+        session.update({m: round(float(self.columns[m][row]), 4) for m in METRICS})
+        return session
@@ -0,0 +1,154 @@
+from collections import deque
+import numpy as np
+
+
+def hrv_metrics_batch(nni_seqs):
+    """
+    Time-domain HRV metrics of many NN interval sequences at once.
+
+    Sequences may have different lengths; they are NaN-padded into one 2D array and every
+    metric is computed with a few vectorized passes over it. Definitions match
+    `pyhrv.time_domain` (SDNN with ddof=1, pNN50 over the number of successive differences).
+
+    Parameters:
+        nni_seqs (list): NN interval sequences in ms.
+
+    Returns:
+        dict: Arrays of shape (len(nni_seqs),) for 'nni_counter', 'nni_mean', 'hr_mean',
+        'sdnn', 'rmssd', 'nn50' and 'pnn50'. Metrics that need more intervals than a
+        sequence has are NaN.
+    """
+    lengths = np.array([len(seq) for seq in nni_seqs], dtype=np.int64)
+    nni = np.full((len(nni_seqs), max(lengths.max(initial=0), 1)), np.nan)
+    nni[np.arange(nni.shape[1]) < lengths[:, None]] = np.concatenate(
+        [np.asarray(seq, dtype=np.float64) for seq in nni_seqs] or [np.empty(0)])
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        n_diffs = lengths - 1
+        nni_mean = np.nansum(nni, axis=1) / lengths
+        hr_mean = np.nansum(60000.0 / nni, axis=1) / lengths
+        sdnn = np.sqrt(np.nansum((nni - nni_mean[:, None]) ** 2, axis=1) / n_diffs)
+        diffs = np.diff(nni, axis=1)
+        rmssd = np.sqrt(np.nansum(diffs ** 2, axis=1) / n_diffs)
+        nn50 = np.sum(np.abs(diffs) > 50, axis=1)  # NaN padding compares False
+        pnn50 = nn50 / n_diffs * 100
+
+    invalid = n_diffs < 1
+    for metric in (sdnn, rmssd, pnn50):
+        metric[invalid] = np.nan
+    return {
+        'nni_counter': lengths,
+        'nni_mean': nni_mean,
+        'hr_mean': hr_mean,
+        'sdnn': sdnn,
+        'rmssd': rmssd,
+        'nn50': nn50,
+        'pnn50': pnn50,
+    }
+
+
+def hrv_metrics(nni):
+    """
+    Time-domain HRV metrics of one NN interval sequence (see `hrv_metrics_batch`).
+
+    Parameters:
+        nni (numpy.ndarray): NN intervals in ms.
+
+    Returns:
+        dict: Python numbers for 'nni_counter', 'nni_mean', 'hr_mean', 'sdnn', 'rmssd', 'nn50' and 'pnn50'.
+    """
+    return {k: v[0].item() for k, v in hrv_metrics_batch([nni]).items()}
+
+
+class OnlineHRV:
+    """
+    Incremental HRV accumulator for NN intervals arriving one beat (or one chunk) at a time.
+
+    Keeps Welford running mean/M2 for SDNN, running sums of squared successive differences
+    for RMSSD and a counter of differences over 50 ms for pNN50, so each beat costs O(1).
+    With `window` set, the oldest interval is evicted once more than `window` intervals are
+    held, and every running sum is downdated accordingly.
+
+    Parameters:
+        window (int, optional): Number of most recent NN intervals to keep (default: all).
+    """
+
+    def __init__(self, window=None):
+        self.window = window
+        self.reset()
+
+    def reset(self):
+        self._nni = deque()
+        self._mean = 0.0
+        self._m2 = 0.0
+        self._hr_sum = 0.0
+        self._sq_diff_sum = 0.0
+        self._nn50 = 0
+
+    def __len__(self):
+        return len(self._nni)
+
+    def update(self, nni):
+        """Add one NN interval (ms), evicting the oldest one if the window is full."""
+        nni = float(nni)
+        if self._nni:
+            diff = nni - self._nni[-1]
+            self._sq_diff_sum += diff * diff
+            self._nn50 += abs(diff) > 50
+        self._nni.append(nni)
+
+        n = len(self._nni)
+        delta = nni - self._mean
+        self._mean += delta / n
+        self._m2 += delta * (nni - self._mean)
+        self._hr_sum += 60000.0 / nni
+
+        if self.window and n > self.window:
+            self._evict()
+        return self
+
+    def extend(self, nni_seq):
+        """Add a chunk of NN intervals."""
+        for nni in nni_seq:
+            self.update(nni)
+        return self
+
+    def _evict(self):
+        oldest = self._nni.popleft()
+        diff = self._nni[0] - oldest
+        self._sq_diff_sum = max(self._sq_diff_sum - diff * diff, 0.0)
+        self._nn50 -= abs(diff) > 50
+
+        n = len(self._nni)
+        delta = oldest - self._mean
+        self._mean -= delta / n
+        self._m2 = max(self._m2 - delta * (oldest - self._mean), 0.0)
+        self._hr_sum -= 60000.0 / oldest
+
+    @property
+    def sdnn(self):
+        n = len(self._nni)
+        return np.sqrt(self._m2 / (n - 1)) if n > 1 else np.nan
+
+    @property
+    def rmssd(self):
+        n_diffs = len(self._nni) - 1
+        return np.sqrt(self._sq_diff_sum / n_diffs) if n_diffs > 0 else np.nan
+
+    @property
+    def pnn50(self):
+        n_diffs = len(self._nni) - 1
+        return self._nn50 / n_diffs * 100 if n_diffs > 0 else np.nan
+
+    def result(self):
+        """Current metrics, with the same keys as `hrv_metrics`."""
+        n = len(self._nni)
+        return {
+            'nni_counter': n,
+            'nni_mean': self._mean if n else np.nan,
+            'hr_mean': self._hr_sum / n if n else np.nan,
+            'sdnn': float(self.sdnn),
+            'rmssd': float(self.rmssd),
+            'nn50': int(self._nn50),
+            'pnn50': float(self.pnn50),
+        }
@@ -0,0 +1,220 @@
+import asyncio
+import math
+import os
+import time
+import uuid
+
+from src import metrics
+
+JOB_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY", os.getenv("VHR_POOL_SIZE", "2")))  # jobs processed at once
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "16"))          # jobs waiting before 429
+JOB_DEADLINE = float(os.getenv("JOB_DEADLINE", "180"))           # seconds from submission to result
+JOB_RESULT_TTL = float(os.getenv("JOB_RESULT_TTL", "600"))       # seconds finished jobs stay pollable
+
+FINISHED_STATUSES = ("done", "failed", "expired", "unusable")
+
+
+class QueueFullError(Exception):
+    """Raised when the job queue is full; `retry_after` is the suggested wait in seconds."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Too many videos in progress, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+class Job:
+    """One unit of work and its observable state."""
+
+    def __init__(self, run, deadline, on_finish=None):
+        self.id = uuid.uuid4().hex
+        self.run = run
+        self.on_finish = on_finish  # called once the job is finished, whatever its status
+        self.status = "queued"
+        self.result = None
+        self.partial = {}  # parts of the result known before the job is done
+        self.error = None
+        self.created_at = time.time()
+        self.deadline = self.created_at + deadline
+        self.started_at = None
+        self.finished_at = None
+        self.version = 0
+        self._changed = asyncio.Event()
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATUSES
+
+    def update(self, status, result=None, error=None):
+        self.status = status
+        if status == "running":
+            self.started_at = time.time()
+        elif status in FINISHED_STATUSES:
+            self.finished_at = time.time()
+            self.result, self.error = result, error
+            self.run = None
+        self._notify()
+
+    def report(self, **values):
+        """Publish part of the result while the job is still running (e.g. the BPM before the HRV)."""
+        self.partial.update(values)
+        self._notify()
+
+    def _notify(self):
+        self.version += 1
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def wait_change(self, since=None, timeout=None):
+        """Wait until the status or `partial` changes (or has changed since `version` was `since`); returns False on timeout."""
+        if since is not None and since != self.version:
+            return True
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def snapshot(self):
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "deadline": self.deadline,
+            "results": self.result,
+            "partial": self.partial,
+            "error": self.error,
+        }
+
+
+class JobQueue:
+    """
+    Bounded FIFO of jobs processed by a fixed number of concurrent runners.
+
+    `submit` refuses new jobs with `QueueFullError` once `max_queued` jobs are waiting,
+    so a burst of uploads is turned away with a retry hint instead of piling up in memory.
+    A job that is still queued or running past its deadline is cancelled and marked
+    `expired`; one whose input cannot be processed (an exception with an `expected`
+    attribute) is marked `unusable`.
+
+    Parameters:
+        concurrency (int): Jobs processed at once.
+        max_queued (int): Jobs allowed to wait for a runner.
+        deadline (float): Default seconds from submission to result.
+        result_ttl (float): Seconds a finished job can still be polled.
+    """
+
+    def __init__(self, concurrency=JOB_CONCURRENCY, max_queued=JOB_QUEUE_SIZE,
+                 deadline=JOB_DEADLINE, result_ttl=JOB_RESULT_TTL):
+        self.concurrency = concurrency
+        self.max_queued = max_queued
+        self.deadline = deadline
+        self.result_ttl = result_ttl
+        self.jobs = {}
+        self.running = 0
+        self.avg_duration = 30.0  # seconds, moving average used for Retry-After
+        self.stats = {"submitted": 0, "rejected": 0, "done": 0, "failed": 0, "expired": 0, "unusable": 0}
+        self._queue = None
+        self._runners = []
+
+    async def start(self):
+        self._queue = asyncio.Queue(maxsize=self.max_queued)
+        self._runners = [asyncio.create_task(self._runner()) for _ in range(self.concurrency)]
+
+    async def close(self):
+        for runner in self._runners:
+            runner.cancel()
+        await asyncio.gather(*self._runners, return_exceptions=True)
+
+    def is_full(self):
+        return self._queue.full()
+
+    def retry_after(self):
+        """Seconds until a runner is likely to take the next queued job, from recent job durations."""
+        return max(1, math.ceil(self.avg_duration / max(self.concurrency, 1)))
+
+    def submit(self, run, deadline=None, on_finish=None):
+        """
+        Queue `run`, an async callable producing the job result. `on_finish` is called
+        once the job is finished, also when it expires before running (e.g. to remove its
+        input file).
+
+        Raises:
+            QueueFullError: When `max_queued` jobs are already waiting.
+        """
+        self._prune()
+        if self._queue.full():
+            self.stats["rejected"] += 1
+            metrics.record_failure("job_rejected")
+            raise QueueFullError(self.retry_after())
+        job = Job(run, self.deadline if deadline is None else min(deadline, self.deadline), on_finish)
+        self._queue.put_nowait(job)
+        self.jobs[job.id] = job
+        self.stats["submitted"] += 1
+        return job
+
+    def completed(self, result):
+        """Register a job that is already done (e.g. a cached result) so it can be polled like the others."""
+        self._prune()
+        job = Job(None, self.deadline)
+        job.update("done", result=result)
+        self.jobs[job.id] = job
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    async def wait(self, job):
+        while not job.finished:
+            await job.wait_change()
+        return job
+
+    def info(self):
+        return {**self.stats, "queued": self._queue.qsize() if self._queue else 0,
+                "running": self.running, "concurrency": self.concurrency,
+                "max_queued": self.max_queued, "avg_duration": round(self.avg_duration, 2)}
+
+    async def _runner(self):
+        while True:
+            job = await self._queue.get()
+            remaining = job.deadline - time.time()
+            if remaining <= 0:
+                self._finish(job, "expired", error="Deadline exceeded while queued")
+                continue
+
+            self.running += 1
+            metrics.IN_FLIGHT.labels("video_jobs").inc()
+            job.update("running")
+            metrics.observe("job_queue_wait", job.started_at - job.created_at)
+            try:
+                result = await asyncio.wait_for(job.run(), remaining)
+                self._finish(job, "done", result=result)
+            except asyncio.TimeoutError:
+                self._finish(job, "expired", error="Deadline exceeded while processing")
+            except Exception as e:
+                # expected outcomes (e.g. a video without a usable pulse signal) are not failures
+                self._finish(job, "unusable" if getattr(e, "expected", False) else "failed", error=str(e))
+            finally:
+                self.running -= 1
+                metrics.IN_FLIGHT.labels("video_jobs").dec()
+                self.avg_duration = 0.8 * self.avg_duration + 0.2 * (time.time() - job.started_at)
+
+    def _finish(self, job, status, result=None, error=None):
+        job.update(status, result=result, error=error)
+        if job.on_finish is not None:
+            on_finish, job.on_finish = job.on_finish, None
+            try:
+                on_finish()
+            except Exception as e:
+                print(f"Job {job.id} cleanup failed: {e}")
+        self.stats[status] += 1
+        if status != "done":
+            metrics.record_failure(f"job_{status}")
+
+    def _prune(self):
+        now = time.time()
+        expired = [job_id for job_id, job in self.jobs.items()
+                   if job.finished and now - job.finished_at > self.result_ttl]
+        for job_id in expired:
+            del self.jobs[job_id]
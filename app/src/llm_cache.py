@@ -0,0 +1,188 @@
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from src import metrics
+
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "3600"))        # seconds a response is reused
+LLM_CACHE_ENTRIES = int(os.getenv("LLM_CACHE_ENTRIES", "1024"))   # responses kept (0 disables caching)
+LLM_CACHE_BINS = os.getenv("LLM_CACHE_BINS", "")                  # e.g. "bpms=2,sdnn=5,rmssd=5,pnn50=1"
+
+
+def parse_bins(spec):
+    """Parse "name=step,..." into {name: step}."""
+    bins = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, step = item.split("=")
+        bins[name.strip()] = float(step)
+    return bins
+
+
+def bin_inputs(query, bins):
+    """
+    Round the numeric inputs listed in `bins` to a multiple of their step, so nearby values
+    render the same prompt. Values that are not numbers are left as they are.
+
+    Returns:
+        dict: A copy of `query`.
+    """
+    binned = dict(query)
+    for name, step in bins.items():
+        if name not in binned or step <= 0:
+            continue
+        try:
+            value = round(float(binned[name]) / step) * step
+        except (TypeError, ValueError):
+            continue
+        binned[name] = int(value) if float(step).is_integer() else round(value, 6)
+    return binned
+
+
+class _Flight:
+    """One upstream call in progress; every request for the same prompt replays its chunks."""
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self._changed = asyncio.Event()
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def add(self, chunk):
+        self.chunks.append(chunk)
+        self._notify()
+
+    def finish(self, error=None):
+        self.done, self.error = True, error
+        self._notify()
+
+    async def replay(self):
+        sent = 0
+        while True:
+            while sent < len(self.chunks):
+                yield self.chunks[sent]
+                sent += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self._changed.wait()
+
+
+class LLMResponseCache:
+    """
+    TTL + LRU cache of LLM responses keyed by the rendered prompt, with single-flight
+    coalescing: concurrent requests for a prompt that is not cached share one upstream call.
+
+    Responses are stored as the list of streamed chunks, so a streaming endpoint replays a
+    cached answer chunk by chunk. The upstream call runs in its own task and is cached
+    once complete, even if the request that started it disconnects; failed calls are not
+    cached. Flights live on the event loop; `get`, `put` and `info` are thread-safe.
+
+    Parameters:
+        ttl (float): Seconds a response is reused.
+        max_entries (int): Responses kept (0 disables caching, coalescing still applies).
+        bins (dict, optional): Rounding steps of numeric inputs, see `bin_inputs`.
+    """
+
+    def __init__(self, ttl=LLM_CACHE_TTL, max_entries=LLM_CACHE_ENTRIES, bins=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.bins = parse_bins(LLM_CACHE_BINS) if bins is None else bins
+        self._entries = OrderedDict()
+        self._flights = {}
+        self._tasks = set()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "expired": 0, "errors": 0}
+
+    def bin(self, query):
+        return bin_inputs(query, self.bins)
+
+    @staticmethod
+    def key(template, query, model=None):
+        """Cache key of a prompt: the rendered template and the model answering it."""
+        rendered = template.format(**query)
+        model = model or os.getenv("MODEL_NAME", "")
+        return hashlib.sha256(f"{model}\0{rendered}".encode()).hexdigest()
+
+    def get(self, key):
+        """Cached chunks for `key`, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.time():
+                del self._entries[key]
+                self.stats["expired"] += 1
+                entry = None
+            if entry is None:
+                self.stats["misses"] += 1
+            else:
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+        metrics.record_cache("llm", hit=entry is not None)
+        return None if entry is None else entry[1]
+
+    def put(self, key, chunks):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, list(chunks))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    async def astream(self, key, produce):
+        """
+        Async generator of response chunks for `key`: from the cache, from a call already in
+        flight, or from `produce()`, a callable returning an async iterator of chunks.
+        """
+        cached = self.get(key)
+        if cached is not None:
+            for chunk in cached:
+                yield chunk
+            return
+
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._flights[key] = _Flight()
+            task = asyncio.create_task(self._run(key, flight, produce))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        else:
+            self.stats["coalesced"] += 1
+            metrics.CACHE_REQUESTS.labels("llm", "coalesced").inc()
+        async for chunk in flight.replay():
+            yield chunk
+
+    async def ainvoke(self, key, produce):
+        """Like `astream`, for a non-streaming call: `produce()` is a coroutine of the whole response text."""
+        async def single_chunk():
+            yield await produce()
+
+        return "".join([chunk async for chunk in self.astream(key, single_chunk)])
+
+    def info(self):
+        with self._lock:
+            return {**self.stats, "entries": len(self._entries), "in_flight": len(self._flights)}
+
+    async def _run(self, key, flight, produce):
+        try:
+            async for chunk in produce():
+                flight.add(chunk)
+        except asyncio.CancelledError:
+            del self._flights[key]
+            flight.finish(error=RuntimeError("LLM call cancelled"))
+            raise
+        except Exception as e:
+            self.stats["errors"] += 1
+            del self._flights[key]
+            flight.finish(error=e)
+            return
+        self.put(key, flight.chunks)
+        del self._flights[key]
+        flight.finish()
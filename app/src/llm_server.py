@@ -1,12 +1,50 @@
-from starlette.responses import StreamingResponse
-from src.llm_tools import (stream_llm_output, invoke_llm_output, build_llm_chain, 
-                           get_content_by_week, search, search_filter)
+from contextlib import asynccontextmanager
+from starlette.responses import Response, StreamingResponse
+from src import metrics
+from src.llm_tools import (astream_llm_output, ainvoke_llm_output, build_llm_chain, 
+                           get_content_by_week, asearch, get_embedding_service, load_resources,
+                           HISTORY_SEARCH_K)
+from src.llm_cache import LLMResponseCache
+from src.history_store import HistoryStore
+from src.partial_json import PartialObjectParser, parse_object
 from src.variables import *
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import Depends, FastAPI, HTTPException, Request
 import re, ast
+import asyncio
+import json
+import time
 from fastapi.middleware.cors import CORSMiddleware
 
-app = FastAPI()
+# Responses keyed by rendered prompt; identical concurrent requests share one upstream call
+llm_cache = LLMResponseCache()
+
+# Per-user session results, the server-side alternative to sending history_result
+history_store = HistoryStore()
+
+# Model and index loading state, reported on /ready
+readiness = {"ready": False, "error": None, "started_at": None, "load_seconds": None}
+
+
+async def load_in_background():
+    readiness["started_at"] = time.time()
+    try:
+        await asyncio.to_thread(load_resources)
+    except Exception as e:
+        readiness["error"] = str(e)
+        print(f"LLM resources failed to load: {e}")
+        return
+    readiness["load_seconds"] = round(time.time() - readiness["started_at"], 2)
+    readiness["ready"] = True
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # accept traffic (and liveness probes) right away, load the model and index meanwhile
+    loader = asyncio.create_task(load_in_background())
+    yield
+    loader.cancel()
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # Allow Expo (replace with your frontend URL)
@@ -14,7 +52,72 @@ app.add_middleware(
     allow_headers=["Content-Type"],
 )
 
-@app.post("/hb-analyze/")
+def require_ready():
+    if not readiness["ready"]:
+        raise HTTPException(status_code=503, detail="LLM server is still loading", headers={"Retry-After": "5"})
+
+
+@app.get("/health")
+def health():
+    """Liveness: the process is up and serving, whether or not the model is loaded."""
+    return {"status": "ok", "cache": llm_cache.info(), "history": history_store.info()}
+
+
+@app.get("/ready")
+def ready():
+    """Readiness: the LLM client, embedding model and vector store are loaded and warmed up."""
+    if not readiness["ready"]:
+        raise HTTPException(status_code=503, detail=readiness)
+    return {**readiness, "embeddings": get_embedding_service().info()}
+
+
+def history_of(data):
+    """
+    `history_result` of a request; when it is empty and the request has a `user_id`, the
+    compact summary of that user's stored sessions instead.
+    """
+    if not data.get("history_result") and data.get("user_id") is not None:
+        return history_store.context(data["user_id"]) or "No previous sessions"
+    if "history_result" not in data:
+        raise Exception("Missing required keys: ['history_result'] (or 'user_id')")
+    return data["history_result"]
+
+
+def cached_stream(chain, template, query):
+    return llm_cache.astream(llm_cache.key(template, query), lambda: astream_llm_output(chain, query))
+
+
+async def cached_invoke(chain, template, query):
+    return await llm_cache.ainvoke(llm_cache.key(template, query), lambda: ainvoke_llm_output(chain, query))
+
+
+@app.get("/metrics")
+def prometheus_metrics():
+    """Vector search and LLM latency histograms, failure counters, in-flight gauges (Prometheus text format)."""
+    body, content_type = metrics.render()
+    return Response(body, media_type=content_type)
+
+
+@app.post("/prefetch-context/", dependencies=[Depends(require_ready)])
+async def prefetch_context(request: Request):
+    """
+    Warm the context of an upcoming /overall-analyze/ or /stress-analyze/ call: the week
+    context and the embedding of `history_result` are cached, so the analysis itself does
+    not wait for them. Called by the video server's /pipeline/ while the video is processed.
+    """
+    try:
+        data = await request.json()
+        week = int(data['week'])
+        get_content_by_week(week)
+        if data.get('history_result') or data.get('user_id') is not None:
+            await asearch(history_of(data), k=HISTORY_SEARCH_K, week=week)
+        return {"message": "Context ready"}
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Prefetch Context failed: {str(e)}")
+
+
+@app.post("/hb-analyze/", dependencies=[Depends(require_ready)])
 async def stream_hr_analyze(request: Request):
     try:
         data = await request.json()
@@ -26,18 +129,18 @@ async def stream_hr_analyze(request: Request):
         if missing_keys:
             raise Exception(f"Missing required keys: {list(missing_keys)}")
         
-        query = {k: data[k] for k in required_keys}
+        query = llm_cache.bin({k: data[k] for k in required_keys})
         
         if data.get("stream", True):
-            return StreamingResponse(stream_llm_output(chain, query), media_type="text/plain")
+            return StreamingResponse(cached_stream(chain, hb_analysis_template, query), media_type="text/plain")
         else:
-            return invoke_llm_output(chain, query)
+            return await cached_invoke(chain, hb_analysis_template, query)
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Get Heart Rate Analysis failed: {str(e)}")
 
 
-@app.post("/hrv-analyze/")
+@app.post("/hrv-analyze/", dependencies=[Depends(require_ready)])
 async def stream_hrv_analyze(request: Request):
     try:
         data = await request.json()
@@ -49,18 +152,18 @@ async def stream_hrv_analyze(request: Request):
         if missing_keys:
             raise Exception(f"Missing required keys: {list(missing_keys)}")
         
-        query = {k: data[k] for k in required_keys}
+        query = llm_cache.bin({k: data[k] for k in required_keys})
         
         if data.get("stream", True):
-            return StreamingResponse(stream_llm_output(chain, query), media_type="text/plain")
+            return StreamingResponse(cached_stream(chain, hrv_analysis_template, query), media_type="text/plain")
         else:
-            return invoke_llm_output(chain, query)
+            return await cached_invoke(chain, hrv_analysis_template, query)
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Get HRV Analysis failed: {str(e)}")
 
 
-@app.post("/stress-analyze/")
+@app.post("/stress-analyze/", dependencies=[Depends(require_ready)])
 async def stream_stress_analyze(request: Request):
     try:
         data = await request.json()
@@ -72,48 +175,220 @@ async def stream_stress_analyze(request: Request):
         if missing_keys:
             raise Exception(f"Missing required keys: {list(missing_keys)}")
         
-        query = {k: data[k] for k in required_keys}
+        query = llm_cache.bin({k: data[k] for k in required_keys})
         query["context"] = get_content_by_week(int(data['week']))
         
         if data.get("stream", True):
-            return StreamingResponse(stream_llm_output(chain, query), media_type="text/plain")
+            return StreamingResponse(cached_stream(chain, stress_analysis_template, query), media_type="text/plain")
         else:
-            return invoke_llm_output(chain, query)
+            return await cached_invoke(chain, stress_analysis_template, query)
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Get Stress Analysis failed: {str(e)}")
 
 
-@app.post("/overall-analyze/")
+@app.post("/overall-analyze/", dependencies=[Depends(require_ready)])
 async def get_overall_analyze(request: Request):
     try:
         data = await request.json()
         chain = build_llm_chain(template=overall_analysis_template, input_vars=overall_input_variables)
         
-        required_keys = set(overall_input_variables) - {"context"} | {"history_result"}
+        required_keys = set(overall_input_variables) - {"context"}
         missing_keys = required_keys - data.keys()
 
         if missing_keys:
             raise Exception(f"Missing required keys: {list(missing_keys)}")
         
-        query = {k: data[k] for k in required_keys}
-        query["context"] = search_filter(search(data['history_result'], k=50), week_filter=int(data['week']))
+        query = llm_cache.bin({k: data[k] for k in required_keys})
+        query["context"] = await asearch(history_of(data), k=HISTORY_SEARCH_K, week=int(data['week']))
         
-        result = invoke_llm_output(chain, query)
-        match = re.search(r'```json\s*(.*?)\s*```', result, re.DOTALL)
+        if data.get("stream", False):
+            return StreamingResponse(stream_overall_events(chain, query), media_type="text/event-stream",
+                                     headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+        result = await cached_invoke(chain, overall_analysis_template, query)
+        return parse_overall_result(result)
+    
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Get Overall Analysis failed: {str(e)}")
+
+
+def parse_overall_result(result):
+    match = re.search(r'```json\s*(.*?)\s*```', result, re.DOTALL)
 
-        if match:
-            extracted_str = match.group(1)
+    if match:
+        extracted_str = match.group(1)
+        try:
             json_dict = ast.literal_eval(extracted_str)
-            return {
-                "message": "LLM Process complete",
-                "results": json_dict
-            }
+        except (ValueError, SyntaxError):
+            # e.g. an unescaped quote inside a suggestion
+            json_dict = parse_object(extracted_str)
+        return {
+            "message": "LLM Process complete",
+            "results": json_dict
+        }
+    else:
+        return {
+            "message": "No JSON content found.",
+            "results": {}
+        }
+
+
+async def overall_aspects(chain, query):
+    """
+    Async generator of the aspects of the overall analysis as (key, value), each one as soon
+    as its value closes in the streamed answer, then (None, parse_overall_result(answer)).
+    """
+    parser = PartialObjectParser()
+    text = []
+    start = time.perf_counter()
+    async for chunk in cached_stream(chain, overall_analysis_template, query):
+        text.append(chunk)
+        for key, value in parser.feed(chunk):
+            if start is not None:
+                metrics.observe("llm_first_aspect", time.perf_counter() - start)
+                start = None
+            yield key, value
+    for key, value in parser.close():
+        yield key, value
+    yield None, parse_overall_result("".join(text))
+
+
+async def stream_overall_events(chain, query):
+    """Server-sent events of /overall-analyze/ with "stream": `aspect` {"key", "value"}, then `done` {"message", "results"}, or `error` {"detail"}."""
+    try:
+        async for key, value in overall_aspects(chain, query):
+            if key is None:
+                yield f"event: done\ndata: {json.dumps(value)}\n\n"
+            else:
+                yield f"event: aspect\ndata: {json.dumps({'key': key, 'value': value})}\n\n"
+    except Exception as e:
+        yield f"event: error\ndata: {json.dumps({'detail': f'Get Overall Analysis failed: {str(e)}'})}\n\n"
+
+
+# Sections of /analyze-all/: template and input variables of each analysis
+ANALYSIS_SECTIONS = {
+    "hb": (hb_analysis_template, hb_input_variables),
+    "hrv": (hrv_analysis_template, hrv_input_variables),
+    "stress": (stress_analysis_template, stress_input_variables),
+    "overall": (overall_analysis_template, overall_input_variables),
+}
+
+
+async def run_section(name, query, events):
+    """Run one analysis and put its events on the `events` queue, ending with ("end", name)."""
+    template, input_vars = ANALYSIS_SECTIONS[name]
+    chain = build_llm_chain(template=template, input_vars=input_vars)
+    try:
+        if name == "overall":
+            async for key, value in overall_aspects(chain, query):
+                if key is None:
+                    await events.put(("section", {"section": name, **value}))
+                else:
+                    await events.put(("aspect", {"section": name, "key": key, "value": value}))
         else:
-            return {
-                "message": "No JSON content found.",
-                "results": {}
-            }
-    
+            text = []
+            async for chunk in cached_stream(chain, template, query):
+                text.append(chunk)
+                await events.put(("delta", {"section": name, "text": chunk}))
+            await events.put(("section", {"section": name, "text": "".join(text)}))
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Get Overall Analysis failed: {str(e)}")
\ No newline at end of file
+        await events.put(("error", {"section": name, "detail": str(e)}))
+    finally:
+        await events.put(("end", name))
+
+
+@app.post("/analyze-all/", dependencies=[Depends(require_ready)])
+async def analyze_all(request: Request):
+    """
+    All four analyses in one request: the union of their inputs (bpms, sdnn, rmssd, pnn50,
+    stress_level, week, and history_result or user_id) in, server-sent events out.
+
+    The week context and the vector search are fetched once, then the four chains run
+    concurrently. Events: `delta` {"section", "text"} for each streamed chunk of hb, hrv
+    and stress; `aspect` {"section", "key", "value"} for each suggestion of overall as soon
+    as it is complete; `section` once a section is complete, with its full "text" (or "message"
+    and "results" for overall, like /overall-analyze/); `error` {"section", "detail"}
+    when one fails; and a final `done`.
+    """
+    try:
+        data = await request.json()
+
+        required_keys = set().union(*(input_vars for _, input_vars in ANALYSIS_SECTIONS.values()))
+        required_keys = required_keys - {"context"}
+        missing_keys = required_keys - data.keys()
+
+        if missing_keys:
+            raise Exception(f"Missing required keys: {list(missing_keys)}")
+
+        inputs = llm_cache.bin({k: data[k] for k in required_keys})
+        week = int(data['week'])
+        contexts = {
+            "stress": get_content_by_week(week),
+            "overall": await asearch(history_of(data), k=HISTORY_SEARCH_K, week=week),
+        }
+        queries = {}
+        for name, (_, input_vars) in ANALYSIS_SECTIONS.items():
+            queries[name] = {k: inputs[k] for k in input_vars if k != "context"}
+            if name in contexts:
+                queries[name]["context"] = contexts[name]
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Get Combined Analysis failed: {str(e)}")
+
+    async def events():
+        queue = asyncio.Queue()
+        tasks = [asyncio.create_task(run_section(name, query, queue)) for name, query in queries.items()]
+        try:
+            running = len(tasks)
+            while running:
+                kind, payload = await queue.get()
+                if kind == "end":
+                    running -= 1
+                    continue
+                yield f"event: {kind}\ndata: {json.dumps(payload)}\n\n"
+            yield "event: done\ndata: {}\n\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.post("/history/")
+async def record_session(request: Request):
+    """Record the results of a session: user_id, week, bpms, sdnn, rmssd, pnn50 and stress_level."""
+    try:
+        data = await request.json()
+
+        missing_keys = {"user_id", "week"} - data.keys()
+        if missing_keys:
+            raise Exception(f"Missing required keys: {list(missing_keys)}")
+
+        row = await asyncio.to_thread(history_store.append, data['user_id'], data['week'], data)
+        return {"message": "Session recorded", "session": row}
+
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=f"Record Session failed: {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Record Session failed: {str(e)}")
+
+
+@app.get("/history/weeks/{week}")
+def week_history(week: int):
+    """Mean and standard deviation of every metric over all the users' sessions of a pregnancy week."""
+    return history_store.week_summary(week)
+
+
+@app.get("/history/{user_id}")
+def user_history(user_id: str, sessions: int = 0):
+    """
+    Aggregates of a user's sessions (last value, recent and overall mean, standard deviation
+    and trend per week of every metric), with the `sessions` latest sessions when asked.
+    """
+    summary = history_store.summary(user_id)
+    if summary is None:
+        raise HTTPException(status_code=404, detail=f"Unknown user: {user_id}")
+    if sessions > 0:
+        summary["recent_sessions"] = history_store.sessions(user_id, limit=sessions)
+    return summary
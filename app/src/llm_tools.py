@@ -1,44 +1,217 @@
-from langchain.docstore.document import Document
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
-import re
-from langchain_openai import ChatOpenAI
-from langchain.prompts import PromptTemplate
 from dotenv import load_dotenv
+import asyncio
+from src.metrics import in_flight, observe, record_failure, timed
+import numpy as np
 import os
+import random
+import re
+import threading
+import time
 
 load_dotenv()
 
-llm = ChatOpenAI(
-  openai_api_key=os.getenv("API_KEY"),
-  openai_api_base="https://openrouter.ai/api/v1",
-  model_name=os.getenv("MODEL_NAME")
-)
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+VECTORDB_PATH = os.getenv("VECTORDB_PATH", "data/vectordb")
+HISTORY_SEARCH_K = int(os.getenv("HISTORY_SEARCH_K", "4"))  # chunks of the week matched with the history in the overall prompt
 
-embeddings_model = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-vectordb = FAISS.load_local("data/vectordb", embeddings_model, allow_dangerous_deserialization=True)
+LLM_API_BASE = os.getenv("LLM_API_BASE", "https://openrouter.ai/api/v1")  # OpenAI-compatible API (see benchmarks/mock_llm.py)
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))     # upstream calls at once per process
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "16"))    # pooled HTTP connections to the API
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))                  # seconds for an answer, or between two chunks
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))  # seconds, doubled per retry, full jitter
 
+# LLM client, embedding model and FAISS store, created on first use (see `load_resources`)
+_resources = {}
+_resources_lock = threading.Lock()
 
-def search(query, vectordb=vectordb, k=20):
-    # Perform similarity search
-    results = vectordb.similarity_search_with_score(query, k=k)
-    return results
-    
 
-def search_filter(results_with_score=None, vectordb=vectordb, week_filter=None, section_filter=None):
-    documents = results_with_score or [(doc, None) for doc in vectordb.docstore._dict.values()]
-    return [
-        (doc, score) for doc, score in documents
-        if (week_filter is None or doc.metadata.get("week") == week_filter)
-        and (section_filter is None or doc.metadata.get("section") == section_filter)
-    ]
+def get_llm():
+    with _resources_lock:
+        if "llm" not in _resources:
+            import httpx
+            from langchain_openai import ChatOpenAI
+
+            # one keep-alive connection pool shared by every request; retries are done in
+            # `ainvoke_llm_output`/`astream_llm_output`, with jitter
+            timeout = httpx.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT)
+            limits = httpx.Limits(max_connections=LLM_MAX_CONNECTIONS,
+                                  max_keepalive_connections=LLM_MAX_CONNECTIONS)
+            _resources["llm"] = ChatOpenAI(
+              openai_api_key=os.getenv("API_KEY"),
+              openai_api_base=LLM_API_BASE,
+              model_name=os.getenv("MODEL_NAME"),
+              http_async_client=httpx.AsyncClient(timeout=timeout, limits=limits),
+              request_timeout=LLM_TIMEOUT,
+              max_retries=0
+            )
+        return _resources["llm"]
+
+
+def get_vectordb():
+    with _resources_lock:
+        if "vectordb" not in _resources:
+            from langchain_huggingface import HuggingFaceEmbeddings
+            from langchain_community.vectorstores import FAISS
+
+            embeddings_model = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
+            _resources["vectordb"] = FAISS.load_local(VECTORDB_PATH, embeddings_model,
+                                                      allow_dangerous_deserialization=True)
+        return _resources["vectordb"]
+
+
+@timed("startup_load")
+def load_resources():
+    """
+    Create the LLM client, load the embedding model and the FAISS store, index the store
+    metadata, then run one query through them so the first request does not pay for lazy initialization.
+    Meant to run in the background while the server already answers `/health`.
+    """
+    get_llm()
+    build_llm_chain(template="{question}", input_vars=["question"])
+    get_metadata_index()
+    search("warm up", k=1)
+
+
+def get_embedding_service():
+    """Cached, micro-batched query embeddings with the model of the loaded store."""
+    vectordb = get_vectordb()
+    with _resources_lock:
+        if "embedding_service" not in _resources:
+            from src.embedding_service import EmbeddingService
+
+            _resources["embedding_service"] = EmbeddingService(vectordb.embedding_function)
+        return _resources["embedding_service"]
+
+
+def _uses_embedding_service(vectordb):
+    return vectordb is None or vectordb is _resources.get("vectordb")
+
+
+def search(query, vectordb=None, k=20, week=None, section=None):
+    """
+    Similarity search, returning (document, score) pairs like `similarity_search_with_score`.
+
+    With `week` and/or `section`, only the documents with that metadata are scored (exact
+    search over their own sub-index, see `MetadataIndex.subindex`), so the result holds
+    min(k, matching documents) pairs instead of whatever survives filtering a global top k.
+    """
+    if _uses_embedding_service(vectordb):
+        embedding = get_embedding_service().embed(query)
+    else:
+        embedding = vectordb._embed_query(query)
+    return search_by_vector(embedding, vectordb=vectordb, k=k, week=week, section=section)
+
+
+async def asearch(query, vectordb=None, k=20, week=None, section=None):
+    """`search` for async callers: the query is embedded off the event loop."""
+    if _uses_embedding_service(vectordb):
+        embedding = await get_embedding_service().aembed(query)
+    else:
+        embedding = await asyncio.to_thread(vectordb._embed_query, query)
+    return search_by_vector(embedding, vectordb=vectordb, k=k, week=week, section=section)
+
+
+@timed("vector_search")
+def search_by_vector(embedding, vectordb=None, k=20, week=None, section=None):
+    if vectordb is None:
+        vectordb = get_vectordb()
+    if week is None and section is None:
+        return vectordb.similarity_search_with_score_by_vector(embedding, k=k)
+
+    import faiss
+
+    subindex, ids = get_metadata_index(vectordb).subindex(week, section)
+    if not ids:
+        return []
+    vector = np.asarray([embedding], dtype=np.float32)
+    if vectordb._normalize_L2:
+        faiss.normalize_L2(vector)
+    scores, positions = subindex.search(vector, min(k, len(ids)))
+    docstore = vectordb.docstore._dict
+    return [(docstore[ids[p]], float(score)) for score, p in zip(scores[0], positions[0]) if p >= 0]
+
+
+class MetadataIndex:
+    """
+    Week and section indexes of the documents of a vector store, plus the formatted
+    context of every week, built in one pass so lookups are dictionary reads.
+
+    `signature` identifies the store content it was built from (docstore object, number of
+    documents, number of vectors); `get_metadata_index` rebuilds it when that changes.
+    """
+
+    def __init__(self, vectordb):
+        self.signature = self.signature_of(vectordb)
+        self.vectordb = vectordb
+        self.docstore = vectordb.docstore._dict
+        self.positions = {doc_id: position for position, doc_id in vectordb.index_to_docstore_id.items()}
+        self._subindexes = {}
+        self.ids_by_week = {}
+        self.ids_by_section = {}
+        self.ids_by_week_section = {}
+        for doc_id, doc in self.docstore.items():
+            week, section = doc.metadata.get("week"), doc.metadata.get("section")
+            self.ids_by_week.setdefault(week, []).append(doc_id)
+            self.ids_by_section.setdefault(section, []).append(doc_id)
+            self.ids_by_week_section.setdefault((week, section), []).append(doc_id)
+        self.week_context = {week: format_context(self.docstore[doc_id] for doc_id in ids)
+                             for week, ids in self.ids_by_week.items()}
 
-def get_content_by_week(week: int, vectordb=vectordb):
-    docs = search_filter(week_filter=week, vectordb=vectordb)
+    @staticmethod
+    def signature_of(vectordb):
+        return id(vectordb.docstore._dict), len(vectordb.docstore._dict), vectordb.index.ntotal
+
+    def ids(self, week=None, section=None):
+        """Docstore ids matching the filters (None: no filter on that field), in docstore order."""
+        if week is not None and section is not None:
+            return self.ids_by_week_section.get((week, section), [])
+        if week is not None:
+            return self.ids_by_week.get(week, [])
+        if section is not None:
+            return self.ids_by_section.get(section, [])
+        return list(self.docstore)
+
+    def subindex(self, week=None, section=None):
+        """
+        Flat FAISS index of the vectors of the documents matching the filters, built on first
+        use with the metric of the store's index.
+
+        Returns:
+            tuple: (index, ids), where position i of the index holds the vector of docstore id ids[i].
+        """
+        key = (week, section)
+        if key not in self._subindexes:
+            import faiss
+
+            ids = self.ids(week, section)
+            store_index = self.vectordb.index
+            subindex = faiss.IndexFlat(store_index.d, store_index.metric_type)
+            if ids:
+                subindex.add(np.vstack([store_index.reconstruct(self.positions[doc_id]) for doc_id in ids]))
+            self._subindexes[key] = (subindex, ids)
+        return self._subindexes[key]
+
+
+_metadata_indexes = {}
+
+
+def get_metadata_index(vectordb=None):
+    """The `MetadataIndex` of `vectordb` (default: the loaded store), rebuilt if the store changed."""
+    if vectordb is None:
+        vectordb = get_vectordb()
+    index = _metadata_indexes.get(id(vectordb))
+    if index is None or index.signature != MetadataIndex.signature_of(vectordb):
+        index = _metadata_indexes[id(vectordb)] = MetadataIndex(vectordb)
+    return index
+
+
+def format_context(docs):
     result = ""
     line = "=" * 50
 
-    for doc, score in docs:
+    for doc in docs:
         title = f"\nWEEK: {doc.metadata['week']}; SECTION: {doc.metadata['section']}\n\n"
         content = doc.page_content
 
@@ -47,16 +220,98 @@ def get_content_by_week(week: int, vectordb=vectordb):
     return result
 
 
-def stream_llm_output(llm_chain, query):
-    for chunk in llm_chain.stream(query):
-        # print(chunk.content, end="", flush=True)
-        yield chunk.content
+def search_filter(results_with_score=None, vectordb=None, week_filter=None, section_filter=None):
+    if not results_with_score:
+        # every document of the store, through the metadata index
+        index = get_metadata_index(vectordb)
+        return [(index.docstore[doc_id], None) for doc_id in index.ids(week_filter, section_filter)]
+    return [
+        (doc, score) for doc, score in results_with_score
+        if (week_filter is None or doc.metadata.get("week") == week_filter)
+        and (section_filter is None or doc.metadata.get("section") == section_filter)
+    ]
+
+@timed("context_lookup")
+def get_content_by_week(week: int, vectordb=None):
+    return get_metadata_index(vectordb).week_context.get(week, "")
+
+
+_upstream_slots = None
+
+
+def upstream_slots():
+    """Semaphore bounding the upstream LLM calls of this process to LLM_MAX_CONCURRENCY."""
+    global _upstream_slots
+    if _upstream_slots is None:
+        _upstream_slots = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+    return _upstream_slots
+
+
+def retryable_errors():
+    import openai
+
+    return (asyncio.TimeoutError, openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)
+
+
+async def backoff(attempt):
+    """Sleep before retry number `attempt` (0-based): exponential, with full jitter."""
+    await asyncio.sleep(random.uniform(0, LLM_RETRY_BASE_DELAY * 2 ** attempt))
+
+
+async def astream_llm_output(llm_chain, query):
+    """
+    Stream the answer of `llm_chain` chunk by chunk.
+
+    Waiting more than LLM_TIMEOUT for the next chunk is an error. Connection errors,
+    timeouts, 429 and 5xx answers are retried up to LLM_MAX_RETRIES times, but only before
+    the first chunk was sent, so a partial answer is never repeated.
+    """
+    errors = retryable_errors()
+    async with upstream_slots():
+        with in_flight("llm_calls"), timed("llm_total"):
+            for attempt in range(LLM_MAX_RETRIES + 1):
+                start = time.perf_counter()
+                first_token = True
+                chunks = llm_chain.astream(query).__aiter__()
+                try:
+                    while True:
+                        try:
+                            chunk = await asyncio.wait_for(chunks.__anext__(), LLM_TIMEOUT)
+                        except StopAsyncIteration:
+                            return
+                        if first_token:
+                            observe("llm_ttft", time.perf_counter() - start)
+                            first_token = False
+                        yield chunk.content
+                except errors:
+                    if not first_token or attempt == LLM_MAX_RETRIES:
+                        raise
+                    record_failure("llm_retry")
+                finally:
+                    await chunks.aclose()
+                await backoff(attempt)
+
+
+async def ainvoke_llm_output(llm_chain, query):
+    """The whole answer of `llm_chain`, with the timeout and retries of `astream_llm_output`."""
+    errors = retryable_errors()
+    async with upstream_slots():
+        with in_flight("llm_calls"), timed("llm_total"):
+            for attempt in range(LLM_MAX_RETRIES + 1):
+                try:
+                    return (await asyncio.wait_for(llm_chain.ainvoke(query), LLM_TIMEOUT)).content
+                except errors:
+                    if attempt == LLM_MAX_RETRIES:
+                        raise
+                    record_failure("llm_retry")
+                await backoff(attempt)
 
-def invoke_llm_output(llm_chain, query):
-    return llm_chain.invoke(query).content
 
+def build_llm_chain(template, input_vars, llm=None):
+    from langchain.prompts import PromptTemplate
 
-def build_llm_chain(template, input_vars, llm=llm):
+    if llm is None:
+        llm = get_llm()
     prompt = PromptTemplate(
         template=template, 
         input_variables=input_vars
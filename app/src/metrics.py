@@ -0,0 +1,91 @@
+import time
+from contextlib import contextmanager
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+# From sub-millisecond steps (peak detection) to whole videos
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+STAGE_SECONDS = Histogram("momvital_stage_seconds", "Time spent in one processing stage",
+                          ["stage"], buckets=STAGE_BUCKETS)
+FAILURES = Counter("momvital_failures_total", "Failed operations", ["stage"])
+CACHE_REQUESTS = Counter("momvital_cache_requests_total", "Cache lookups", ["cache", "result"])
+IN_FLIGHT = Gauge("momvital_in_flight", "Operations in progress", ["operation"])
+
+# Observations made while recording, to be sent to another process (see `start_recording`)
+_records = None
+
+
+def observe(stage, seconds):
+    """Record the duration of one run of `stage`."""
+    STAGE_SECONDS.labels(stage).observe(seconds)
+    if _records is not None:
+        _records.append(("stage", stage, seconds))
+
+
+def record_failure(stage):
+    FAILURES.labels(stage).inc()
+    if _records is not None:
+        _records.append(("failure", stage, 1))
+
+
+def record_cache(cache, hit):
+    result = "hit" if hit else "miss"
+    CACHE_REQUESTS.labels(cache, result).inc()
+    if _records is not None:
+        _records.append(("cache", (cache, result), 1))
+
+
+@contextmanager
+def timed(stage):
+    """
+    Context manager (or decorator) observing the duration of `stage` and counting its failures.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        record_failure(stage)
+        raise
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+
+def in_flight(operation):
+    """Context manager (or decorator) counting `operation` as in progress while it runs."""
+    return IN_FLIGHT.labels(operation).track_inprogress()
+
+
+def start_recording():
+    """
+    Also keep every observation in a list from now on. Worker processes have their own
+    metrics, which nobody scrapes; they send `drain()` with each reply and the server
+    process `replay`s it into its own metrics.
+    """
+    global _records
+    _records = []
+
+
+def drain():
+    """Return and forget the observations recorded so far."""
+    global _records
+    records, _records = _records or [], ([] if _records is not None else None)
+    return records
+
+
+def replay(records):
+    for kind, name, value in records:
+        if kind == "stage":
+            STAGE_SECONDS.labels(name).observe(value)
+        elif kind == "failure":
+            FAILURES.labels(name).inc(value)
+        elif kind == "cache":
+            CACHE_REQUESTS.labels(*name).inc(value)
+
+
+def render():
+    """
+    Returns:
+        tuple: (body, content_type) of the Prometheus text exposition of every metric.
+    """
+    return generate_latest(), CONTENT_TYPE_LATEST
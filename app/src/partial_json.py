@@ -0,0 +1,202 @@
+import ast
+import json
+
+QUOTES = "'\""
+CLOSERS = ",:}]"
+MAX_KEY_LENGTH = 64  # longest key accepted as the next member after a possibly closing quote
+
+
+def decode_value(text):
+    """
+    Value of one JSON / Python literal, as written by a model: JSON first, then a Python
+    literal (single quotes), then, for a quoted string that neither accepts (e.g. an
+    unescaped quote inside), its text between the outer quotes.
+    """
+    text = text.strip()
+    for parse in (json.loads, ast.literal_eval):
+        try:
+            return parse(text)
+        except (ValueError, SyntaxError):
+            pass
+    if len(text) >= 2 and text[0] in QUOTES and text[-1] == text[0]:
+        quote = text[0]
+        return text[1:-1].replace("\\" + quote, quote).replace("\\n", "\n")
+    if text[:1] in QUOTES:
+        return text[1:]  # string cut off by the end of the answer
+    return text
+
+
+class PartialObjectParser:
+    """
+    Incremental, tolerant parser of the top-level object of a model answer.
+
+    Text is fed as it streams; `feed` returns the members of the object whose value just
+    closed, so each one can be used before the answer is complete. Text before the first
+    `{` (such as a ```json fence) is skipped. Strings may use single or double quotes, and
+    an unescaped quote inside a value does not end it: in a member of the top-level
+    object, a quote only closes a key when `:` follows, and a value when `}` follows or
+    `,` and the next quoted key with its `:` (see `_closes`), so apostrophes and quoted
+    words survive. The text after a candidate quote is held back until that is decided,
+    across chunks. In nested objects and arrays, any of `,:}]` after a quote closes it.
+    """
+
+    def __init__(self):
+        self.members = {}
+        self.done = False
+        self._depth = 0
+        self._quote = None         # quote of the string being read
+        self._escaped = False
+        self._has_value = False    # the member being read is past its `:`
+        self._ahead = None         # text after a quote that may close the string, until decided
+        self._member = []
+
+    def feed(self, text):
+        """
+        Parameters:
+            text (str): Next chunk of the answer.
+
+        Returns:
+            list: (key, value) pairs completed by this chunk, in order.
+        """
+        completed = []
+        for char in text:
+            if self.done:
+                break
+            self._feed_char(char, completed)
+        return completed
+
+    def close(self):
+        """Members still open when the answer ended (an unterminated object), parsed as far as possible."""
+        completed = []
+        if self._ahead is not None:
+            # the answer ended after the quote: it closed its string
+            ahead, self._ahead, self._quote = self._ahead, None, None
+            for char in ahead:
+                if not self.done:
+                    self._feed_char(char, completed)
+        if not self.done and self._depth > 0:
+            self._close_member(completed)
+            self.done = True
+        return completed
+
+    def _feed_char(self, char, completed):
+        if self._depth == 0:
+            if char == "{":
+                self._depth = 1
+            return
+        if self._ahead is not None:
+            self._ahead += char
+            closes = _closes(self._ahead, strict=self._depth == 1, key=not self._has_value)
+            if closes is None:
+                return
+            ahead, self._ahead = self._ahead, None
+            if closes:
+                self._quote = None
+            # replay the held back text, in or out of the string
+            for held in ahead:
+                if not self.done:
+                    self._feed_char(held, completed)
+            return
+        if self._quote is not None:
+            self._member.append(char)
+            if self._escaped:
+                self._escaped = False
+            elif char == "\\":
+                self._escaped = True
+            elif char == self._quote:
+                self._ahead = ""
+            return
+
+        if char in QUOTES:
+            self._quote = char
+        elif char in "{[":
+            self._depth += 1
+        elif char in "}]":
+            self._depth -= 1
+            if self._depth == 0:
+                self._close_member(completed)
+                self.done = True
+                return
+        elif char == "," and self._depth == 1:
+            self._close_member(completed)
+            return
+        elif char == ":" and self._depth == 1:
+            self._has_value = True
+        self._member.append(char)
+
+    def _close_member(self, completed):
+        member = "".join(self._member).strip()
+        self._member = []
+        self._has_value = False
+        key, value = _split_member(member)
+        if key is None:
+            return
+        self.members[key] = value
+        completed.append((key, value))
+
+
+def _closes(ahead, strict, key):
+    """
+    Whether the quote followed by `ahead` closes its string: True, False, or None while
+    `ahead` is too short to tell.
+
+    Parameters:
+        strict (bool): Quote of a member of the top-level object. A key is closed by `:`,
+            a value by `}` or by `,` and the next quoted key (word characters, spaces and
+            dashes) with its `:`. Otherwise any of `,:}]` closes.
+        key (bool): The string is the key of its member.
+    """
+    rest = ahead.lstrip()
+    if not rest:
+        return None
+    if not strict:
+        return rest[0] in CLOSERS
+    if key:
+        return rest[0] == ":"
+    if rest[0] == "}":
+        return True
+    if rest[0] != ",":
+        return False
+    rest = rest[1:].lstrip()
+    if not rest:
+        return None
+    if rest[0] not in QUOTES:
+        return False
+    for i, char in enumerate(rest[1:MAX_KEY_LENGTH + 2], start=1):
+        if char == rest[0]:
+            after = rest[i + 1:].lstrip()
+            return (after[0] == ":" and i > 1) if after else None
+        if not (char.isalnum() or char in "_- "):
+            return False
+    return None if len(rest) <= MAX_KEY_LENGTH + 1 else False
+
+
+def _split_member(member):
+    """Split `key: value` at the first colon outside quotes."""
+    quote = None
+    escaped = False
+    for i, char in enumerate(member):
+        if quote is not None:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == quote:
+                quote = None
+        elif char in QUOTES:
+            quote = char
+        elif char == ":":
+            key = decode_value(member[:i])
+            value = member[i + 1:].strip()
+            if not value:
+                return None, None
+            return str(key), decode_value(value)
+    return None, None
+
+
+def parse_object(text):
+    """Members of the first object in `text`, tolerating what `PartialObjectParser` tolerates."""
+    parser = PartialObjectParser()
+    parser.feed(text)
+    parser.close()
+    return parser.members
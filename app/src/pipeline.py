@@ -0,0 +1,179 @@
+import asyncio
+import json
+import math
+import os
+
+from src import metrics
+
+LLM_SERVER_URL = os.getenv("LLM_SERVER_URL", "http://127.0.0.1:3001")       # llm_server, called by /pipeline/
+PIPELINE_LLM_TIMEOUT = float(os.getenv("PIPELINE_LLM_TIMEOUT", "120"))      # seconds without data from llm_server
+PIPELINE_LLM_CONNECTIONS = int(os.getenv("PIPELINE_LLM_CONNECTIONS", "16"))  # pooled connections to llm_server
+
+# llm_server endpoint of each analysis, and the video metrics it needs before it can start
+SECTIONS = {
+    "hb": ("/hb-analyze/", ("bpms",)),
+    "hrv": ("/hrv-analyze/", ("sdnn", "rmssd", "pnn50")),
+    "stress": ("/stress-analyze/", ("stress_level",)),
+    "overall": ("/overall-analyze/", ("stress_level", "bpms", "sdnn", "rmssd", "pnn50")),
+}
+
+
+class LLMClient:
+    """
+    Client of llm_server over one pooled HTTP connection pool, so the two services stay
+    separately deployable (and in their own environments) while the pipeline drives both.
+    """
+
+    def __init__(self, base_url=LLM_SERVER_URL, timeout=PIPELINE_LLM_TIMEOUT,
+                 max_connections=PIPELINE_LLM_CONNECTIONS):
+        import httpx
+
+        self.client = httpx.AsyncClient(base_url=base_url, timeout=httpx.Timeout(timeout, connect=5),
+                                        limits=httpx.Limits(max_connections=max_connections))
+
+    async def close(self):
+        await self.client.aclose()
+
+    async def prefetch_context(self, week, history_result, user_id=None):
+        """Warm llm_server's week context and the embedding of the history; failures only cost the warm-up."""
+        try:
+            await self.client.post("/prefetch-context/",
+                                   json={"week": week, "history_result": history_result, "user_id": user_id})
+        except Exception as e:
+            print(f"Context prefetch failed: {e}")
+
+    async def record_session(self, user_id, week, results):
+        """Store the metrics of this session in llm_server's per-user history."""
+        response = await self.client.post("/history/", json={**results, "user_id": user_id, "week": week})
+        if response.status_code != 200:
+            raise RuntimeError(f"/history/ answered {response.status_code}: {response.text[:200]}")
+
+    async def stream(self, path, payload):
+        """
+        POST `payload` to `path` and yield (event, data) as the answer arrives: a plain text
+        stream gives ("delta", text) chunks, server-sent events are decoded from JSON.
+        """
+        async with self.client.stream("POST", path, json=payload) as response:
+            if response.status_code != 200:
+                body = (await response.aread()).decode(errors="replace")
+                raise RuntimeError(f"{path} answered {response.status_code}: {body[:200]}")
+            if not response.headers.get("content-type", "").startswith("text/event-stream"):
+                async for text in response.aiter_text():
+                    yield "delta", text
+                return
+            event, data = "message", []
+            async for line in response.aiter_lines():
+                if line.startswith("event:"):
+                    event = line[6:].strip()
+                elif line.startswith("data:"):
+                    data.append(line[5:].strip())
+                elif not line and data:
+                    yield event, json.loads("\n".join(data))
+                    event, data = "message", []
+
+
+async def job_metrics(job):
+    """
+    Async generator of the metrics of a video job as they become known: the parts it
+    reports while running (see `Job.report`), then the rest of its result.
+
+    Raises:
+        RuntimeError: When the job failed or expired.
+    """
+    sent = set()
+    while True:
+        seen = job.version
+        fresh = {k: v for k, v in job.partial.items() if k not in sent}
+        if job.finished:
+            if job.status != "done":
+                raise RuntimeError(f"Video Analyzing failed: {job.error}")
+            fresh = {k: v for k, v in job.result.items() if k not in sent}
+        if fresh:
+            sent.update(fresh)
+            yield fresh
+        if job.finished:
+            return
+        await job.wait_change(since=seen)
+
+
+async def run_pipeline(updates, llm, week, history_result, user_id=None):
+    """
+    Async generator of the (event, data) of a video → suggestions run.
+
+    Each analysis is sent to llm_server as soon as the metrics it needs are in `updates`
+    (an async iterator of metric dicts, e.g. `job_metrics`), so the heart rate analysis
+    streams while the HRV is still being computed. Events: `metrics` with newly known
+    metrics; `delta` {"section", "text"} and `aspect` {"section", "key", "value"} while an
+    analysis streams; `section` when one is complete; `error` {"section", "detail"}; and a
+    final `done` {"results"} with every metric.
+
+    With a `user_id`, llm_server uses that user's stored history when `history_result` is
+    empty, and the session is added to it once every analysis is done.
+    """
+    events = asyncio.Queue()
+    known = {}
+    started = {}
+
+    async def run_section(name, path):
+        payload = {**{k: known[k] for k in SECTIONS[name][1]}, "week": week, "stream": True}
+        if name == "overall":
+            payload.update(history_result=history_result, user_id=user_id)
+        text = []
+        try:
+            async for event, data in llm.stream(path, payload):
+                if event == "delta":
+                    text.append(data)
+                    await events.put(("delta", {"section": name, "text": data}))
+                elif event == "aspect":
+                    await events.put(("aspect", {"section": name, **data}))
+                elif event == "done":
+                    await events.put(("section", {"section": name, **data}))
+                elif event == "error":
+                    raise RuntimeError(data.get("detail"))
+            if name != "overall":
+                await events.put(("section", {"section": name, "text": "".join(text)}))
+        except Exception as e:
+            metrics.record_failure("pipeline_llm")
+            await events.put(("error", {"section": name, "detail": str(e)}))
+        finally:
+            await events.put(("end", name))
+
+    async def follow_metrics():
+        try:
+            async for update in updates:
+                known.update(update)
+                await events.put(("metrics", update))
+                for name, (path, needs) in SECTIONS.items():
+                    if name not in started and all(k in known for k in needs):
+                        # "start" is queued before this task's "end", so the consumer never sees zero running
+                        started[name] = asyncio.create_task(run_section(name, path))
+                        await events.put(("start", name))
+        except Exception as e:
+            await events.put(("error", {"section": "video", "detail": str(e)}))
+        finally:
+            await events.put(("end", "video"))
+
+    follower = asyncio.create_task(follow_metrics())
+    try:
+        running = 1
+        while running:
+            kind, payload = await events.get()
+            if kind == "start":
+                running += 1
+            elif kind == "end":
+                running -= 1
+            else:
+                yield kind, payload
+        # after the analyses, so the stored history they used does not include this session; a
+        # session without every metric (e.g. too few beats for the HRV) is not recorded
+        if user_id is not None and all(isinstance(known.get(k), (int, float)) and math.isfinite(known[k])
+                                       for k in SECTIONS["overall"][1]):
+            try:
+                await llm.record_session(user_id, week, known)
+            except Exception as e:
+                yield "error", {"section": "history", "detail": str(e)}
+        yield "done", {"results": known}
+    finally:
+        follower.cancel()
+        for task in started.values():
+            task.cancel()
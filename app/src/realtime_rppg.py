@@ -0,0 +1,135 @@
+import math
+import os
+
+import cv2
+import numpy as np
+
+from src.data_process_tools import VHR_PARAMS, adaptive_peak_detection, convert_np_type
+from src.hrv_tools import OnlineHRV
+from src.vhr_stages import FaceSkinExtractor, rgb_trace_to_bvp
+
+RT_UPDATE_INTERVAL = float(os.getenv("RT_UPDATE_INTERVAL", "1.0"))   # seconds of video between two readouts
+RT_HRV_WINDOW = int(os.getenv("RT_HRV_WINDOW", "60"))                # NN intervals in the rolling HRV
+RT_MAX_SESSIONS = int(os.getenv("RT_MAX_SESSIONS", "4"))             # concurrent WebSocket sessions
+MIN_NNI, MAX_NNI = 60000 / 180, 60000 / 40                           # ms, plausible beat-to-beat range
+
+
+class RingBuffer:
+    """Fixed-capacity circular buffer of equally shaped samples backed by one NumPy array."""
+
+    def __init__(self, capacity, sample_shape, dtype=np.float32):
+        self._data = np.zeros((capacity,) + tuple(sample_shape), dtype=dtype)
+        self._next = 0
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def append(self, sample):
+        self._data[self._next] = sample
+        self._next = (self._next + 1) % len(self._data)
+        self._size = min(self._size + 1, len(self._data))
+
+    def last(self, n):
+        """The `n` most recent samples, oldest first."""
+        n = min(n, self._size)
+        idx = (self._next - n + np.arange(n)) % len(self._data)
+        return self._data[idx]
+
+
+def decode_frame(data, frame_format="jpeg", width=None, height=None):
+    """
+    Turn a WebSocket binary message into a BGR frame.
+
+    Parameters:
+        data (bytes): An encoded image (JPEG, PNG, WebP...) or raw pixels.
+        frame_format (str): 'raw' for raw `bgr24` pixels of `width` x `height`, anything else
+            for an encoded image.
+    """
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    if frame_format == "raw":
+        return buffer.reshape(height, width, 3)
+    frame = cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+    if frame is None:
+        raise ValueError("Cannot decode frame")
+    return frame
+
+
+class RealtimeRPPG:
+    """
+    Rolling rPPG estimation over a live stream of frames.
+
+    Each frame goes through the skin ROI step and only its mean skin RGB is kept, in a ring
+    buffer holding one `winsize` window. Every `update_interval` seconds of video the CHROM
+    step runs on the latest window, giving a BPM, and the peaks found in the part of the
+    window not seen yet are turned into NN intervals for an incremental HRV accumulator.
+
+    Parameters:
+        fps (float): Frame rate of the incoming stream.
+        extractor_params (dict, optional): Keyword arguments of `FaceSkinExtractor`.
+        update_interval (float): Seconds of video between two readouts.
+        hrv_window (int): NN intervals in the rolling HRV.
+    """
+
+    def __init__(self, fps, extractor_params=None, update_interval=RT_UPDATE_INTERVAL, hrv_window=RT_HRV_WINDOW):
+        self.fps = fps
+        self.winsize = VHR_PARAMS['winsize']
+        self.window_length = math.ceil(self.winsize * fps)
+        self.update_frames = max(1, round(update_interval * fps))
+        self.extractor = FaceSkinExtractor(**(extractor_params or {}))
+        self.trace = RingBuffer(self.window_length, (1, 3))
+        self.hrv = OnlineHRV(window=hrv_window)
+        self.frames = 0
+        self.bpm = None
+        self._last_update = 0
+        self._last_peak = None
+
+    def add_frame(self, frame):
+        self.trace.append(self.extractor(frame))
+        self.frames += 1
+
+    def ready(self):
+        """Whether enough new frames arrived for the next readout."""
+        return len(self.trace) >= self.window_length and self.frames - self._last_update >= self.update_frames
+
+    def update(self):
+        """Run CHROM on the latest window, update BPM and HRV, and return the readout."""
+        window = self.trace.last(self.window_length)
+        window_start = self.frames - self.window_length
+        bvps, _, bpmES = rgb_trace_to_bvp(window, self.fps,
+                                          winsize=self.winsize,
+                                          method=VHR_PARAMS['method'],
+                                          pre_filt=VHR_PARAMS['pre_filt'],
+                                          post_filt=VHR_PARAMS['post_filt'],
+                                          cuda=VHR_PARAMS['cuda'])
+        self.bpm = float(np.ravel(bpmES[0].tolist())[0])
+
+        # peaks too close to the window end may still move, leave them for the next window
+        signal = np.ravel(np.asarray(bvps[0]))
+        margin = round(0.25 * self.fps)
+        peaks = adaptive_peak_detection(signal, fs=self.fps) + window_start
+        for peak in peaks[peaks < self.frames - margin]:
+            if self._last_peak is not None:
+                nni = (peak - self._last_peak) * 1000.0 / self.fps
+                if nni < MIN_NNI:
+                    continue  # same beat seen again in an overlapping window
+                if nni <= MAX_NNI:
+                    self.hrv.update(nni)
+            self._last_peak = peak
+
+        self._last_update = self.frames
+        return self.readout()
+
+    def readout(self):
+        hrv = {k: (None if isinstance(v, float) and math.isnan(v) else convert_np_type(v))
+               for k, v in self.hrv.result().items() if k in ('nni_counter', 'sdnn', 'rmssd', 'pnn50', 'hr_mean')}
+        return {
+            "type": "update",
+            "time": round(self.frames / self.fps, 2),
+            "frames": self.frames,
+            "bpm": self.bpm,
+            "hrv": hrv,
+        }
+
+    def close(self):
+        self.extractor.close()
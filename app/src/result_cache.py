@@ -0,0 +1,140 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from src import metrics
+
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR", "result_cache")
+RESULT_CACHE_MEMORY_ENTRIES = int(os.getenv("RESULT_CACHE_MEMORY_ENTRIES", "1024"))
+RESULT_CACHE_DISK_BYTES = int(os.getenv("RESULT_CACHE_DISK_BYTES", str(64 * 1024 * 1024)))
+
+# Bumped when stored results can no longer be trusted. 2: uploads used to be saved under the
+# client file name, so a queued job could process another upload's bytes and store that
+# result under its own digest
+CACHE_KEY_VERSION = 2
+
+
+def make_cache_key(video_digest, params):
+    """
+    Key a result by the content of the video and every parameter that affects it.
+
+    Parameters:
+        video_digest (str): Hex SHA-256 of the bytes that were processed.
+        params (dict): JSON-serializable processing parameters.
+
+    Returns:
+        str: Hex SHA-256 cache key.
+    """
+    encoded_params = json.dumps(params, sort_keys=True, default=str)
+    return hashlib.sha256(f"v{CACHE_KEY_VERSION}:{video_digest}:{encoded_params}".encode()).hexdigest()
+
+
+class ResultCache:
+    """
+    Two-level LRU cache of video results: an in-memory dict bounded by entry
+    count in front of a directory of JSON files bounded by total size. Disk recency is
+    tracked through file mtimes, so the cache survives restarts and is shared by workers.
+
+    Parameters:
+        cache_dir (str): Directory for the on-disk level (None disables it).
+        max_memory_entries (int): Entries kept in memory.
+        max_disk_bytes (int): Total size of the on-disk level.
+    """
+
+    def __init__(self, cache_dir=RESULT_CACHE_DIR, max_memory_entries=RESULT_CACHE_MEMORY_ENTRIES,
+                 max_disk_bytes=RESULT_CACHE_DISK_BYTES):
+        self.cache_dir = cache_dir
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_bytes = 0
+        self.stats = {"hits": 0, "memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            self._disk_bytes = sum(entry.stat().st_size for entry in os.scandir(cache_dir)
+                                   if entry.name.endswith(".json"))
+
+    def get(self, key):
+        """Return the cached result for `key`, or None."""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.stats["hits"] += 1
+                self.stats["memory_hits"] += 1
+                metrics.record_cache("result", hit=True)
+                return self._memory[key]
+
+        result = self._read_disk(key)
+        with self._lock:
+            if result is None:
+                self.stats["misses"] += 1
+            else:
+                self.stats["hits"] += 1
+                self.stats["disk_hits"] += 1
+                self._remember(key, result)
+        metrics.record_cache("result", hit=result is not None)
+        return result
+
+    def put(self, key, result):
+        with self._lock:
+            self._remember(key, result)
+        if self.cache_dir:
+            self._write_disk(key, result)
+
+    def info(self):
+        with self._lock:
+            return {**self.stats, "memory_entries": len(self._memory), "disk_bytes": self._disk_bytes}
+
+    def _remember(self, key, result):
+        self._memory[key] = result
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _read_disk(self, key):
+        if not self.cache_dir:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "r") as file:
+                result = json.load(file)
+            os.utime(path)  # mark as recently used
+            return result
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write_disk(self, key, result):
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(result, file)
+        size = os.path.getsize(tmp_path)
+        previous = os.path.getsize(path) if os.path.exists(path) else 0
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._disk_bytes += size - previous
+            if self._disk_bytes > self.max_disk_bytes:
+                self._evict_disk()
+
+    def _evict_disk(self):
+        """Delete least recently used files until the directory is back to 90% of its budget."""
+        entries = sorted((entry for entry in os.scandir(self.cache_dir) if entry.name.endswith(".json")),
+                         key=lambda entry: entry.stat().st_mtime)
+        target = self.max_disk_bytes * 0.9
+        for entry in entries:
+            if self._disk_bytes <= target:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+            except FileNotFoundError:
+                continue
+            self._disk_bytes -= size
+            self.stats["evictions"] += 1
@@ -0,0 +1,184 @@
+import functools
+import os
+
+import numpy as np
+
+from src.metrics import record_failure
+
+
+def _optional_float(name):
+    value = os.getenv(name, "")
+    return float(value) if value else None
+
+
+# Gates applied while the skin RGB trace is extracted (see `SignalQualityMonitor`)
+QUALITY_PARAMS = {
+    # early rejection: 0 disables it
+    'reject_after': float(os.getenv('VHR_REJECT_AFTER', '3')),                 # seconds of video before the face/lighting check
+    'min_face_ratio': float(os.getenv('VHR_REJECT_MIN_FACE_RATIO', '0.5')),   # share of frames with skin pixels
+    'min_brightness': float(os.getenv('VHR_REJECT_MIN_BRIGHTNESS', '30')),    # mean skin level, 0-255
+    'min_snr': _optional_float('VHR_REJECT_MIN_SNR'),                         # dB, median of the first windows (unset: off)
+    'reject_windows': int(os.getenv('VHR_REJECT_WINDOWS', '3')),
+    # early termination: unset target disables it
+    'target_snr': _optional_float('VHR_EARLY_STOP_SNR'),                      # dB every recent window must reach
+    'stop_windows': int(os.getenv('VHR_EARLY_STOP_WINDOWS', '5')),
+    'max_bpm_spread': float(os.getenv('VHR_EARLY_STOP_BPM_SPREAD', '3')),     # BPM range of those windows
+    'min_seconds': float(os.getenv('VHR_EARLY_STOP_MIN_SECONDS', '20')),      # never stop before, HRV needs the beats
+}
+
+
+class SignalQualityError(ValueError):
+    """The video cannot give a usable pulse signal; `reason` says why."""
+
+    expected = True  # an outcome to report to the user, not a processing failure
+
+    def __init__(self, reason):
+        super().__init__(f"Unusable video: {reason}")
+        self.reason = reason
+
+    def __reduce__(self):
+        # rebuilt from `reason` when sent back from a worker process, not from the message
+        return type(self), (self.reason,)
+
+
+def window_snr(rgb, fps, min_hz=0.65, max_hz=4.0):
+    """
+    Spectral SNR of one window of skin RGB means, after a CHROM projection: power within
+    0.1 Hz of the spectral peak and 0.2 Hz of its first harmonic, over the rest of the
+    pulse band (de Haan & Jeanne, 2013).
+
+    Parameters:
+        rgb (numpy.ndarray): RGB means, shape (n_frames, 3).
+        fps (float): Frame rate.
+
+    Returns:
+        tuple: (snr_db, bpm) of the window.
+    """
+    valid = np.all(np.isfinite(rgb), axis=1) & (rgb.min(axis=1) > 0)
+    if valid.mean() < 0.5:
+        return -np.inf, np.nan
+    rgb = rgb[valid] / rgb[valid].mean(axis=0)
+    x = 3 * rgb[:, 0] - 2 * rgb[:, 1]
+    y = 1.5 * rgb[:, 0] + rgb[:, 1] - 1.5 * rgb[:, 2]
+
+    n = len(x)
+    n_fft = max(2048, 1 << (n - 1).bit_length())
+    freqs = np.fft.rfftfreq(n_fft, 1 / fps)
+    band = (freqs >= min_hz) & (freqs <= max_hz)
+
+    def bandpass(v):
+        return np.fft.irfft(np.fft.rfft(v - v.mean(), n_fft) * band, n_fft)[:n]
+
+    xf, yf = bandpass(x), bandpass(y)
+    pulse = xf - (xf.std() / max(yf.std(), 1e-12)) * yf
+    power = np.abs(np.fft.rfft(pulse * np.hanning(n), n_fft)) ** 2
+    f0 = freqs[band][np.argmax(power[band])]
+    signal = band & ((np.abs(freqs - f0) <= 0.1) | (np.abs(freqs - 2 * f0) <= 0.2))
+    snr = 10 * np.log10(max(power[signal].sum(), 1e-12) / max(power[band & ~signal].sum(), 1e-12))
+    return float(snr), float(f0 * 60)
+
+
+class SignalQualityMonitor:
+    """
+    Progressive signal-quality index of a skin RGB trace, updated as frames are added.
+
+    Every second of video, once a first `winsize` window is complete, the SNR and BPM of
+    the latest window are computed (the windows pyVHR will use). This supports two gates:
+
+    - early rejection: after `reject_after` seconds, too few frames with a face or too
+      dark a face raise `SignalQualityError`, and so does a median SNR below `min_snr`
+      over the first `reject_windows` windows;
+    - early termination: after `min_seconds`, `observe` returns True once the last
+      `stop_windows` windows all reach `target_snr` and agree on the BPM within
+      `max_bpm_spread`, so the caller can stop extracting frames.
+
+    Parameters:
+        fps (float): Frame rate of the trace.
+        winsize (float): Window size in seconds, as in VHR_PARAMS.
+        params (dict): Thresholds, see QUALITY_PARAMS.
+    """
+
+    def __init__(self, fps, winsize=6, params=QUALITY_PARAMS):
+        self.fps = fps
+        self.params = params
+        self.window = max(2, int(round(winsize * fps)))
+        self.step = max(1, int(round(fps)))
+        self.snr = []
+        self.bpm = []
+        self.input_checked = False
+        self.stopped_early = False
+
+    def observe(self, trace):
+        """
+        Parameters:
+            trace (numpy.ndarray): Skin RGB trace so far, shape (n_frames, 1, 3).
+
+        Returns:
+            bool: True when the signal is good enough to stop.
+
+        Raises:
+            SignalQualityError: When the video is clearly unusable.
+        """
+        n = len(trace)
+        if n == 0 or n % self.step:
+            return False
+        params = self.params
+        seconds = n / self.fps
+        rejecting = params['reject_after'] > 0
+
+        if rejecting and not self.input_checked and seconds >= params['reject_after']:
+            self.input_checked = True
+            self._check_input(trace[:, 0])
+
+        if n < self.window:
+            return False
+        snr, bpm = window_snr(trace[n - self.window:n, 0], self.fps)
+        self.snr.append(snr)
+        self.bpm.append(bpm)
+
+        if rejecting and params['min_snr'] is not None and len(self.snr) == params['reject_windows']:
+            median = float(np.median(self.snr))
+            if median < params['min_snr']:
+                self._reject(f"no pulse signal found (SNR {median:.1f} dB)")
+
+        if params['target_snr'] is None or seconds < params['min_seconds']:
+            return False
+        recent_snr = self.snr[-params['stop_windows']:]
+        recent_bpm = np.asarray(self.bpm[-params['stop_windows']:])
+        if (len(recent_snr) == params['stop_windows'] and min(recent_snr) >= params['target_snr']
+                and np.all(np.isfinite(recent_bpm)) and np.ptp(recent_bpm) <= params['max_bpm_spread']):
+            self.stopped_early = True
+            return True
+        return False
+
+    def apply(self, trace):
+        """
+        Run the gates over an already complete trace, as if it was observed frame by frame.
+
+        Returns:
+            numpy.ndarray: `trace` up to where `observe` would have stopped.
+        """
+        for n in range(self.step, len(trace) + 1, self.step):
+            if self.observe(trace[:n]):
+                return trace[:n]
+        return trace
+
+    def _check_input(self, rgb):
+        valid = np.all(np.isfinite(rgb), axis=1) & (rgb.min(axis=1) > 0)
+        face_ratio = valid.mean()
+        if face_ratio < self.params['min_face_ratio']:
+            self._reject(f"face found in {face_ratio:.0%} of the frames")
+        brightness = rgb[valid].mean()
+        if brightness < self.params['min_brightness']:
+            self._reject(f"face too dark (mean level {brightness:.0f}/255)")
+
+    def _reject(self, reason):
+        record_failure("signal_quality")
+        raise SignalQualityError(reason)
+
+
+def monitor_factory(winsize, params=QUALITY_PARAMS):
+    """Callable building a `SignalQualityMonitor` for a frame rate, or None when both gates are off."""
+    if params['reject_after'] <= 0 and params['target_snr'] is None:
+        return None
+    return functools.partial(SignalQualityMonitor, winsize=winsize, params=params)
@@ -0,0 +1,402 @@
+import asyncio
+import hashlib
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ModuleNotFoundError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+from src.frame_source import FRAME_MEMORY_BYTES, TraceBuffer, frame_budget
+from src.metrics import observe
+from src.vhr_stages import FaceSkinExtractor
+
+FFMPEG_BIN = os.getenv("FFMPEG_BIN", "ffmpeg")
+STREAM_ROI_THREADS = int(os.getenv("STREAM_ROI_THREADS", "4"))    # concurrent uploads doing ROI extraction
+FRAME_QUEUE_SIZE = int(os.getenv("STREAM_FRAME_QUEUE_SIZE", "64"))  # decoded frames buffered per upload
+SNIFF_BYTES = 64 * 1024
+
+_roi_executor = ThreadPoolExecutor(max_workers=STREAM_ROI_THREADS, thread_name_prefix="roi")
+# One per ROI thread: an upload only decodes while streaming when it holds one, so its frame
+# consumer is running and the `to_thread(frames.put, ...)` handoff never waits on a busy
+# `_roi_executor` while holding a default executor thread
+_stream_slots = threading.BoundedSemaphore(STREAM_ROI_THREADS)
+_roi_local = threading.local()
+
+# file_path: saved upload, under a unique name, for the caller to remove; digest: hex SHA-256 of the
+# bytes written to file_path (and fed to the decoder); sig/fps: skin RGB trace
+# extracted while streaming (None if it could not be); cached: what `lookup` returned
+ReceivedVideo = namedtuple("ReceivedVideo", ["file_path", "digest", "sig", "fps", "cached"])
+
+
+class UploadError(ValueError):
+    """Raised for a request that is not a valid upload (a client error, unlike a failure to process it)."""
+
+
+def is_streamable(head):
+    """
+    Tell whether a video can be decoded from a pipe while it is still arriving.
+
+    MP4/MOV files whose `moov` index is written after the media data (`mdat`) need the
+    whole file before the first frame can be decoded. Other containers (WebM, AVI,
+    fragmented or fast-start MP4) are decoded progressively.
+
+    Parameters:
+        head (bytes): First bytes of the file.
+    """
+    pos = 0
+    while pos + 8 <= len(head):
+        size = int.from_bytes(head[pos:pos + 4], "big")
+        kind = head[pos + 4:pos + 8]
+        if pos == 0 and kind != b"ftyp":
+            return True  # not an ISO base media file
+        if kind in (b"moov", b"moof"):
+            return True
+        if kind == b"mdat":
+            return False
+        if size == 1:
+            size = int.from_bytes(head[pos + 8:pos + 16], "big")
+        if size < 8:
+            break
+        pos += size
+    return True
+
+
+class StreamingDecoder:
+    """
+    ffmpeg subprocess decoding a video fed chunk by chunk on stdin.
+
+    Frames come out of stdout as a YUV4MPEG2 stream, whose header carries the frame size
+    and frame rate, and are converted to BGR arrays like `cv2.VideoCapture` returns.
+
+    Parameters:
+        max_height (int, optional): Let ffmpeg downscale frames to at most this height.
+    """
+
+    def __init__(self, max_height=None):
+        self.max_height = max_height
+        self.proc = None
+        self.fps = None
+        self.width = None
+        self.height = None
+        self.failed = False
+        self.decode_time = 0.0  # seconds spent converting frames
+
+    async def start(self):
+        # yuv420p needs even dimensions
+        scale = f"min(1\\,{self.max_height}/ih)" if self.max_height else "1"
+        self.proc = await asyncio.create_subprocess_exec(
+            FFMPEG_BIN, "-hide_banner", "-loglevel", "error", "-i", "pipe:0",
+            "-vf", f"scale=trunc(iw*{scale}/2)*2:trunc(ih*{scale}/2)*2", "-pix_fmt", "yuv420p",
+            "-f", "yuv4mpegpipe", "pipe:1",
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL)
+
+    async def feed(self, chunk):
+        if self.failed:
+            return
+        try:
+            self.proc.stdin.write(chunk)
+            await self.proc.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            self.failed = True
+
+    async def close_input(self):
+        if not self.proc.stdin.is_closing():
+            self.proc.stdin.close()
+        try:
+            await self.proc.stdin.wait_closed()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    async def read_header(self):
+        """Read the stream header, which sets `fps`, `width` and `height`; False when ffmpeg outputs no video."""
+        header = await self.proc.stdout.readline()
+        if not header.startswith(b"YUV4MPEG2"):
+            self.failed = True
+            return False
+        params = {token[:1]: token[1:] for token in header.split()[1:]}
+        self.width, self.height = int(params[b"W"]), int(params[b"H"])
+        num, den = params.get(b"F", b"30:1").split(b":")
+        self.fps = int(num) / int(den)
+        return True
+
+    @property
+    def frame_bytes(self):
+        """Size of one decoded BGR frame, once the header is read."""
+        return self.width * self.height * 3
+
+    async def frames(self):
+        """
+        Async generator of decoded BGR frames, after `read_header`.
+
+        Only the conversion of the frames is reported as decode time: reading them mostly
+        waits for the upload.
+        """
+        width, height = self.width, self.height
+        frame_size = width * height * 3 // 2
+
+        while True:
+            line = await self.proc.stdout.readline()
+            if not line.startswith(b"FRAME"):
+                break
+            data = await self.proc.stdout.readexactly(frame_size)
+            start = time.perf_counter()
+            yuv = np.frombuffer(data, dtype=np.uint8).reshape(height * 3 // 2, width)
+            frame = cv2.cvtColor(yuv, cv2.COLOR_YUV2BGR_I420)
+            self.decode_time += time.perf_counter() - start
+            yield frame
+
+    async def wait(self):
+        if await self.proc.wait() != 0:
+            self.failed = True
+
+    def kill(self):
+        if self.proc and self.proc.returncode is None:
+            self.proc.kill()
+
+
+class _MultipartEvents:
+    """Collects python-multipart callbacks into a list of (kind, value) events, like Starlette does."""
+
+    def __init__(self):
+        self.events = []
+        self._field = b""
+        self._value = b""
+        self._headers = {}
+
+    def callbacks(self):
+        return {
+            "on_part_begin": self._on_part_begin,
+            "on_part_data": lambda data, start, end: self.events.append(("data", data[start:end])),
+            "on_part_end": lambda: self.events.append(("end", None)),
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": lambda: self.events.append(("headers", self._headers)),
+        }
+
+    def _on_part_begin(self):
+        self._headers = {}
+
+    def _on_header_field(self, data, start, end):
+        self._field += data[start:end]
+
+    def _on_header_value(self, data, start, end):
+        self._value += data[start:end]
+
+    def _on_header_end(self):
+        self._headers[self._field.lower()] = self._value
+        self._field, self._value = b"", b""
+
+
+def remove_upload(file_path):
+    """Delete a saved upload, if it is still there."""
+    try:
+        os.remove(file_path)
+    except FileNotFoundError:
+        pass
+
+
+def _extract_trace(frames, extractor_params, decoder, quality=None, failed=None):
+    """
+    Thread body: pull frames until None and return the skin RGB trace, shape (n_frames, 1, 3).
+
+    Frames keep being drained after an error, or once the `quality` monitor (see
+    `vhr_stages.extract_trace_from_file`) has enough signal, so the producer never blocks
+    on a full queue. An error (e.g. an unusable video) sets the `failed` event at once,
+    so the upload can be aborted; it is raised once None is received.
+    """
+    if not hasattr(_roi_local, "extractors"):
+        _roi_local.extractors = {}
+    key = tuple(sorted(extractor_params.items()))
+    extractor = _roi_local.extractors.get(key)
+    if extractor is None:
+        extractor = _roi_local.extractors[key] = FaceSkinExtractor(**extractor_params)
+    extractor.reset()
+    sig, error, roi_time = TraceBuffer(), None, 0.0
+    monitor, enough = None, False
+    while True:
+        frame = frames.get()
+        if frame is None:
+            break
+        if error is None and not enough:
+            start = time.perf_counter()
+            try:
+                sig.append(extractor(frame))
+                if monitor is None and quality:
+                    monitor = quality(decoder.fps)  # known once frames come out
+                if monitor is not None:
+                    enough = monitor.observe(sig.array())
+            except Exception as e:
+                error = e
+                if failed is not None:
+                    failed.set()
+            roi_time += time.perf_counter() - start
+    if error is not None:
+        raise error
+    observe("roi", roi_time)
+    return sig.array()
+
+
+async def receive_video(request, upload_dir, field_name="file", extractor_params=None, lookup=None, quality=None):
+    """
+    Save a multipart video upload while decoding it and extracting the skin RGB trace.
+
+    The request body is read chunk by chunk; each chunk is written to disk and fed to an
+    ffmpeg decoder, whose frames go through ROI extraction in a worker thread. Video
+    processing therefore overlaps with the network transfer instead of following it. At
+    most STREAM_ROI_THREADS uploads are decoded like this at once; the others are only
+    saved, and processed the usual way.
+
+    Parameters:
+        request (Request): Incoming multipart/form-data request.
+        upload_dir (str): Directory to save the uploaded file in, under a unique name; the
+            caller removes it once processed (see `remove_upload`).
+        field_name (str): Form field holding the video.
+        extractor_params (dict, optional): Keyword arguments of `vhr_stages.FaceSkinExtractor`;
+            its `max_height` is applied by the decoder already.
+        lookup (callable, optional): Async function called with the video digest once the
+            upload is complete; if it returns something other than None, decoding stops and
+            the value is returned as `cached`.
+        quality (callable, optional): Signal-quality gates of the extraction, see
+            `vhr_stages.extract_trace_from_file`; an unusable video raises its
+            `SignalQualityError` as soon as it is found, without reading the rest of the upload.
+
+    Returns:
+        ReceivedVideo: `sig` and `fps` are None when the video was not decoded while
+        streaming (e.g. MP4 with the index at the end, or every ROI thread busy); the saved
+        file is then complete and can be processed the usual way.
+
+    Raises:
+        UploadError: When the request is not a multipart/form-data upload with a `field_name` file.
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise UploadError("Expected a multipart/form-data upload")
+
+    extractor_params = extractor_params or {}
+    loop = asyncio.get_running_loop()
+    multipart_events = _MultipartEvents()
+    events = multipart_events.events
+    parser = MultipartParser(params[b"boundary"], multipart_events.callbacks())
+
+    file_path, buffer, decoder, pump, frames, trace, slot = None, None, None, None, None, None, False
+    failed = threading.Event()  # set by the ROI thread on an error
+    head, sniffing = b"", True
+    video_hash = hashlib.sha256()
+
+    async def pump_frames():
+        nonlocal frames, trace, slot
+        if not await decoder.read_header():
+            return
+        # the frame size is known from here: FRAME_QUEUE_SIZE frames, within FRAME_MEMORY_BYTES
+        frames = queue.Queue(maxsize=min(FRAME_QUEUE_SIZE, frame_budget(decoder.frame_bytes, FRAME_MEMORY_BYTES)))
+        trace = loop.run_in_executor(_roi_executor, _extract_trace, frames, extractor_params, decoder, quality, failed)
+        # held until the ROI thread is done, also when the upload ends first
+        trace.add_done_callback(lambda _: _stream_slots.release())
+        slot = False
+        async for frame in decoder.frames():
+            await asyncio.to_thread(frames.put, frame)
+
+    try:
+        async for chunk in request.stream():
+            try:
+                parser.write(chunk)
+            except ValueError as e:  # python-multipart's parse errors
+                raise UploadError(f"Malformed multipart/form-data upload: {e}")
+            for kind, value in events:
+                if kind == "headers" and file_path is None:
+                    _, disposition = parse_options_header(value.get(b"content-disposition", b""))
+                    if disposition.get(b"name", b"").decode() == field_name and b"filename" in disposition:
+                        # unique name: queued uploads with the same client file name must not overwrite each other
+                        extension = os.path.splitext(os.path.basename(disposition[b"filename"].decode()))[1]
+                        file_path = os.path.join(upload_dir, uuid.uuid4().hex + extension[:16])
+                        buffer = await asyncio.to_thread(open, file_path, "wb")
+                elif kind == "data" and buffer is not None and not buffer.closed:
+                    video_hash.update(value)
+                    await asyncio.to_thread(buffer.write, value)
+                    if sniffing:
+                        head += value
+                        if len(head) < SNIFF_BYTES:
+                            continue
+                        sniffing = False
+                        slot = is_streamable(head) and _stream_slots.acquire(blocking=False)
+                        if slot:
+                            decoder = StreamingDecoder(max_height=extractor_params.get("max_height"))
+                            try:
+                                await decoder.start()
+                            except OSError as e:
+                                # e.g. no ffmpeg binary: only save the upload, processed the usual way
+                                print(f"Streaming decoder unavailable: {e}")
+                                decoder = None
+                                _stream_slots.release()
+                                slot = False
+                            else:
+                                pump = asyncio.create_task(pump_frames())
+                                await decoder.feed(head)
+                    elif decoder is not None:
+                        await decoder.feed(value)
+                elif kind == "end" and buffer is not None and not buffer.closed:
+                    await asyncio.to_thread(buffer.close)
+            events.clear()
+            if failed.is_set():
+                # stop decoding and raise the error of the ROI thread, before the rest of the upload
+                decoder.kill()
+                pump.cancel()
+                await asyncio.to_thread(frames.put, None)
+                await trace
+        parser.finalize()
+
+        if file_path is None:
+            raise UploadError(f"No '{field_name}' file in the upload")
+        digest = video_hash.hexdigest()
+
+        cached = await lookup(digest) if lookup else None
+        if cached is not None:
+            if decoder is not None:
+                decoder.kill()
+                pump.cancel()
+                if trace is not None:
+                    loop.run_in_executor(None, frames.put, None)
+            return ReceivedVideo(file_path, digest, None, None, cached)
+        if decoder is None:
+            return ReceivedVideo(file_path, digest, None, None, None)
+
+        await decoder.close_input()
+        await pump
+        await decoder.wait()
+        observe("decode", decoder.decode_time)
+        if trace is None:  # ffmpeg output no video
+            return ReceivedVideo(file_path, digest, None, None, None)
+        await asyncio.to_thread(frames.put, None)
+        sig = await trace
+        if decoder.failed or len(sig) == 0:
+            return ReceivedVideo(file_path, digest, None, None, None)
+        return ReceivedVideo(file_path, digest, sig, decoder.fps, None)
+
+    except BaseException:
+        if decoder is not None:
+            decoder.kill()
+        if pump is not None:
+            pump.cancel()
+        if trace is not None and not trace.done():
+            loop.run_in_executor(None, frames.put, None)  # let the ROI thread finish on its own
+        if buffer is not None:
+            buffer.close()
+            remove_upload(file_path)
+        raise
+    finally:
+        if buffer is not None and not buffer.closed:
+            buffer.close()
+        if slot:
+            _stream_slots.release()
@@ -0,0 +1,355 @@
+import multiprocessing as mp
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+from pyVHR.extraction.sig_extraction_methods import holistic_mean
+from pyVHR.extraction.skin_extraction_methods import SkinExtractionConvexHull
+from pyVHR.extraction.utils import sig_windowing
+from pyVHR.BVP.BVP import RGB_sig_to_BVP
+from pyVHR.BVP.filters import apply_filter, BPfilter
+from pyVHR.BPM.BPM import BVP_to_BPM, BVP_to_BPM_cuda
+import pyVHR.BVP.methods as bvp_methods
+
+from src.frame_source import FRAME_MEMORY_BYTES, VideoFrameSource, TraceBuffer
+from src.metrics import observe, timed
+
+SEGMENT_MIN_SECONDS = float(os.getenv("VHR_SEGMENT_MIN_SECONDS", "6"))  # shortest segment worth its own process
+
+# Band-pass used by pyVHR before/after the rPPG method (0.65-4 Hz → 39-240 BPM)
+BP_PARAMS = {'minHz': 0.65, 'maxHz': 4.0, 'fps': 'adaptive', 'order': 6}
+NUM_LANDMARKS = 468
+
+
+class FaceSkinExtractor:
+    """
+    Frame-by-frame version of pyVHR's `holistic` + `convexhull` ROI step.
+
+    Each call takes one BGR frame and returns the mean skin RGB of the face, shape (1, 3),
+    exactly like `SignalProcessing.extract_holistic` does for a whole video. Keeping it per
+    frame lets callers feed frames from any source (a pipe, a socket, a chunk of a file).
+
+    With the defaults every frame is processed at full resolution with full landmark
+    detection. The fast mode trades a little precision for speed:
+    - `max_height` downscales frames to a working resolution before anything else;
+    - `detect_every` runs FaceMesh only every N frames and moves the landmarks of the
+      frames in between with pyramidal Lucas-Kanade optical flow, re-detecting early when
+      the face moves more than `motion_threshold` (fraction of the face size per frame)
+      or too many landmarks are lost.
+
+    Parameters:
+        skin_th (tuple): (low, high) RGB thresholds for skin pixels.
+        device (str): 'CPU' or 'GPU' for the convex hull skin extraction.
+        max_height (int, optional): Working frame height in pixels (default: keep the input size).
+        detect_every (int): Run full landmark detection every N frames.
+        motion_threshold (float): Face motion that forces a re-detection.
+    """
+
+    def __init__(self, skin_th=(5, 230), device='CPU', max_height=None, detect_every=1, motion_threshold=0.02):
+        import mediapipe as mp
+
+        self._face_mesh = mp.solutions.face_mesh.FaceMesh(
+            max_num_faces=1, min_detection_confidence=0.5, min_tracking_confidence=0.5)
+        self._skin = SkinExtractionConvexHull(device)
+        self.low_th, self.high_th = np.int32(skin_th[0]), np.int32(skin_th[1])
+        self.max_height = max_height
+        self.detect_every = max(1, detect_every)
+        self.motion_threshold = motion_threshold
+        self.stats = {"frames": 0, "detections": 0}
+        self.reset()
+
+    def reset(self):
+        """Forget the tracked face, to be called between videos."""
+        self._ldmks = None
+        self._prev_gray = None
+        self._since_detect = 0
+
+    def landmarks(self, image):
+        """
+        Detect face landmarks on an RGB image.
+
+        Returns:
+            numpy.ndarray or None: (468, 5) array in pyVHR layout (row, col, ...), -1 for
+            landmarks that were not found, or None when there is no face.
+        """
+        results = self._face_mesh.process(image)
+        if not results.multi_face_landmarks:
+            return None
+        height, width = image.shape[:2]
+        points = np.array([(l.x, l.y) for l in results.multi_face_landmarks[0].landmark], dtype=np.float32)
+        ldmks = np.full((NUM_LANDMARKS, 5), -1.0, dtype=np.float32)
+        visible = (points >= 0).all(axis=1) & (points <= 1).all(axis=1)
+        ldmks[visible, 0] = np.minimum(np.floor(points[visible, 1] * height), height - 1)
+        ldmks[visible, 1] = np.minimum(np.floor(points[visible, 0] * width), width - 1)
+        return ldmks
+
+    def track(self, prev_gray, gray, ldmks):
+        """
+        Move landmarks from `prev_gray` to `gray` with optical flow.
+
+        Returns:
+            numpy.ndarray or None: Moved landmarks, or None when the face moved too much or
+            was lost and a full detection is needed.
+        """
+        visible = ldmks[:, 0] >= 0
+        if visible.sum() < 3:
+            return None
+        points = ldmks[visible][:, [1, 0]].reshape(-1, 1, 2)  # (x, y) for OpenCV
+        moved, status, _ = cv2.calcOpticalFlowPyrLK(prev_gray, gray, points, None,
+                                                    winSize=(15, 15), maxLevel=2)
+        status = status.ravel() == 1
+        if status.mean() < 0.8:
+            return None
+
+        points, moved = points.reshape(-1, 2), moved.reshape(-1, 2)
+        face_size = np.ptp(points, axis=0).max()
+        motion = np.median(np.linalg.norm(moved[status] - points[status], axis=1))
+        if face_size <= 0 or motion / face_size > self.motion_threshold:
+            return None
+
+        height, width = gray.shape
+        tracked = ldmks.copy()
+        idx = np.flatnonzero(visible)
+        tracked[idx[~status], :2] = -1.0
+        tracked[idx[status], 0] = np.clip(np.round(moved[status, 1]), 0, height - 1)
+        tracked[idx[status], 1] = np.clip(np.round(moved[status, 0]), 0, width - 1)
+        return tracked
+
+    def skin_mean(self, image, ldmks):
+        """Mean RGB of the skin pixels inside the landmarks' convex hull, shape (1, 3)."""
+        if ldmks is None:
+            return holistic_mean(np.zeros_like(image), self.low_th, self.high_th)
+        cropped_skin_im, _ = self._skin.extract_skin(image, ldmks)
+        return holistic_mean(cropped_skin_im, self.low_th, self.high_th)
+
+    def __call__(self, frame):
+        frame = downscale(frame, self.max_height)
+        image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        self.stats["frames"] += 1
+
+        if self.detect_every == 1:
+            self.stats["detections"] += 1
+            return self.skin_mean(image, self.landmarks(image))
+
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        ldmks = None
+        if self._ldmks is not None and self._since_detect < self.detect_every:
+            ldmks = self.track(self._prev_gray, gray, self._ldmks)
+        if ldmks is None:
+            ldmks = self.landmarks(image)
+            self._since_detect = 0
+            self.stats["detections"] += 1
+        self._since_detect += 1
+        self._ldmks, self._prev_gray = ldmks, gray
+        return self.skin_mean(image, ldmks)
+
+    def close(self):
+        self._face_mesh.close()
+
+
+def downscale(frame, max_height):
+    """Resize a frame so its height is at most `max_height`, keeping the aspect ratio."""
+    if not max_height or frame.shape[0] <= max_height:
+        return frame
+    scale = max_height / frame.shape[0]
+    return cv2.resize(frame, (round(frame.shape[1] * scale), max_height), interpolation=cv2.INTER_AREA)
+
+
+def extract_trace_from_file(videoFileName, extractor, memory_bytes=None, quality=None):
+    """
+    Decode a video file chunk by chunk and run `extractor` on every frame.
+
+    Only the per-frame skin RGB means are kept, so memory does not grow with the video
+    resolution, and only by 12 bytes per frame with its length (see `frame_source.TraceBuffer`).
+
+    Parameters:
+        extractor (FaceSkinExtractor): ROI step; frames are decoded at its `max_height`.
+        memory_bytes (int, optional): Budget for decoded frames (default: VHR_FRAME_MEMORY_BYTES).
+        quality (callable, optional): Builds a `signal_quality.SignalQualityMonitor` from the
+            frame rate; decoding stops once it reports enough signal, and its
+            `SignalQualityError` for an unusable video is raised as soon as it is detected.
+
+    Returns:
+        tuple: (sig, fps), the skin RGB trace of shape (n_frames, 1, 3) and the video frame rate.
+    """
+    source_params = {"memory_bytes": memory_bytes} if memory_bytes else {}
+    trace = TraceBuffer()
+    roi_time = 0.0
+    extractor.reset()
+    with VideoFrameSource(videoFileName, max_height=extractor.max_height, **source_params) as source:
+        monitor = quality(source.fps) if quality else None
+        enough = False
+        for chunk in source.chunks():
+            start = time.perf_counter()
+            for frame in chunk:
+                trace.append(extractor(frame))
+                if monitor is not None and monitor.observe(trace.array()):
+                    enough = True
+                    break
+            roi_time += time.perf_counter() - start
+            if enough:
+                break
+    observe("decode", source.decode_time)
+    observe("roi", roi_time)
+    return trace.array(), source.fps
+
+
+_segment_executor = None
+_segment_extractors = {}  # per segment process: FaceSkinExtractor by parameters
+
+
+def segment_executor(workers):
+    """Process pool of the segment workers of this process, started on first use and kept warm."""
+    global _segment_executor
+    if _segment_executor is None:
+        _segment_executor = ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context("spawn"))
+    return _segment_executor
+
+
+def _extract_segment(videoFileName, shm_name, capacity, start, stop, extractor_params, memory_bytes):
+    """
+    Segment process body: run ROI extraction on frames [start, stop) and write their skin RGB
+    means to rows [start, stop) of the shared trace of `capacity` rows.
+
+    Returns:
+        tuple: (frames, overflow, decode_time, roi_time); `overflow` holds the frames past
+        `capacity` of the last segment (when the container under-reported its length).
+    """
+    key = tuple(sorted(extractor_params.items()))
+    extractor = _segment_extractors.get(key)
+    if extractor is None:
+        extractor = _segment_extractors[key] = FaceSkinExtractor(**extractor_params)
+    extractor.reset()
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    trace = None
+    try:
+        trace = np.ndarray((capacity, 1, 3), dtype=np.float32, buffer=shm.buf)
+        overflow = []
+        n = start
+        roi_time = 0.0
+        with VideoFrameSource(videoFileName, max_height=extractor.max_height, memory_bytes=memory_bytes,
+                              start=start, stop=stop) as source:
+            for chunk in source.chunks():
+                t0 = time.perf_counter()
+                for frame in chunk:
+                    value = extractor(frame)
+                    if n < capacity:
+                        trace[n] = value
+                    else:
+                        overflow.append(value)
+                    n += 1
+                roi_time += time.perf_counter() - t0
+        return n - start, np.asarray(overflow, dtype=np.float32).reshape(-1, 1, 3), source.decode_time, roi_time
+    finally:
+        trace = None  # the view must be gone before the mapping is closed
+        shm.close()
+
+
+def _segment_ready():
+    return os.getpid()
+
+
+def warm_up_segments(workers):
+    """Start the segment processes (and their imports) before the first video needs them."""
+    executor = segment_executor(workers)
+    wait([executor.submit(_segment_ready) for _ in range(workers)])
+
+
+def extract_trace_parallel(videoFileName, extractor_params, workers, memory_bytes=FRAME_MEMORY_BYTES,
+                           min_seconds=SEGMENT_MIN_SECONDS):
+    """
+    `extract_trace_from_file` split across processes: the video is cut into consecutive
+    frame ranges, each decoded and ROI-extracted by a segment process that writes its rows
+    of the trace straight into shared memory.
+
+    Segments meet at the trace level, before pyVHR cuts it into overlapping windows, so
+    `rgb_trace_to_bvp` sees the same trace (and returns the same windows) as a serial run.
+
+    Parameters:
+        extractor_params (dict): Keyword arguments of `FaceSkinExtractor`.
+        workers (int): Segment processes.
+        memory_bytes (int): Budget for decoded frames, shared by the segments.
+        min_seconds (float): Shortest segment; short videos use fewer processes.
+
+    Returns:
+        tuple: (sig, fps), like `extract_trace_from_file`.
+    """
+    cap = cv2.VideoCapture(videoFileName)
+    if not cap.isOpened():
+        raise ValueError(f"Cannot open video: {videoFileName}")
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    capacity = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+
+    segments = min(workers, int(capacity // max(min_seconds * fps, 1)))
+    if segments < 2:
+        extractor = FaceSkinExtractor(**extractor_params)
+        try:
+            return extract_trace_from_file(videoFileName, extractor, memory_bytes=memory_bytes)
+        finally:
+            extractor.close()
+
+    bounds = np.linspace(0, capacity, segments + 1).round().astype(int)
+    shm = shared_memory.SharedMemory(create=True, size=capacity * 3 * 4)
+    try:
+        executor = segment_executor(workers)
+        futures = [executor.submit(_extract_segment, videoFileName, shm.name, capacity, int(start),
+                                   int(stop) if i < segments - 1 else None, extractor_params,
+                                   memory_bytes // segments)
+                   for i, (start, stop) in enumerate(zip(bounds[:-1], bounds[1:]))]
+        wait(futures)  # no segment may still be writing when the memory is released
+        results = [future.result() for future in futures]
+
+        trace = np.ndarray((capacity, 1, 3), dtype=np.float32, buffer=shm.buf)
+        pieces = [trace[start:min(start + frames, capacity)] for start, (frames, _, _, _) in zip(bounds, results)]
+        sig = np.concatenate(pieces + [results[-1][1]])
+        del trace, pieces
+    finally:
+        shm.close()
+        shm.unlink()
+
+    observe("decode", sum(result[2] for result in results))
+    observe("roi", sum(result[3] for result in results))
+    return sig, fps
+
+
+@timed("chrom")
+def rgb_trace_to_bvp(sig, fps, winsize=6, method='cupy_CHROM', pre_filt=True, post_filt=True, cuda=True):
+    """
+    Run the signal part of pyVHR's pipeline (windowing, filtering, rPPG method, BPM) on an RGB trace.
+
+    Parameters:
+        sig (numpy.ndarray): Skin RGB trace, shape (n_frames, 1, 3).
+        fps (float): Frame rate of the trace.
+        winsize (int): Window size in seconds.
+        method (str): rPPG method name from `pyVHR.BVP.methods`.
+
+    Returns:
+        tuple: (bvps, timesES, bpmES), same as `Pipeline.run_on_video` with the holistic approach.
+    """
+    windowed_sig, timesES = sig_windowing(np.asarray(sig, dtype=np.float32), winsize, 1, fps)
+
+    if pre_filt:
+        windowed_sig = apply_filter(windowed_sig, BPfilter, fps=fps, params=BP_PARAMS)
+
+    if 'cupy' in method:
+        device_type = 'cuda'
+    elif 'torch' in method:
+        device_type = 'torch'
+    else:
+        device_type = 'cpu'
+    bvps = RGB_sig_to_BVP(windowed_sig, fps, device_type=device_type,
+                          method=getattr(bvp_methods, method), params={})
+
+    if post_filt:
+        bvps = apply_filter(bvps, BPfilter, fps=fps, params=BP_PARAMS)
+
+    if cuda:
+        bpmES = BVP_to_BPM_cuda(bvps, fps, minHz=BP_PARAMS['minHz'], maxHz=BP_PARAMS['maxHz'])
+    else:
+        bpmES = BVP_to_BPM(bvps, fps, minHz=BP_PARAMS['minHz'], maxHz=BP_PARAMS['maxHz'])
+    return bvps, timesES, bpmES
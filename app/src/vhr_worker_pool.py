@@ -0,0 +1,256 @@
+import asyncio
+import multiprocessing as mp
+import os
+import threading
+import time
+import traceback
+
+from src import metrics
+
+POOL_SIZE = int(os.getenv("VHR_POOL_SIZE", "2"))                        # number of warm worker processes
+MAX_JOBS_PER_WORKER = int(os.getenv("VHR_MAX_JOBS_PER_WORKER", "50"))   # recycle a worker after N jobs
+JOB_TIMEOUT = float(os.getenv("VHR_JOB_TIMEOUT", "300"))                # seconds, kill the worker past this
+STARTUP_TIMEOUT = float(os.getenv("VHR_STARTUP_TIMEOUT", "180"))        # seconds to load and warm up a worker
+HEALTH_CHECK_INTERVAL = float(os.getenv("VHR_HEALTH_CHECK_INTERVAL", "30"))
+HEALTH_CHECK_TIMEOUT = float(os.getenv("VHR_HEALTH_CHECK_TIMEOUT", "10"))
+START_METHOD = os.getenv("VHR_POOL_START_METHOD", "spawn")              # 'spawn' keeps CUDA out of the parent
+
+
+def _worker_main(conn):
+    """
+    Entry point of a worker process: build one warm pipeline, then serve jobs until told to stop.
+
+    Messages received: ("job", func, args, kwargs), ("ping",) or None to exit.
+    Messages sent: ("ready", pid, records), ("ok", result, records), ("error", message, records)
+    or ("pong", info), where `records` are the metrics observed meanwhile (see `metrics.drain`).
+    The error message is the traceback, or the exception itself when it is an expected
+    outcome (an `expected` attribute, e.g. `signal_quality.SignalQualityError`).
+    """
+    from src.data_process_tools import warm_up_pipeline
+
+    metrics.start_recording()
+    try:
+        pipe = warm_up_pipeline()
+    except Exception:
+        conn.send(("error", traceback.format_exc()))
+        return
+    conn.send(("ready", os.getpid(), metrics.drain()))
+
+    while True:
+        try:
+            msg = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if msg is None:
+            break
+
+        if msg[0] == "ping":
+            conn.send(("pong", {"pid": os.getpid(), "warm": pipe is not None}))
+            continue
+
+        _, func, args, kwargs = msg
+        try:
+            reply = ("ok", func(*args, pipe=pipe, **kwargs))
+        except Exception as e:
+            reply = ("error", e if getattr(e, "expected", False) else traceback.format_exc())
+        conn.send(reply + (metrics.drain(),))
+
+
+class _Worker:
+    """Parent-side handle of one worker process and its pipe."""
+
+    def __init__(self, ctx):
+        self.conn, child_conn = ctx.Pipe()
+        # not a daemon, so it may start the segment processes of VHR_SEGMENT_WORKERS; it still
+        # exits with the server, when its pipe closes
+        self.process = ctx.Process(target=_worker_main, args=(child_conn,), daemon=False)
+        self.process.start()
+        child_conn.close()
+        self.jobs_done = 0
+        self.started_at = time.time()
+
+    def wait_ready(self, timeout):
+        reply = self.request(None, timeout)
+        if reply[0] != "ready":
+            raise RuntimeError(f"VHR worker failed to start:\n{reply[1]}")
+        metrics.replay(reply[2])
+
+    def request(self, msg, timeout):
+        """Send `msg` (if any) and block for the reply, raising TimeoutError past `timeout`."""
+        if msg is not None:
+            self.conn.send(msg)
+        if not self.conn.poll(timeout):
+            raise TimeoutError(f"VHR worker {self.process.pid} did not answer within {timeout}s")
+        return self.conn.recv()
+
+    def stop(self, timeout=5):
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class VHRWorkerPool:
+    """
+    Pool of long-lived processes, each holding an initialized pyVHR pipeline.
+
+    Jobs are handed to an idle, already-warm worker. A worker is replaced once it has
+    served `max_jobs_per_worker` jobs, when a job exceeds `job_timeout`, when it dies,
+    or when it fails a periodic health check.
+
+    Parameters:
+        size (int): Number of worker processes.
+        max_jobs_per_worker (int): Jobs served before a worker is recycled (0 disables recycling).
+        job_timeout (float): Seconds a single job may run before its worker is killed.
+        health_check_interval (float): Seconds between health checks of idle workers.
+    """
+
+    def __init__(self, size=POOL_SIZE, max_jobs_per_worker=MAX_JOBS_PER_WORKER,
+                 job_timeout=JOB_TIMEOUT, health_check_interval=HEALTH_CHECK_INTERVAL):
+        self.size = size
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.job_timeout = job_timeout
+        self.health_check_interval = health_check_interval
+        self._ctx = mp.get_context(START_METHOD)
+        self._workers = []
+        self._idle = None
+        self._health_task = None
+        self._lock = threading.Lock()
+        self._tasks = set()
+        self.stats = {"jobs": 0, "failures": 0, "timeouts": 0, "cancelled": 0, "recycled": 0, "replaced": 0}
+
+    async def start(self):
+        """Spawn and warm up all workers concurrently."""
+        self._idle = asyncio.Queue()
+        workers = await asyncio.gather(*[asyncio.to_thread(self._spawn) for _ in range(self.size)])
+        for worker in workers:
+            self._idle.put_nowait(worker)
+        if self.health_check_interval > 0:
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    async def close(self):
+        if self._health_task:
+            self._health_task.cancel()
+        with self._lock:
+            workers, self._workers = self._workers, []
+        await asyncio.gather(*[asyncio.to_thread(w.stop) for w in workers])
+
+    async def submit(self, func, *args, **kwargs):
+        """
+        Run `func(*args, pipe=<warm pipeline>, **kwargs)` on an idle worker and return its result.
+
+        `func` must be a picklable, module-level function accepting a `pipe` keyword.
+        """
+        worker = await self._idle.get()
+        try:
+            status, payload, records = await asyncio.to_thread(
+                worker.request, ("job", func, args, kwargs), self.job_timeout)
+        except asyncio.CancelledError:
+            # the caller gave up (e.g. job deadline): kill the busy worker rather than reuse it mid-job
+            self.stats["cancelled"] += 1
+            self._respawn_later(worker)
+            raise
+        except TimeoutError:
+            self.stats["timeouts"] += 1
+            metrics.record_failure("vhr_worker_timeout")
+            self._respawn_later(worker)
+            raise
+        except (EOFError, OSError) as e:
+            self.stats["failures"] += 1
+            metrics.record_failure("vhr_worker_died")
+            self._respawn_later(worker)
+            raise RuntimeError(f"VHR worker died while processing: {e}")
+        metrics.replay(records)
+
+        self.stats["jobs"] += 1
+        worker.jobs_done += 1
+        if self.max_jobs_per_worker and worker.jobs_done >= self.max_jobs_per_worker:
+            self.stats["recycled"] += 1
+            self._respawn_later(worker, count=False)
+        else:
+            self._idle.put_nowait(worker)
+
+        if status != "ok":
+            self.stats["failures"] += 1
+            if isinstance(payload, Exception):
+                raise payload
+            raise RuntimeError(payload)
+        return payload
+
+    def status(self):
+        """Snapshot of the pool for the health endpoint."""
+        with self._lock:
+            workers = list(self._workers)
+        return {
+            "size": self.size,
+            "alive": sum(w.process.is_alive() for w in workers),
+            "idle": self._idle.qsize() if self._idle else 0,
+            "workers": [{"pid": w.process.pid, "jobs_done": w.jobs_done,
+                         "uptime": round(time.time() - w.started_at, 1)} for w in workers],
+            **self.stats,
+        }
+
+    def _spawn(self):
+        worker = _Worker(self._ctx)
+        try:
+            worker.wait_ready(STARTUP_TIMEOUT)
+        except Exception:
+            worker.stop(timeout=0)
+            raise
+        with self._lock:
+            self._workers.append(worker)
+        return worker
+
+    def _respawn_later(self, worker, count=True):
+        """Replace `worker` in the background and hand the new one to the idle queue."""
+        task = asyncio.create_task(self._respawn(worker, count))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _respawn(self, worker, count):
+        try:
+            worker = await asyncio.to_thread(self._replace, worker, count)
+        except Exception as e:
+            # keep the slot, the next health check retries the replacement
+            print(f"VHR worker replacement failed: {e}")
+        self._idle.put_nowait(worker)
+
+    def _replace(self, worker, count=True):
+        with self._lock:
+            if worker in self._workers:
+                self._workers.remove(worker)
+        worker.stop(timeout=0 if count else 5)
+        if count:
+            self.stats["replaced"] += 1
+        return self._spawn()
+
+    def _ping(self, worker):
+        try:
+            status, _ = worker.request(("ping",), HEALTH_CHECK_TIMEOUT)
+            return status == "pong"
+        except (TimeoutError, EOFError, OSError):
+            return False
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(self.health_check_interval)
+            await self.health_check()
+
+    async def health_check(self):
+        """Ping every idle worker and replace the ones that are dead or unresponsive."""
+        idle = []
+        while not self._idle.empty():
+            idle.append(self._idle.get_nowait())
+        for worker in idle:
+            if not (worker.process.is_alive() and await asyncio.to_thread(self._ping, worker)):
+                try:
+                    worker = await asyncio.to_thread(self._replace, worker)
+                except Exception as e:
+                    # keep the slot, the next check retries the replacement
+                    print(f"VHR worker replacement failed: {e}")
+            self._idle.put_nowait(worker)
@@ -1,10 +1,50 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Request
-from src.data_process_tools import overall_process
-import shutil
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
+from starlette.responses import Response, StreamingResponse
+from src import metrics
+from src.data_process_tools import (processing_params, signal_quality_monitor, skin_extractor_params,
+                                    summarize_bpm, summarize_hrv, vhr_process, vhr_process_trace)
+from src.job_queue import JobQueue, QueueFullError
+from src.pipeline import LLMClient, job_metrics, run_pipeline
+from src.realtime_rppg import RealtimeRPPG, decode_frame, RT_MAX_SESSIONS
+from src.result_cache import ResultCache, make_cache_key
+from src.signal_quality import SignalQualityError
+from src.streaming_upload import UploadError, receive_video, remove_upload
+from src.vhr_worker_pool import VHRWorkerPool, POOL_SIZE
 import asyncio
+import json
 import os
 
-app = FastAPI()
+# Warm worker processes running the pyVHR pipeline (VHR_POOL_SIZE=0 runs in-process instead)
+worker_pool = VHRWorkerPool() if POOL_SIZE > 0 else None
+
+# Results of already processed videos, keyed by video content and processing parameters
+result_cache = ResultCache()
+
+# Bounds how many videos are processed at once and how many may wait
+job_queue = JobQueue()
+
+# Slots of the live /ws/rppg sessions, reserved before the connection is accepted
+realtime_sessions = set()
+
+# Pooled client of llm_server for /pipeline/, created at startup
+llm_client = None
+
+
+@asynccontextmanager
+async def lifespan(app):
+    global llm_client
+    if worker_pool:
+        await worker_pool.start()
+    await job_queue.start()
+    llm_client = LLMClient()
+    yield
+    await llm_client.close()
+    await job_queue.close()
+    if worker_pool:
+        await worker_pool.close()
+
+app = FastAPI(lifespan=lifespan)
 
 # Directory to save uploaded videos
 UPLOAD_DIR = "uploaded_videos"
@@ -14,23 +54,241 @@ os.makedirs(UPLOAD_DIR, exist_ok=True)
 def hello_world():
     return "Hi"
 
+@app.get("/health")
+def health():
+    status = {"status": "ok", "pool": None, "cache": result_cache.info(), "jobs": job_queue.info()}
+    if worker_pool is None:
+        return status
+    status["pool"] = worker_pool.status()
+    if status["pool"]["alive"] == 0:
+        raise HTTPException(status_code=503, detail=status)
+    return status
+
+@app.get("/metrics")
+def prometheus_metrics():
+    """Per-stage latency histograms, failure and cache counters, in-flight gauges (Prometheus text format)."""
+    body, content_type = metrics.render()
+    return Response(body, media_type=content_type)
+
+async def run_process(func, *args):
+    if worker_pool:
+        return await worker_pool.submit(func, *args)
+    return await asyncio.to_thread(func, *args)
+
+def queue_full_error(retry_after):
+    return HTTPException(status_code=429, detail=f"Too many videos in progress, retry in {retry_after}s",
+                         headers={"Retry-After": str(retry_after)})
+
+async def submit_video(request, deadline=None):
+    """
+    Receive an uploaded video and queue its processing.
+
+    Returns:
+        Job: Already done when the result was cached.
+
+    Raises:
+        HTTPException: 429 with Retry-After when the job queue is full, 400 when the request
+            is not a video upload, 422 when the video was found unusable while it was uploading.
+    """
+    if job_queue.is_full():
+        # refuse before reading the body
+        raise queue_full_error(job_queue.retry_after())
+
+    params = processing_params()
+
+    async def lookup(digest):
+        return await asyncio.to_thread(result_cache.get, make_cache_key(digest, params))
+
+    try:
+        with metrics.in_flight("uploads"), metrics.timed("upload"):
+            video = await receive_video(request, UPLOAD_DIR, extractor_params=skin_extractor_params(),
+                                        lookup=lookup, quality=signal_quality_monitor())
+    except UploadError as e:
+        raise HTTPException(status_code=400, detail=f"Video Upload failed: {str(e)}")
+    except SignalQualityError as e:
+        raise HTTPException(status_code=422, detail=f"Video Analyzing failed: {str(e)}")
+    if video.cached is not None:
+        remove_upload(video.file_path)
+        return job_queue.completed(video.cached)
+
+    # video.file_path is unique to this upload, so its digest names the bytes this job processes
+    cache_key = make_cache_key(video.digest, params)
+
+    async def process():
+        # the BPM is reported as soon as pyVHR is done, the HRV is computed in this process meanwhile
+        with metrics.timed("process_trace" if video.sig is not None else "process_video"):
+            if video.sig is not None:
+                bvps, timesES, bpmES = await run_process(vhr_process_trace, video.sig, video.fps)
+            else:
+                bvps, timesES, bpmES = await run_process(vhr_process, video.file_path)
+            process_results = summarize_bpm(bpmES)
+            job.report(**process_results)
+            process_results.update(await asyncio.to_thread(summarize_hrv, bvps, timesES, video.fps))
+        await asyncio.to_thread(result_cache.put, cache_key, process_results)
+        return process_results
+
+    try:
+        job = job_queue.submit(process, deadline=deadline, on_finish=lambda: remove_upload(video.file_path))
+        return job
+    except QueueFullError as e:
+        remove_upload(video.file_path)
+        raise queue_full_error(e.retry_after)
+
 @app.post("/analyze/")
-async def analyze(file: UploadFile = File(...)):
+async def analyze(request: Request):
+    """
+    Analyze a video sent as multipart/form-data in the `file` field and wait for the result.
+
+    Frames are decoded and their skin ROI extracted while the upload is still arriving;
+    videos that cannot be decoded from a stream are processed once fully saved.
+    """
     print("Running API Analyze")
     try:
-        file_path = os.path.join(UPLOAD_DIR, file.filename)
+        job = await job_queue.wait(await submit_video(request))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Video Analyzing failed: {str(e)}")
+
+    if job.status == "expired":
+        raise HTTPException(status_code=504, detail=f"Video Analyzing failed: {job.error}")
+    if job.status == "unusable":
+        raise HTTPException(status_code=422, detail=f"Video Analyzing failed: {job.error}")
+    if job.status != "done":
+        raise HTTPException(status_code=500, detail=f"Video Analyzing failed: {job.error}")
+    return {
+        "message": "Processing complete",
+        "results": job.result
+    }
+
+@app.post("/jobs/", status_code=202)
+async def submit_job(request: Request, deadline: float = None):
+    """
+    Queue a video (multipart/form-data, `file` field) for analysis and return its job id at once.
+    Poll `GET /jobs/{job_id}` or follow `GET /jobs/{job_id}/events` for the result.
+    `deadline` (seconds) can shorten the default JOB_DEADLINE.
+    """
+    try:
+        job = await submit_video(request, deadline=deadline)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Video Upload failed: {str(e)}")
+    return job.snapshot()
 
-        # Save the uploaded file
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+def get_job_or_404(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+    return job
 
-        process_results = await asyncio.to_thread(overall_process, file_path)
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    return get_job_or_404(job_id).snapshot()
 
-        return {
-            "message": "Processing complete",
-            "results": process_results
-        }
-    
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """Server-sent events: one `status` event per status change or partial result, until the job is finished."""
+    job = get_job_or_404(job_id)
+
+    async def events():
+        while True:
+            seen = job.version
+            yield f"event: status\ndata: {json.dumps(job.snapshot())}\n\n"
+            if job.finished:
+                break
+            while not await job.wait_change(since=seen, timeout=15):
+                yield ": keep-alive\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.post("/pipeline/")
+async def pipeline(request: Request, week: int, history_result: str = "", user_id: str = None):
+    """
+    Video to suggestions in one request: upload a video like `/analyze/` (multipart/form-data,
+    `file` field) with the pregnancy `week` and `history_result` as query parameters. With a
+    `user_id` instead of `history_result`, llm_server uses the user's stored history, and the
+    session is recorded in it at the end.
+
+    The answer is a stream of server-sent events. `metrics` events carry the metrics as they
+    are computed (the BPM first, then the HRV metrics and stress level). Each llm_server
+    analysis starts as soon as its metrics are known and streams as `delta` and `aspect`
+    events, then a `section` event. `error` events report a failed stage, and `done` closes
+    the stream with every metric.
+    """
+    # the week context and the history embedding are warmed up while the video uploads
+    prefetch = asyncio.create_task(llm_client.prefetch_context(week, history_result, user_id))
+    try:
+        job = await submit_video(request)
+    except HTTPException:
+        prefetch.cancel()
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Video Analyzing failed: {str(e)}")
+        prefetch.cancel()
+        raise HTTPException(status_code=500, detail=f"Video Upload failed: {str(e)}")
+
+    async def events():
+        async for kind, data in run_pipeline(job_metrics(job), llm_client, week, history_result, user_id):
+            yield f"event: {kind}\ndata: {json.dumps(data)}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
+@app.websocket("/ws/rppg")
+async def realtime_rppg(websocket: WebSocket):
+    """
+    Live rPPG over a WebSocket.
+
+    The client first sends a JSON config: {"fps": 30, "format": "jpeg"} (any encoded image
+    format), or {"fps": 30, "format": "raw", "width": 640, "height": 480} for raw bgr24
+    pixels. Then it sends one binary message per frame. About every second of video the
+    server pushes {"type": "update", "bpm": ..., "hrv": {...}}. A text message
+    {"type": "end"} gets a final {"type": "summary", ...} before the socket closes.
+    """
+    if len(realtime_sessions) >= RT_MAX_SESSIONS:
+        await websocket.close(code=1013)  # try again later
+        return
+    # taken before the first await, so concurrent connections cannot all pass the check
+    slot = object()
+    realtime_sessions.add(slot)
+
+    session = None
+    try:
+        await websocket.accept()
+        config = await websocket.receive_json()
+        fps = float(config.get("fps", 30))
+        frame_format = config.get("format", "jpeg")
+        width, height = config.get("width"), config.get("height")
+        if frame_format == "raw" and not (width and height):
+            await websocket.close(code=1003, reason="Raw frames need width and height")
+            return
+
+        session = await asyncio.to_thread(RealtimeRPPG, fps, extractor_params=skin_extractor_params())
+        metrics.IN_FLIGHT.labels("realtime_sessions").inc()
+
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            if message.get("text") is not None:
+                if json.loads(message["text"]).get("type") == "end":
+                    await websocket.send_json({**session.readout(), "type": "summary"})
+                    await websocket.close()
+                    break
+                continue
+
+            data = message["bytes"]
+            await asyncio.to_thread(lambda: session.add_frame(decode_frame(data, frame_format, width, height)))
+            if session.ready():
+                await websocket.send_json(await asyncio.to_thread(session.update))
+
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        await websocket.close(code=1011, reason=f"Realtime rPPG failed: {str(e)}"[:120])
+    finally:
+        realtime_sessions.discard(slot)
+        if session is not None:
+            metrics.IN_FLIGHT.labels("realtime_sessions").dec()
+            session.close()
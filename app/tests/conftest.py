@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Tests import the services' modules as `src.<module>`, like the servers do from app/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
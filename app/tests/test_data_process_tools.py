@@ -0,0 +1,44 @@
+import json
+
+import numpy as np
+import pytest
+
+pytest.importorskip("pyVHR.analysis.pipeline")
+
+from src.data_process_tools import stitch_bvp_windows, summarize_hrv  # noqa: E402
+
+
+def test_summarize_hrv_reports_missing_metrics_as_null():
+    # one 6 s window at 30 fps with two beats: a single NN interval, too few for any HRV metric
+    t = np.arange(180) / 30
+    window = np.cos(2 * np.pi * t / 2.5)  # peaks at 2.5 s and 5 s
+
+    result = summarize_hrv(window[None, None, :], np.array([3.0]), fps=30)
+
+    assert result == {"sdnn": None, "rmssd": None, "pnn50": None, "stress_level": None}
+    json.dumps(result, allow_nan=False)
+
+
+def test_stitch_bvp_windows_rebuilds_the_signal_under_overlapping_windows():
+    # 6 s windows every second, at 30 fps, of a 1 Hz pulse; each window has its own offset
+    # and gain, which the per-window standardization removes
+    fps, winsize, n_windows = 30, 6, 5
+    t = np.arange((n_windows - 1 + winsize) * fps) / fps
+    pulse = np.sin(2 * np.pi * t)
+    length = winsize * fps
+    bvps = np.stack([(3 + i) * pulse[i * fps:i * fps + length] + 10 * i for i in range(n_windows)])[:, None, :]
+    timesES = winsize / 2 + np.arange(n_windows)
+
+    signal, derived_fps = stitch_bvp_windows(bvps, timesES)
+
+    assert derived_fps == fps
+    assert signal.shape == t.shape
+    np.testing.assert_allclose(signal, np.sqrt(2) * pulse, atol=1e-9)
+
+
+def test_stitch_bvp_windows_keeps_a_single_window():
+    window = np.random.default_rng(0).normal(size=180)
+
+    signal, _ = stitch_bvp_windows(window[None, None, :], np.array([3.0]), fps=30)
+
+    np.testing.assert_allclose(signal, (window - window.mean()) / window.std())
@@ -0,0 +1,83 @@
+import asyncio
+import threading
+
+import pytest
+
+from src.embedding_service import EmbeddingService, normalize_text
+
+
+class FakeEmbeddings:
+    """Embeds a text as [len(text)], recording the batches; held by `gate` until released."""
+
+    def __init__(self, fail=False):
+        self.batches = []
+        self.fail = fail
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def embed_documents(self, texts):
+        self.gate.wait(5)
+        self.batches.append(list(texts))
+        if self.fail:
+            raise RuntimeError("model unavailable")
+        return [[float(len(text))] for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+def test_concurrent_queries_are_encoded_in_one_batch():
+    model = FakeEmbeddings()
+    service = EmbeddingService(model, batch_wait=0.2, max_batch=8)
+    futures = [service.submit(text) for text in ("a", "bb", "ccc", "  bb ")]
+
+    assert [future.result(5) for future in futures] == [[1.0], [2.0], [3.0], [2.0]]
+    assert model.batches == [["a", "bb", "ccc"]]
+    assert service.embed("ccc") == [3.0] and len(model.batches) == 1
+    assert service.info()["hits"] == 1 and service.info()["mean_batch"] == 3
+
+
+def test_batches_are_split_at_max_batch():
+    model = FakeEmbeddings()
+    model.gate.clear()  # the first batch is held, so the next queries gather behind it
+    service = EmbeddingService(model, batch_wait=0.05, max_batch=2)
+    futures = [service.submit(str(i) * (i + 1)) for i in range(5)]
+    model.gate.set()
+
+    assert [future.result(5) for future in futures] == [[float(i + 1)] for i in range(5)]
+    assert all(len(batch) <= 2 for batch in model.batches)
+    assert sorted(text for batch in model.batches for text in batch) == [str(i) * (i + 1) for i in range(5)]
+
+
+def test_failed_batch_reaches_every_caller_and_is_not_cached():
+    model = FakeEmbeddings(fail=True)
+    service = EmbeddingService(model, batch_wait=0.1)
+    futures = [service.submit(text) for text in ("a", "b")]
+
+    for future in futures:
+        with pytest.raises(RuntimeError):
+            future.result(5)
+    model.fail = False
+    assert service.embed("a") == [1.0]
+
+
+def test_cache_keeps_the_latest_entries_and_serves_aembed():
+    model = FakeEmbeddings()
+    service = EmbeddingService(model, max_entries=2, batch_wait=0)
+    for text in ("a", "bb", "ccc"):
+        service.embed(text)
+
+    assert asyncio.run(service.aembed("ccc")) == [3.0]
+    service.embed("a")
+    assert len(model.batches) == 4  # "a" was evicted
+    assert normalize_text("  two\n  words ") == "two words"
+
+
+def test_query_encoding_options_disable_batching():
+    model = FakeEmbeddings()
+    model.query_encode_kwargs = {"prompt": "query: "}
+    service = EmbeddingService(model, batch_wait=0.2)
+    futures = [service.submit(text) for text in ("a", "bb")]
+
+    assert [future.result(5) for future in futures] == [[1.0], [2.0]]
+    assert model.batches == [["a"], ["bb"]]
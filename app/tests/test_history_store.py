@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from src import history_store
+from src.history_store import METRICS, HistoryStore
+
+
+def session(rng):
+    return {"bpms": rng.uniform(60, 110), "sdnn": rng.uniform(20, 80), "rmssd": rng.uniform(15, 70),
+            "pnn50": rng.uniform(0, 40), "stress_level": rng.uniform(0, 100)}
+
+
+def test_append_and_read_back(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    first = {"bpms": 72.5, "sdnn": 41.0, "rmssd": 33.0, "pnn50": 12.0, "stress_level": 55.0}
+    second = {**first, "bpms": 80.0}
+
+    assert store.append("alice", 20, first, timestamp=1.0) == 0
+    assert store.append("bob", 21, second, timestamp=2.0) == 1
+    store.append("alice", 22, second, timestamp=3.0)
+
+    sessions = store.sessions("alice")
+    assert [s["week"] for s in sessions] == [20, 22]
+    assert sessions[0] == {"week": 20, "time": 1.0, **first}
+    assert store.sessions("alice", week=22, limit=1)[0]["bpms"] == 80.0
+    assert store.sessions("carol") == [] and store.summary("carol") is None
+
+    summary = store.summary("alice")
+    assert summary["sessions"] == 2 and (summary["first_week"], summary["last_week"]) == (20, 22)
+    assert summary["metrics"]["bpms"]["mean"] == pytest.approx(76.25)
+    assert summary["metrics"]["bpms"]["trend_per_week"] == pytest.approx(3.75)
+    assert store.week_summary(21)["sessions"] == 1
+
+
+def test_grow_keeps_every_row_and_reopening_rebuilds_the_aggregates(tmp_path, monkeypatch):
+    monkeypatch.setattr(history_store, "HISTORY_INITIAL_ROWS", 4)
+    rng = np.random.default_rng(0)
+    store = HistoryStore(str(tmp_path))
+    rows = [(f"user{i % 3}", 10 + i % 7, session(rng)) for i in range(21)]
+    for user_id, week, values in rows:
+        store.append(user_id, week, values)
+
+    assert store.info() == {"sessions": 21, "users": 3, "capacity": 32}
+    reopened = HistoryStore(str(tmp_path))
+    for user_id in ("user0", "user1", "user2"):
+        assert reopened.sessions(user_id) == store.sessions(user_id)
+        assert reopened.summary(user_id) == store.summary(user_id)
+        expected = np.mean([np.float32(v["sdnn"]) for u, _, v in rows if u == user_id])
+        assert store.summary(user_id)["metrics"]["sdnn"]["mean"] == pytest.approx(expected, abs=0.01)
+    assert reopened.week_summary(12) == store.week_summary(12)
+
+
+@pytest.mark.parametrize("change", [{"sdnn": None}, {"rmssd": float("nan")}, {"pnn50": "high"},
+                                    {"stress_level": float("inf")}])
+def test_invalid_metrics_are_rejected_without_a_row(tmp_path, change):
+    store = HistoryStore(str(tmp_path))
+    values = {**session(np.random.default_rng(1)), **change}
+
+    with pytest.raises(ValueError):
+        store.append("alice", 20, values)
+    assert store.info()["sessions"] == 0 and store.sessions("alice") == []
+
+
+def test_invalid_user_or_week_is_rejected(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    values = {m: 1.0 for m in METRICS}
+
+    for user_id, week in (("", 20), ("a\nb", 20), ("alice", -1), ("alice", history_store.MAX_WEEK)):
+        with pytest.raises(ValueError):
+            store.append(user_id, week, values)
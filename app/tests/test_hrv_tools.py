@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+from src.hrv_tools import OnlineHRV, hrv_metrics, hrv_metrics_batch
+
+
+def reference(nni):
+    """Definitions of pyhrv.time_domain, one sequence at a time."""
+    nni = np.asarray(nni, dtype=np.float64)
+    diffs = np.diff(nni)
+    return {
+        'nni_counter': len(nni),
+        'nni_mean': nni.mean(),
+        'hr_mean': (60000.0 / nni).mean(),
+        'sdnn': nni.std(ddof=1),
+        'rmssd': np.sqrt(np.mean(diffs ** 2)),
+        'nn50': int(np.sum(np.abs(diffs) > 50)),
+        'pnn50': np.sum(np.abs(diffs) > 50) / len(diffs) * 100,
+    }
+
+
+def test_batch_matches_the_reference_for_sequences_of_different_lengths():
+    rng = np.random.default_rng(0)
+    seqs = [rng.normal(800, 60, size=n) for n in (2, 3, 17, 250)]
+
+    batch = hrv_metrics_batch(seqs)
+
+    for i, seq in enumerate(seqs):
+        for name, value in reference(seq).items():
+            assert batch[name][i] == pytest.approx(value, rel=1e-9), name
+
+
+def test_metrics_without_enough_intervals_are_nan():
+    batch = hrv_metrics_batch([[], [812.0], [800.0, 900.0]])
+
+    for name in ('sdnn', 'rmssd', 'pnn50'):
+        assert np.isnan(batch[name][:2]).all()
+    assert batch['nni_counter'].tolist() == [0, 1, 2]
+    assert batch['pnn50'][2] == 100.0
+
+
+def test_single_sequence_gives_python_numbers():
+    metrics = hrv_metrics(np.array([800.0, 860.0, 790.0]))
+
+    assert all(isinstance(value, (int, float)) for value in metrics.values())
+    assert metrics['nn50'] == 2
+
+
+def test_online_matches_the_batch_kernel():
+    rng = np.random.default_rng(1)
+    nni = rng.normal(800, 80, size=120)
+
+    online = OnlineHRV().extend(nni).result()
+
+    for name, value in hrv_metrics(nni).items():
+        assert online[name] == pytest.approx(value, rel=1e-9), name
+
+
+@pytest.mark.parametrize("window", [2, 5, 30])
+def test_online_window_evicts_the_oldest_intervals(window):
+    rng = np.random.default_rng(2)
+    nni = rng.normal(800, 80, size=200)
+    online = OnlineHRV(window=window)
+
+    for i, value in enumerate(nni):
+        online.update(value)
+        assert len(online) == min(i + 1, window)
+        expected = hrv_metrics(nni[max(0, i + 1 - window):i + 1])
+        for name, metric in online.result().items():
+            if np.isnan(expected[name]):
+                assert np.isnan(metric), name
+            else:
+                assert metric == pytest.approx(expected[name], rel=1e-6, abs=1e-9), name
+
+
+def test_online_reset_forgets_every_interval():
+    online = OnlineHRV(window=10).extend([800.0, 900.0, 700.0])
+    online.reset()
+
+    assert len(online) == 0
+    assert np.isnan(online.result()['sdnn'])
+    assert online.extend([800.0, 860.0]).result()['nn50'] == 1
@@ -0,0 +1,123 @@
+import asyncio
+
+import pytest
+
+from src.job_queue import JobQueue, QueueFullError
+
+
+class Unusable(Exception):
+    expected = True
+
+
+def run_queue(test, **kwargs):
+    async def main():
+        queue = JobQueue(**{"concurrency": 1, "max_queued": 2, "deadline": 5, "result_ttl": 60, **kwargs})
+        await queue.start()
+        try:
+            await test(queue)
+        finally:
+            await queue.close()
+
+    asyncio.run(main())
+
+
+def test_jobs_run_in_order_within_the_concurrency():
+    async def test(queue):
+        order, finished = [], []
+
+        def job(i):
+            async def run():
+                order.append(("start", i, queue.running))
+                await asyncio.sleep(0.01)
+                return i * 10
+            return run
+
+        jobs = [queue.submit(job(i), on_finish=lambda i=i: finished.append(i)) for i in range(3)]
+        for job in jobs:
+            await queue.wait(job)
+
+        assert [job.result for job in jobs] == [0, 10, 20]
+        assert order == [("start", 0, 1), ("start", 1, 1), ("start", 2, 1)]
+        assert finished == [0, 1, 2]
+        assert queue.stats["done"] == 3
+
+    run_queue(test, max_queued=3)
+
+
+def test_full_queue_refuses_with_a_retry_hint():
+    async def test(queue):
+        async def blocked():
+            await asyncio.Event().wait()  # until the queue is closed
+
+        queue.submit(blocked)
+        await asyncio.sleep(0)  # taken by the runner
+        queue.submit(blocked)
+        queue.submit(blocked)
+
+        assert queue.is_full()
+        with pytest.raises(QueueFullError) as error:
+            queue.submit(blocked)
+        assert error.value.retry_after >= 1 and queue.stats["rejected"] == 1
+
+    run_queue(test)
+
+
+def test_failures_deadlines_and_cleanup():
+    async def test(queue):
+        finished = []
+
+        async def fail():
+            raise RuntimeError("boom")
+
+        async def unusable():
+            raise Unusable("no face")
+
+        async def slow():
+            await asyncio.sleep(10)
+
+        jobs = {name: queue.submit(run, deadline=0.2, on_finish=lambda name=name: finished.append(name))
+                for name, run in (("fail", fail), ("unusable", unusable), ("slow", slow), ("late", slow))}
+        for job in jobs.values():
+            await queue.wait(job)
+
+        assert {name: job.status for name, job in jobs.items()} == {
+            "fail": "failed", "unusable": "unusable", "slow": "expired", "late": "expired"}
+        assert jobs["fail"].error == "boom"
+        assert jobs["late"].error == "Deadline exceeded while queued"
+        assert sorted(finished) == ["fail", "late", "slow", "unusable"]
+
+    run_queue(test, max_queued=4)
+
+
+def test_partial_results_are_published_while_running():
+    async def test(queue):
+        proceed = asyncio.Event()
+
+        async def run():
+            job.report(bpms=72.0)
+            await proceed.wait()
+            return {"bpms": 72.0, "sdnn": 40.0}
+
+        job = queue.submit(run)
+        seen = job.version
+        assert await job.wait_change(since=seen, timeout=1)
+        while not job.partial:
+            await job.wait_change(timeout=1)
+        assert job.partial == {"bpms": 72.0} and job.status == "running"
+        proceed.set()
+        await queue.wait(job)
+        assert job.snapshot()["results"] == {"bpms": 72.0, "sdnn": 40.0}
+
+    run_queue(test)
+
+
+def test_completed_jobs_are_pollable_until_their_ttl(monkeypatch):
+    async def test(queue):
+        job = queue.completed({"bpms": 70.0})
+        assert queue.get(job.id) is job and job.status == "done"
+
+        monkeypatch.setattr("src.job_queue.time.time", lambda: job.finished_at + 1)
+        queue.completed({})
+        assert queue.get(job.id) is None
+
+    run_queue(test, result_ttl=0.5)
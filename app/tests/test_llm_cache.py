@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+
+from src.llm_cache import LLMResponseCache
+
+
+class Upstream:
+    """Stand-in for the LLM: counts calls and streams its chunks once released."""
+
+    def __init__(self, chunks=("a", "b", "c"), error=None):
+        self.chunks = chunks
+        self.error = error
+        self.calls = 0
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.calls += 1
+        await self.release.wait()
+        for chunk in self.chunks:
+            yield chunk
+            await asyncio.sleep(0)
+        if self.error is not None:
+            raise self.error
+
+
+async def collect(cache, key, produce):
+    return [chunk async for chunk in cache.astream(key, produce)]
+
+
+def test_concurrent_requests_share_one_upstream_call():
+    async def main():
+        cache = LLMResponseCache(ttl=60, max_entries=8, bins={})
+        upstream = Upstream()
+        requests = [asyncio.create_task(collect(cache, "k", upstream)) for _ in range(5)]
+        await asyncio.sleep(0)
+        upstream.release.set()
+        results = await asyncio.gather(*requests)
+
+        assert upstream.calls == 1
+        assert results == [["a", "b", "c"]] * 5
+        assert cache.stats["coalesced"] == 4
+        assert await collect(cache, "k", upstream) == ["a", "b", "c"]
+        assert upstream.calls == 1 and cache.stats["hits"] == 1
+
+    asyncio.run(main())
+
+
+def test_failed_call_reaches_every_waiter_and_is_not_cached():
+    async def main():
+        cache = LLMResponseCache(ttl=60, max_entries=8, bins={})
+        upstream = Upstream(error=RuntimeError("upstream down"))
+        requests = [asyncio.create_task(collect(cache, "k", upstream)) for _ in range(3)]
+        await asyncio.sleep(0)
+        upstream.release.set()
+        results = await asyncio.gather(*requests, return_exceptions=True)
+
+        assert all(isinstance(result, RuntimeError) for result in results)
+        assert cache.get("k") is None and cache.info()["in_flight"] == 0
+
+        retry = Upstream()
+        retry.release.set()
+        assert await collect(cache, "k", retry) == ["a", "b", "c"]
+
+    asyncio.run(main())
+
+
+def test_call_is_cached_when_the_request_that_started_it_goes_away():
+    async def main():
+        cache = LLMResponseCache(ttl=60, max_entries=8, bins={})
+        upstream = Upstream()
+        request = asyncio.create_task(collect(cache, "k", upstream))
+        await asyncio.sleep(0)
+        request.cancel()
+        upstream.release.set()
+        with pytest.raises(asyncio.CancelledError):
+            await request
+        while cache.info()["in_flight"]:
+            await asyncio.sleep(0)
+
+        assert cache.get("k") == ["a", "b", "c"]
+
+    asyncio.run(main())
+
+
+def test_entries_expire_and_the_least_recently_used_is_evicted(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("src.llm_cache.time.time", lambda: now[0])
+    cache = LLMResponseCache(ttl=10, max_entries=2, bins={})
+    cache.put("a", ["1"])
+    cache.put("b", ["2"])
+    cache.get("a")
+    cache.put("c", ["3"])
+
+    assert cache.get("b") is None
+    assert cache.get("a") == ["1"] and cache.get("c") == ["3"]
+    now[0] += 11
+    assert cache.get("a") is None and cache.stats["expired"] == 1
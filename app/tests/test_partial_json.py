@@ -0,0 +1,58 @@
+import pytest
+
+from src.partial_json import PartialObjectParser, parse_object
+
+ANSWER = ('```json\n{"stress_management": "Try "box breathing", it\'s easy.", '
+          '\'physical_activity\': \'Walk 20 minutes, don\'t rush.\', "sleep": "Aim for 8 hours"}\n```')
+EXPECTED = {
+    "stress_management": 'Try "box breathing", it\'s easy.',
+    "physical_activity": "Walk 20 minutes, don't rush.",
+    "sleep": "Aim for 8 hours",
+}
+
+
+def feed_in_chunks(text, size):
+    parser = PartialObjectParser()
+    completed = []
+    for i in range(0, len(text), size):
+        completed += parser.feed(text[i:i + size])
+    completed += parser.close()
+    return parser, completed
+
+
+def test_embedded_quotes_and_apostrophes():
+    assert parse_object(ANSWER) == EXPECTED
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 7, 13, len(ANSWER)])
+def test_chunk_boundaries_do_not_change_the_result(size):
+    parser, completed = feed_in_chunks(ANSWER, size)
+
+    assert parser.members == EXPECTED
+    assert completed == list(EXPECTED.items())
+    assert parser.done
+
+
+def test_member_is_reported_once_the_next_key_is_seen():
+    parser = PartialObjectParser()
+
+    assert parser.feed('{"nutrition": "Eat "more" greens", "sl') == []
+    assert parser.feed('eep": "Rest"') == [("nutrition", 'Eat "more" greens')]
+    assert parser.feed("}") == [("sleep", "Rest")]
+
+
+def test_quote_followed_by_comma_and_plain_text_stays_in_the_string():
+    assert parse_object('{"tip": "Say "no", then "yes", calmly"}') == {"tip": 'Say "no", then "yes", calmly'}
+
+
+def test_nested_values_and_escapes():
+    text = '{"a": [1, "x, y"], "b": {"c": "d"}, "e": "line\\nbreak \\"q\\""}'
+
+    assert parse_object(text) == {"a": [1, "x, y"], "b": {"c": "d"}, "e": 'line\nbreak "q"'}
+
+
+def test_unterminated_answer_is_parsed_as_far_as_possible():
+    parser = PartialObjectParser()
+    parser.feed('{"sleep": "Rest well"')
+
+    assert parser.close() == [("sleep", "Rest well")]
@@ -0,0 +1,58 @@
+import os
+
+from src.result_cache import ResultCache, make_cache_key
+
+RESULT = {"bpms": 74.2, "sdnn": 41.5, "rmssd": 30.1, "pnn50": 9.0, "stress_level": 61.3}
+
+
+def test_cache_key_covers_the_video_and_every_parameter():
+    params = {"version": 2, "vhr": {"winsize": 6, "method": "cupy_CHROM"}}
+
+    key = make_cache_key("ab" * 32, params)
+
+    assert key == make_cache_key("ab" * 32, {"vhr": {"method": "cupy_CHROM", "winsize": 6}, "version": 2})
+    assert key != make_cache_key("cd" * 32, params)
+    assert key != make_cache_key("ab" * 32, {**params, "vhr": {"winsize": 8, "method": "cupy_CHROM"}})
+
+
+def test_memory_level_falls_back_to_disk_and_survives_a_restart(tmp_path):
+    cache = ResultCache(str(tmp_path), max_memory_entries=1)
+    cache.put("a", RESULT)
+    cache.put("b", {**RESULT, "bpms": 80.0})
+
+    assert cache.get("a") == RESULT
+    assert cache.stats["disk_hits"] == 1
+    assert cache.get("a") == RESULT and cache.stats["memory_hits"] == 1
+    assert cache.get("missing") is None and cache.stats["misses"] == 1
+
+    restarted = ResultCache(str(tmp_path))
+    assert restarted.get("b") == {**RESULT, "bpms": 80.0}
+    assert restarted.info()["disk_bytes"] == cache.info()["disk_bytes"]
+
+
+def test_disk_level_evicts_the_least_recently_used_files(tmp_path):
+    entry_size = len(b'{"bpms": 74.2, "sdnn": 41.5, "rmssd": 30.1, "pnn50": 9.0, "stress_level": 61.3}')
+    cache = ResultCache(str(tmp_path), max_memory_entries=0, max_disk_bytes=3 * entry_size)
+    for i, key in enumerate("abc"):
+        cache.put(key, RESULT)
+        os.utime(tmp_path / f"{key}.json", (1000 + i, 1000 + i))
+    os.utime(tmp_path / "a.json", (2000, 2000))  # used last
+
+    cache.put("d", RESULT)  # over budget: back to 90% of it, so two files go
+
+    assert sorted(os.listdir(tmp_path)) == ["a.json", "d.json"]
+    assert cache.info()["disk_bytes"] == 2 * entry_size and cache.stats["evictions"] == 2
+
+
+def test_corrupt_file_is_a_miss(tmp_path):
+    (tmp_path / "bad.json").write_text("{not json")
+
+    assert ResultCache(str(tmp_path)).get("bad") is None
+
+
+def test_memory_only_without_a_directory():
+    cache = ResultCache(None, max_memory_entries=2)
+    cache.put("a", RESULT)
+
+    assert cache.get("a") == RESULT
+    assert cache.info()["disk_bytes"] == 0
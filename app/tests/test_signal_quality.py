@@ -0,0 +1,12 @@
+import pickle
+
+from src.signal_quality import SignalQualityError
+
+
+def test_signal_quality_error_survives_pickling():
+    error = pickle.loads(pickle.dumps(SignalQualityError("face too dark")))
+
+    assert isinstance(error, SignalQualityError)
+    assert error.reason == "face too dark"
+    assert str(error) == "Unusable video: face too dark"
+    assert error.expected